@@ -0,0 +1,198 @@
+"""Compare concurrent slow uploads and status polling under gunicorn (WSGI) and uvicorn (ASGI).
+
+Each server runs as a subprocess against a throwaway database, media
+directory and in-memory broker (no Celery worker, uploads stay PENDING).
+Simulated clients trickle a multipart upload in chunks, as slow mobile
+clients do, then poll the status endpoint. gunicorn is started as in
+render.yaml; uvicorn serves jpgtopdf/asgi.py, which selects the async views.
+
+Run from the project root:
+    python -m benchmarks.bench_concurrency --clients 200
+    python -m benchmarks.bench_concurrency --clients 1000 --chunk-delay 0.5 --servers asgi
+    python -m benchmarks.bench_concurrency --workers 4
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+SETTINGS = '''from jpgtopdf.settings import *
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+DATABASES = {{'default': {{
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': {database!r},
+    'OPTIONS': {{'timeout': 30}},
+}}}}
+MEDIA_ROOT = {media!r}
+CELERY_BROKER_URL = 'memory://localhost/'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+'''
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, port, workers):
+    if kind == 'wsgi':
+        return ['gunicorn', 'jpgtopdf.wsgi:application', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    return [sys.executable, '-m', 'uvicorn', 'jpgtopdf.asgi:application',
+            '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+
+
+def make_image():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), 'red').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def multipart(image):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="email"\r\n\r\nbench@example.com\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="jpeg_file"; filename="bench.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+    return f'multipart/form-data; boundary={boundary}', body
+
+
+async def request(port, method, path, body=b'', content_type=None, chunks=1, chunk_delay=0.0):
+    """Send one HTTP/1.1 request, trickling the body in ``chunks`` pieces; return (status, body)."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        headers = f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\nContent-Length: {len(body)}\r\n'
+        if content_type:
+            headers += f'Content-Type: {content_type}\r\n'
+        writer.write((headers + '\r\n').encode())
+        size = -(-len(body) // chunks) if body else 0
+        for i in range(chunks if body else 0):
+            writer.write(body[i * size:(i + 1) * size])
+            await writer.drain()
+            if chunk_delay and i < chunks - 1:
+                await asyncio.sleep(chunk_delay)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), payload
+
+
+async def client(port, args, content_type, body, results):
+    start = time.perf_counter()
+    try:
+        code, payload = await asyncio.wait_for(
+            request(port, 'POST', '/api/converter/upload/', body, content_type, args.chunks, args.chunk_delay),
+            args.timeout,
+        )
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+        results['errors'] += 1
+        return
+    if code != 201:
+        results['errors'] += 1
+        return
+    results['upload'].append(time.perf_counter() - start)
+    upload_id = json.loads(payload)['id']
+
+    for _ in range(args.polls):
+        await asyncio.sleep(args.poll_interval)
+        start = time.perf_counter()
+        try:
+            code, _ = await asyncio.wait_for(
+                request(port, 'GET', f'/api/converter/status/{upload_id}/'), args.timeout,
+            )
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            code = None
+        if code == 200:
+            results['status'].append(time.perf_counter() - start)
+        else:
+            results['errors'] += 1
+
+
+async def run_clients(port, args, content_type, body):
+    results = {'upload': [], 'status': [], 'errors': 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, args, content_type, body, results) for _ in range(args.clients)))
+    results['wall'] = time.perf_counter() - start
+    return results
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Server exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server did not listen on {port} within {timeout}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', default='wsgi,asgi', help='Comma separated: wsgi, asgi')
+    parser.add_argument('--clients', type=int, default=100, help='Concurrent simulated clients')
+    parser.add_argument('--chunks', type=int, default=10, help='Pieces each upload body is sent in')
+    parser.add_argument('--chunk-delay', type=float, default=0.2, help='Seconds between body pieces')
+    parser.add_argument('--polls', type=int, default=3, help='Status requests per client after the upload')
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=1, help='Server processes (render.yaml runs one)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds before a request counts as failed')
+    args = parser.parse_args()
+
+    content_type, body = multipart(make_image())
+    print(f"{'server':>6} {'uploads':>8} {'errors':>7} {'upload p50':>11} {'p95':>8} {'p99':>8} "
+          f"{'status p50':>11} {'p95':>8} {'wall':>7}")
+    for kind in args.servers.split(','):
+        workdir = tempfile.mkdtemp(prefix='bench-concurrency-')
+        with open(os.path.join(workdir, 'bench_settings.py'), 'w') as f:
+            f.write(SETTINGS.format(database=os.path.join(workdir, 'db.sqlite3'), media=os.path.join(workdir, 'media')))
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='bench_settings',
+            PYTHONPATH=os.pathsep.join([workdir, os.getcwd(), os.environ.get('PYTHONPATH', '')]),
+        )
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '-v', '0'], env=env, check=True)
+        port = free_port()
+        process = subprocess.Popen(server_command(kind, port, args.workers), env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port, process)
+            results = asyncio.run(run_clients(port, args, content_type, body))
+        finally:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        def ms(values, fraction):
+            value = percentile(values, fraction)
+            return f'{value * 1000:.0f}ms' if value is not None else '-'
+
+        print(f"{kind:>6} {len(results['upload']):>8} {results['errors']:>7} "
+              f"{ms(results['upload'], 0.5):>11} {ms(results['upload'], 0.95):>8} {ms(results['upload'], 0.99):>8} "
+              f"{ms(results['status'], 0.5):>11} {ms(results['status'], 0.95):>8} {results['wall']:>6.1f}s")
+
+
+if __name__ == '__main__':
+    main()
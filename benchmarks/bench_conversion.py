@@ -0,0 +1,189 @@
+"""Benchmark the conversion engine across formats, image sizes and engines.
+
+A reproducible corpus is generated once into ``--corpus-dir`` and every case
+runs in a fresh process, so peak RSS is measured per case. Results are
+written as JSON and, when a baseline is given, compared against it.
+
+Run from the project root:
+    python -m benchmarks.bench_conversion --output results.json
+    python -m benchmarks.bench_conversion --baseline benchmarks/baseline.json
+    python -m benchmarks.bench_conversion --update-baseline benchmarks/baseline.json
+"""
+from PIL import Image
+from converter.conversion import convert_to_pdf
+import argparse
+import numpy as np
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+FORMATS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'BMP': '.bmp',
+    'TIFF': '.tiff',
+}
+
+# Megapixels, rendered as 4:3 images
+SIZES = [0.3, 2, 12, 50, 100]
+QUICK_SIZES = [0.3, 2, 12]
+
+# Engine name -> convert_to_pdf keyword arguments
+ENGINES = {
+    'balanced': {'preset': 'balanced'},
+    'smallest': {'preset': 'smallest'},
+    'lossless': {'preset': 'lossless'},
+    'document': {'preset': 'balanced', 'document_mode': True},
+}
+
+METRICS = ('wall_seconds', 'cpu_seconds', 'peak_rss_bytes', 'output_bytes')
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), 'jpgtopdf-bench-corpus')
+
+
+def dimensions(megapixels):
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    return width, int(width * 3 / 4)
+
+
+def corpus_path(corpus_dir, format, megapixels):
+    return os.path.join(corpus_dir, f'{megapixels}mp{FORMATS[format]}')
+
+
+def generate_image(path, format, megapixels):
+    """Render a deterministic photo-like image: gradients with seeded noise."""
+    size = dimensions(megapixels)
+    gradient = Image.linear_gradient('L').resize(size)
+    radial = Image.radial_gradient('L').resize(size)
+    rng = np.random.default_rng(int(megapixels * 10))
+    noise = Image.fromarray(rng.normal(128, 40, size[::-1]).clip(0, 255).astype(np.uint8), 'L')
+    image = Image.merge('RGB', (gradient, radial, noise))
+    if format == 'GIF':
+        image = image.convert('P', palette=Image.Palette.ADAPTIVE)
+    image.save(path, format=format)
+
+
+def ensure_corpus(corpus_dir, formats, sizes):
+    os.makedirs(corpus_dir, exist_ok=True)
+    for format in formats:
+        for megapixels in sizes:
+            path = corpus_path(corpus_dir, format, megapixels)
+            if not os.path.exists(path):
+                print(f'Generating {path}', file=sys.stderr)
+                generate_image(path, format, megapixels)
+
+
+def _peak_rss_bytes():
+    # ru_maxrss survives fork and exec, so it would report the parent's peak
+    # when that is higher. VmHWM is tracked per address space.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def _run_case(path, engine, queue):
+    output = tempfile.TemporaryFile()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    convert_to_pdf(path, output, **ENGINES[engine])
+    queue.put({
+        'wall_seconds': time.perf_counter() - wall_start,
+        'cpu_seconds': time.process_time() - cpu_start,
+        'peak_rss_bytes': _peak_rss_bytes(),
+        'output_bytes': output.tell(),
+    })
+
+
+def run_case(path, engine, repeat):
+    """Run one case ``repeat`` times in fresh processes and keep the fastest run."""
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_run_case, args=(path, engine, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        runs.append(result)
+    return min(runs, key=lambda run: run['wall_seconds'])
+
+
+def compare(results, baseline, threshold):
+    """Return a list of human readable regressions of results against a baseline."""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric in METRICS:
+            if previous[metric] and result[metric] > previous[metric] * (1 + threshold):
+                change = result[metric] / previous[metric] - 1
+                regressions.append(f'{key} {metric}: {previous[metric]:.4g} -> {result[metric]:.4g} (+{change:.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--formats', default=','.join(FORMATS), help='Comma separated, default: all')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in QUICK_SIZES),
+                        help=f"Megapixels, comma separated (all: {','.join(str(s) for s in SIZES)})")
+    parser.add_argument('--engines', default='balanced', help=f"Comma separated from: {', '.join(ENGINES)}")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Compare against this results JSON and fail on regressions')
+    parser.add_argument('--update-baseline', metavar='PATH', help='Write results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed relative slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+
+    formats = args.formats.split(',')
+    sizes = [float(s) if '.' in s else int(s) for s in args.sizes.split(',')]
+    engines = args.engines.split(',')
+    ensure_corpus(args.corpus_dir, formats, sizes)
+
+    results = {}
+    print(f"{'case':>28} {'wall':>9} {'cpu':>9} {'peak rss':>10} {'output':>11}")
+    for engine in engines:
+        for format in formats:
+            for megapixels in sizes:
+                key = f'{engine}/{format}/{megapixels}mp'
+                result = run_case(corpus_path(args.corpus_dir, format, megapixels), engine, args.repeat)
+                results[key] = result
+                print(f"{key:>28} {result['wall_seconds']:>8.3f}s {result['cpu_seconds']:>8.3f}s "
+                      f"{result['peak_rss_bytes'] / 2 ** 20:>8.1f}MB {result['output_bytes']:>11}")
+
+    document = {
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.update_baseline)):
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Measure PDF size and CPU time of document mode on scanned receipts and letters.
+
+Run from the project root:
+    python -m benchmarks.bench_document_mode
+"""
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from converter.conversion import convert_to_pdf
+import argparse
+import io
+import random
+import time
+
+WORDS = 'invoice total amount due date payment thank you order item qty price tax subtotal'.split()
+
+
+def scan(image, seed):
+    """Make a clean render look scanned: tinted paper, blur, sensor noise, JPEG."""
+    rng = random.Random(seed)
+    noise = Image.effect_noise(image.size, 12).convert('RGB')
+    tint = Image.new('RGB', image.size, (rng.randint(238, 250), rng.randint(236, 248), rng.randint(225, 240)))
+    image = Image.blend(Image.composite(image, tint, image.convert('L').point(lambda v: 255 - v)), noise, 0.06)
+    image = image.filter(ImageFilter.GaussianBlur(0.6))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def render_text(size, font_size, margin, seed):
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=font_size)
+    for y in range(margin, size[1] - margin, int(font_size * 1.6)):
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+        draw.text((margin, y), line, fill=(15, 15, 20), font=font)
+    return image
+
+
+def corpus(count):
+    """Yield (name, jpeg bytes) pairs of synthetic letters, receipts and a colour control."""
+    for i in range(count):
+        yield f'letter-{i}', scan(render_text((1240, 1754), 22, 120, i), i)
+        yield f'receipt-{i}', scan(render_text((576, 1800), 18, 24, 1000 + i), 1000 + i)
+    photo = Image.radial_gradient('L').resize((1200, 900)).convert('RGB')
+    photo = Image.merge('RGB', (photo.getchannel(0), photo.point(lambda v: 255 - v).getchannel(1), photo.getchannel(2)))
+    yield 'colour-control', scan(photo, 0)
+
+
+def run(data, document_mode):
+    output = io.BytesIO()
+    start = time.process_time()
+    convert_to_pdf(io.BytesIO(data), output, document_mode=document_mode)
+    return len(output.getvalue()), time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=5, help='Letters and receipts to generate (each)')
+    args = parser.parse_args()
+
+    totals = {False: [0, 0.0], True: [0, 0.0]}
+    print(f"{'input':>16} {'colour':>10} {'document':>10} {'ratio':>6} {'cpu colour':>11} {'cpu doc':>9}")
+    for name, data in corpus(args.count):
+        results = {}
+        for document_mode in (False, True):
+            size, cpu = run(data, document_mode)
+            results[document_mode] = (size, cpu)
+            totals[document_mode][0] += size
+            totals[document_mode][1] += cpu
+        (size, cpu), (doc_size, doc_cpu) = results[False], results[True]
+        print(f'{name:>16} {size:>10} {doc_size:>10} {size / doc_size:>5.1f}x {cpu * 1000:>9.1f}ms {doc_cpu * 1000:>7.1f}ms')
+
+    (size, cpu), (doc_size, doc_cpu) = totals[False], totals[True]
+    print(f"{'total':>16} {size:>10} {doc_size:>10} {size / doc_size:>5.1f}x {cpu * 1000:>9.1f}ms {doc_cpu * 1000:>7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Compare alpha flattening against the old ``image.convert('RGB')`` path.
+
+Run from the project root:
+    python -m benchmarks.bench_flatten
+"""
+from PIL import Image, ImageDraw
+from converter.conversion import prepare_page
+import argparse
+import time
+
+SIZES = [(1920, 1080), (2560, 1440), (3840, 2160)]
+
+
+def make_screenshot(size, opaque=False):
+    """Build an RGBA screenshot-like image: opaque windows over a transparent desktop."""
+    image = Image.new('RGBA', size, (0, 0, 0, 255 if opaque else 0))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for i in range(8):
+        box = (i * width // 10, i * height // 12, i * width // 10 + width // 3, i * height // 12 + height // 3)
+        draw.rectangle(box, fill=(40 * i % 256, 90, 200, 255 if opaque else 96 + 16 * i))
+    return image
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'size':>11} {'alpha':>11} {'convert(RGB)':>13} {'prepare_page':>13}")
+    for size in SIZES:
+        for opaque in (False, True):
+            image = make_screenshot(size, opaque=opaque)
+            image.load()
+            old = best_of(lambda: image.convert('RGB'), args.repeat)
+            new = best_of(lambda: prepare_page(image), args.repeat)
+            label = 'opaque' if opaque else 'transparent'
+            print(f"{size[0]:>5}x{size[1]:<5} {label:>11} {old * 1000:>11.1f}ms {new * 1000:>11.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Measure the cold import cost of the web and worker entry points with ``-X importtime``.
+
+Each entry point is imported in a fresh interpreter. The cumulative time of
+its top-level imports is compared against a budget, and modules that must
+stay out of an entry point (Pillow and numpy in the web tier) are checked.
+Exits with code 1 when a budget is exceeded or a forbidden module shows up.
+
+Run from the project root:
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --web-budget 800 --worker-budget 1500 --top 15
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = {
+    # What a gunicorn worker imports before serving its first request
+    'web': (
+        'import django; django.setup(); '
+        'from django.core.wsgi import get_wsgi_application; get_wsgi_application(); '
+        'import jpgtopdf.urls'
+    ),
+    # What a Celery prefork child has loaded once warmed up
+    'worker': (
+        'import django; django.setup(); '
+        'from jpgtopdf.celery import app, warm_up_conversion; '
+        'app.loader.import_default_modules(); warm_up_conversion()'
+    ),
+}
+FORBIDDEN = {
+    'web': ('PIL', 'numpy'),
+    'worker': (),
+}
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure(code):
+    """Run ``code`` under -X importtime and return ``{module: (self_us, cumulative_us, depth)}``."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='jpgtopdf.settings')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per entry point, the median is reported')
+    parser.add_argument('--web-budget', type=float, default=750.0, help='Web import budget in ms')
+    parser.add_argument('--worker-budget', type=float, default=1500.0, help='Worker import budget in ms')
+    parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports to list')
+    args = parser.parse_args()
+    budgets = {'web': args.web_budget, 'worker': args.worker_budget}
+
+    failed = False
+    for entry, code in ENTRY_POINTS.items():
+        runs = [measure(code) for _ in range(args.repeat)]
+        totals = [sum(cumulative for _, cumulative, depth in run.values() if depth == 0) / 1000 for run in runs]
+        total = statistics.median(totals)
+        last = runs[-1]
+        status = 'ok' if total <= budgets[entry] else 'OVER BUDGET'
+        failed |= total > budgets[entry]
+        print(f'{entry}: {total:.0f}ms for {len(last)} modules (budget {budgets[entry]:.0f}ms) {status}')
+
+        top = sorted(
+            ((cumulative, name) for name, (_, cumulative, depth) in last.items() if depth == 0),
+            reverse=True,
+        )[:args.top]
+        for cumulative, name in top:
+            print(f'    {cumulative / 1000:>8.1f}ms  {name}')
+
+        leaked = [name for name in FORBIDDEN[entry] if name in last]
+        if leaked:
+            failed = True
+            print(f'    forbidden modules imported: {", ".join(leaked)}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Measure the speedup of threaded page encoding on a large multi-page image.
+
+A generated multi-page TIFF is converted with an increasing number of encode
+threads. Each run uses a fresh process, so peak RSS shows the effect of the
+pages-in-flight bound.
+
+Run from the project root:
+    python -m benchmarks.bench_pages --pages 50 --megapixels 2
+    python -m benchmarks.bench_pages --threads 1,2,4,8 --in-flight 4 --engine document
+"""
+from PIL import Image
+from converter.conversion import convert_to_pdf
+from .bench_conversion import DEFAULT_CORPUS_DIR, ENGINES, _peak_rss_bytes, dimensions
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+
+
+def ensure_document(path, pages, megapixels):
+    """Write a deterministic TIFF of ``pages`` photo-like pages unless it exists."""
+    if os.path.exists(path):
+        return
+    print(f'Generating {path}', file=sys.stderr)
+    size = dimensions(megapixels)
+    rng = np.random.default_rng(pages)
+    gradient = Image.linear_gradient('L').resize(size)
+    frames = [
+        Image.merge('RGB', (
+            gradient,
+            gradient.rotate(90 * (i % 4)),
+            Image.fromarray(rng.normal(128, 40, size[::-1]).clip(0, 255).astype(np.uint8), 'L'),
+        ))
+        for i in range(pages)
+    ]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frames[0].save(path, format='TIFF', save_all=True, append_images=frames[1:])
+
+
+def _run_case(path, engine, threads, in_flight, queue):
+    output = tempfile.TemporaryFile()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    convert_to_pdf(path, output, threads=threads, max_in_flight=in_flight, **ENGINES[engine])
+    queue.put({
+        'wall_seconds': time.perf_counter() - wall_start,
+        'cpu_seconds': time.process_time() - cpu_start,
+        'peak_rss_bytes': _peak_rss_bytes(),
+        'output_bytes': output.tell(),
+    })
+
+
+def run_case(path, engine, threads, in_flight, repeat):
+    """Run one thread count ``repeat`` times in fresh processes and keep the fastest run."""
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_run_case, args=(path, engine, threads, in_flight, queue))
+        process.start()
+        runs.append(queue.get())
+        process.join()
+    return min(runs, key=lambda run: run['wall_seconds'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--megapixels', type=float, default=2)
+    parser.add_argument('--threads', default=None,
+                        help='Comma separated thread counts (default: powers of two up to the core count)')
+    parser.add_argument('--in-flight', type=int, default=None, help='Pages in flight (default: 2 per thread)')
+    parser.add_argument('--engine', default='balanced', help=f"One of: {', '.join(ENGINES)}")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.threads:
+        counts = [int(count) for count in args.threads.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= (os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+    path = os.path.join(args.corpus_dir, f'{args.pages}x{args.megapixels}mp.tiff')
+    ensure_document(path, args.pages, args.megapixels)
+
+    baseline = None
+    print(f"{'threads':>7} {'wall':>9} {'cpu':>9} {'speedup':>8} {'peak rss':>10} {'output':>11}")
+    for threads in counts:
+        result = run_case(path, args.engine, threads, args.in_flight, args.repeat)
+        baseline = baseline or result['wall_seconds']
+        print(f"{threads:>7} {result['wall_seconds']:>8.3f}s {result['cpu_seconds']:>8.3f}s "
+              f"{baseline / result['wall_seconds']:>7.2f}x {result['peak_rss_bytes'] / 2 ** 20:>8.1f}MB "
+              f"{result['output_bytes']:>11}")
+
+
+if __name__ == '__main__':
+    main()
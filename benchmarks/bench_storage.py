@@ -0,0 +1,81 @@
+"""Compare write and read latency of the ephemeral upload storage against FileSystemStorage.
+
+The disk storage writes to a temporary directory under --disk-dir (the
+project directory by default, i.e. where MEDIA_ROOT lives), the ephemeral
+storage to one under --ephemeral-dir (/dev/shm by default).
+
+Run from the project root:
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --files 500 --ephemeral-dir /mnt/jpgtopdf-tmpfs
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+SIZES = [('100KB', 100 * 1024), ('1MB', 1024 * 1024), ('5MB', 5 * 1024 * 1024)]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(storage, payload, files):
+    """Save ``files`` copies of ``payload`` and read them back, returning (write, read) latencies."""
+    from django.core.files.base import ContentFile
+
+    writes, reads, names = [], [], []
+    for i in range(files):
+        content = ContentFile(payload)
+        start = time.perf_counter()
+        names.append(storage.save(f'uploads/pdf/{i:02x}/{i}.pdf', content))
+        writes.append(time.perf_counter() - start)
+    for name in names:
+        start = time.perf_counter()
+        with storage.open(name) as f:
+            f.read()
+        reads.append(time.perf_counter() - start)
+    for name in names:
+        storage.delete(name)
+    return writes, reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=200, help='Files written per size (default: 200)')
+    parser.add_argument('--disk-dir', default=os.getcwd())
+    parser.add_argument('--ephemeral-dir', default='/dev/shm')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jpgtopdf.settings')
+    import django
+    django.setup()
+    from django.core.files.storage import FileSystemStorage
+    from converter.storage import EphemeralStorage
+
+    disk_root = tempfile.mkdtemp(prefix='bench-storage-', dir=args.disk_dir)
+    ephemeral_root = tempfile.mkdtemp(prefix='bench-storage-', dir=args.ephemeral_dir)
+    storages = [
+        ('filesystem', FileSystemStorage(location=disk_root)),
+        ('ephemeral', EphemeralStorage(location=ephemeral_root, admission_wait=0)),
+    ]
+    try:
+        print(f"{'size':>6} {'storage':>11} {'write p50':>10} {'write p95':>10} {'read p50':>10} {'read p95':>10}")
+        for label, size in SIZES:
+            payload = os.urandom(size)
+            for name, storage in storages:
+                writes, reads = run(storage, payload, args.files)
+                print(
+                    f"{label:>6} {name:>11}"
+                    f" {percentile(writes, 0.5) * 1000:>8.2f}ms {percentile(writes, 0.95) * 1000:>8.2f}ms"
+                    f" {percentile(reads, 0.5) * 1000:>8.2f}ms {percentile(reads, 0.95) * 1000:>8.2f}ms"
+                )
+    finally:
+        shutil.rmtree(disk_root, ignore_errors=True)
+        shutil.rmtree(ephemeral_root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
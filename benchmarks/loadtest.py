@@ -0,0 +1,324 @@
+"""End-to-end load test: upload, queue, convert, send and status polling.
+
+Starts the Django app on a local port, an in-process Celery worker and an
+SMTP stand-in, then runs concurrent simulated clients that upload an image
+and poll the status endpoint until it reaches COMPLETED or FAILED.
+Everything uses a throwaway database and media directory.
+
+Run from the project root:
+    python -m benchmarks.loadtest --clients 20 --uploads 5
+    python -m benchmarks.loadtest --broker redis://localhost:6379/15 --concurrency 8
+    python -m benchmarks.loadtest --set PENDING_TIMEOUT_SECONDS=60 --keep-delays
+
+With a Redis broker, the report includes how much memory, how many commands
+and how many stored task results the run added to Redis. Beat's frequent sweep
+tasks are sent every --sweep-interval seconds so their result writes are
+counted too; the daily ones are not.
+"""
+import argparse
+import ast
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+TERMINAL = ('COMPLETED', 'FAILED')
+STAGES = ('upload', 'queue', 'convert', 'send', 'end_to_end')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def configure(args, workdir, smtp_port):
+    """Point the project settings at throwaway storage, the chosen broker and the SMTP sink."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jpgtopdf.settings')
+    from django.conf import settings
+
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['*']
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(workdir, 'loadtest.sqlite3'),
+        'OPTIONS': {'timeout': 30},
+    }
+    settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST = '127.0.0.1'
+    settings.EMAIL_PORT = smtp_port
+    settings.EMAIL_USE_TLS = False
+    settings.CELERY_BROKER_URL = args.broker
+    settings.CELERY_RESULT_BACKEND = 'cache+memory://' if args.broker.startswith('memory://') else args.broker
+    for assignment in args.set:
+        name, value = assignment.split('=', 1)
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        setattr(settings, name, value)
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def start_web(port):
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', port), QuietHandler)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_worker(args):
+    from jpgtopdf.celery import app
+
+    if not args.keep_delays:
+        # The task sleeps between stages so the UI can show progress, which
+        # would otherwise dominate every measurement. Only the tasks module's
+        # sleep is replaced; its clocks and the clients' polling stay real
+        import converter.tasks
+        no_sleep = types.ModuleType('time')
+        no_sleep.__dict__.update(time.__dict__)
+        no_sleep.sleep = lambda seconds: None
+        converter.tasks.time = no_sleep
+    if args.broker.startswith('memory://'):
+        # The in-memory transport polls once per second by default
+        app.conf.broker_transport_options = {'polling_interval': 0.01}
+
+    worker = app.Worker(
+        pool=args.pool,
+        concurrency=args.concurrency,
+        loglevel='WARNING',
+        without_heartbeat=True,
+        without_mingle=True,
+        without_gossip=True,
+        quiet=True,
+        redirect_stdouts=False,
+        hostname='loadtest@localhost',
+    )
+    threading.Thread(target=worker.start, daemon=True).start()
+    return worker
+
+
+def redis_snapshot(url):
+    """Memory, command count, key count and stored Celery results of the Redis behind ``url``."""
+    import redis
+    client = redis.Redis.from_url(url)
+    info = client.info()
+    return {
+        'time': time.perf_counter(),
+        'used_memory': info['used_memory'],
+        'commands': info['total_commands_processed'],
+        'keys': client.dbsize(),
+        'results': sum(1 for _ in client.scan_iter('celery-task-meta-*', count=1000)),
+    }
+
+
+def redis_report(before, after, uploads):
+    elapsed = after['time'] - before['time']
+    commands = after['commands'] - before['commands']
+    return {
+        'used_memory_delta_bytes': after['used_memory'] - before['used_memory'],
+        'commands': commands,
+        'commands_per_second': commands / elapsed if elapsed else None,
+        'commands_per_upload': commands / uploads if uploads else None,
+        'keys_delta': after['keys'] - before['keys'],
+        'result_keys_delta': after['results'] - before['results'],
+    }
+
+
+def start_sweeps(interval, stop):
+    """Send beat's frequent sweeps every ``interval`` seconds until ``stop`` is set.
+
+    Daily crontab entries (purge, reconcile) are left out: one run a day does
+    not belong in a per-second load.
+    """
+    from jpgtopdf.celery import app
+
+    tasks = [entry['task'] for entry in app.conf.beat_schedule.values() if isinstance(entry['schedule'], (int, float))]
+
+    def run():
+        while not stop.wait(interval):
+            for task in tasks:
+                app.send_task(task)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def make_image():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.effect_noise((1200, 900), 40).convert('RGB').save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def post_upload(base_url, image, email):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="email"\r\n\r\n{email}\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="jpeg_file"; filename="load.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(
+        f'{base_url}/api/converter/upload/',
+        data=body,
+        headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def get_status(base_url, upload_id):
+    with urllib.request.urlopen(f'{base_url}/api/converter/status/{upload_id}/') as response:
+        return json.load(response)['status']
+
+
+def run_upload(base_url, image, poll_interval, timeout):
+    """Upload once and poll until done, returning the time each status was first seen."""
+    start = time.perf_counter()
+    upload_id = post_upload(base_url, image, f'load-{uuid.uuid4().hex[:8]}@example.com')['id']
+    seen = {'uploaded': time.perf_counter() - start}
+    status = 'PENDING'
+    while status not in TERMINAL and time.perf_counter() - start < timeout:
+        time.sleep(poll_interval)
+        status = get_status(base_url, upload_id)
+        seen.setdefault(status, time.perf_counter() - start)
+    seen['final'] = status
+    return seen
+
+
+def stage_durations(seen):
+    """Split one upload's status timeline into per-stage durations."""
+    uploaded = seen['uploaded']
+    converting = seen.get('CONVERTING', seen.get('SENDING', seen.get(seen['final'])))
+    sending = seen.get('SENDING', seen.get(seen['final']))
+    done = seen.get(seen['final'])
+    durations = {'upload': uploaded}
+    if done is not None:
+        durations['end_to_end'] = done
+        if converting is not None:
+            durations['queue'] = converting - uploaded
+        if converting is not None and sending is not None:
+            durations['convert'] = sending - converting
+        if sending is not None:
+            durations['send'] = done - sending
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=10, help='Concurrent simulated clients')
+    parser.add_argument('--uploads', type=int, default=3, help='Uploads per client')
+    parser.add_argument('--broker', default='memory://localhost/', help='Celery broker URL (default: in-memory)')
+    parser.add_argument('--pool', default='threads', choices=('threads', 'solo'))
+    parser.add_argument('--concurrency', type=int, default=4, help='Celery worker concurrency')
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=120.0, help='Give up on an upload after this long')
+    parser.add_argument('--port', type=int, default=0, help='Web server port (default: any free port)')
+    parser.add_argument('--keep-delays', action='store_true',
+                        help='Keep the demo sleeps between task stages')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='Override a Django setting, may be repeated')
+    parser.add_argument('--sweep-interval', type=float, default=1.0,
+                        help="Seconds between sends of beat's frequent sweeps, 0 to disable (default: 1)")
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    from .smtp_sink import SMTPSink
+
+    workdir = tempfile.mkdtemp(prefix='jpgtopdf-loadtest-')
+    smtp = SMTPSink().start()
+    configure(args, workdir, smtp.port)
+    web = start_web(args.port)
+    start_worker(args)
+    base_url = f'http://127.0.0.1:{web.server_address[1]}'
+    image = make_image()
+
+    total = args.clients * args.uploads
+    print(f'Running {total} uploads from {args.clients} clients against {base_url}', file=sys.stderr)
+    use_redis = args.broker.startswith(('redis://', 'rediss://'))
+    redis_before = redis_snapshot(args.broker) if use_redis else None
+    stop_sweeps = threading.Event()
+    if args.sweep_interval:
+        start_sweeps(args.sweep_interval, stop_sweeps)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        timelines = list(pool.map(
+            lambda _: run_upload(base_url, image, args.poll_interval, args.timeout),
+            range(total),
+        ))
+    elapsed = time.perf_counter() - started
+    stop_sweeps.set()
+
+    outcomes = {}
+    for seen in timelines:
+        outcomes[seen['final']] = outcomes.get(seen['final'], 0) + 1
+    samples = {stage: [] for stage in STAGES}
+    for seen in timelines:
+        for stage, duration in stage_durations(seen).items():
+            samples[stage].append(duration)
+
+    report = {
+        'uploads': total,
+        'clients': args.clients,
+        'elapsed_seconds': elapsed,
+        'throughput_per_second': outcomes.get('COMPLETED', 0) / elapsed,
+        'outcomes': outcomes,
+        'emails_received': smtp.messages,
+        'stages': {
+            stage: {
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+            }
+            for stage, values in samples.items()
+        },
+    }
+    if use_redis:
+        # Let the last sweeps and results land before the second snapshot
+        time.sleep(max(args.sweep_interval, 1.0))
+        report['redis'] = redis_report(redis_before, redis_snapshot(args.broker), total)
+
+    print(f"{total} uploads in {elapsed:.1f}s, {report['throughput_per_second']:.2f} completed/s, outcomes: {outcomes}")
+    print(f"{'stage':>12} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, values in report['stages'].items():
+        if values['p50'] is not None:
+            print(f"{stage:>12} {values['p50']:>8.3f}s {values['p95']:>8.3f}s {values['p99']:>8.3f}s")
+    if use_redis:
+        redis_stats = report['redis']
+        print(
+            f"redis: {redis_stats['used_memory_delta_bytes'] / 1024:+.1f} KiB memory, "
+            f"{redis_stats['commands']} commands ({redis_stats['commands_per_second']:.0f}/s, "
+            f"{redis_stats['commands_per_upload']:.1f} per upload), "
+            f"{redis_stats['result_keys_delta']:+d} stored results, {redis_stats['keys_delta']:+d} keys"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    web.shutdown()
+    smtp.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,186 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Count, Q
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from datetime import timedelta
+from .models import ImageUpload, WebhookDeadLetter
+from .tasks import deliver_webhook, requeue_failed_uploads
 
-# Register your models here.
+CURSOR_VAR = 'after'
+DASHBOARD_CACHE_KEY = 'converter.admin.dashboard'
+
+
+def estimated_count(queryset):
+    """Count rows without scanning a large table.
+
+    Unfiltered querysets on PostgreSQL use the planner's row estimate.
+    Everything else is counted up to ADMIN_COUNT_LIMIT rows.
+    """
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is -1 until the table has been analyzed
+        if row and row[0] >= 0:
+            return int(row[0])
+    return queryset.order_by()[:settings.ADMIN_COUNT_LIMIT].count()
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+class KeysetChangeList(ChangeList):
+    """Change list paged by a (timestamp, id) cursor instead of OFFSET.
+
+    Every page is an index range scan from the cursor, so late pages cost the
+    same as the first one. The cursor of the last row shown is passed as
+    ``?after=`` to get the next page.
+    """
+
+    def get_results(self, request):
+        queryset = self.queryset.order_by('-timestamp', '-id')
+        cursor = getattr(request, 'upload_cursor', None)
+        if cursor:
+            timestamp, pk = cursor
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+        page = list(queryset[:self.list_per_page + 1])
+
+        last = page[self.list_per_page - 1] if len(page) > self.list_per_page else None
+        self.next_url = self.get_query_string({CURSOR_VAR: f'{last.timestamp.isoformat()}_{last.id}'}) if last else None
+        self.first_url = self.get_query_string(remove=[CURSOR_VAR]) if cursor else None
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.count_is_estimate = self.result_count >= settings.ADMIN_COUNT_LIMIT
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = page[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = bool(self.next_url or self.first_url)
+
+
+@admin.register(ImageUpload)
+class ImageUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'email', 'timestamp', 'status', 'preset', 'error_message')
+    list_filter = ('status',)
+    show_facets = admin.ShowFacets.NEVER
+    # Exact match only, so the email index is used instead of a LIKE scan
+    search_fields = ('=email',)
+    ordering = ('-timestamp', '-id')
+    sortable_by = ()
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    readonly_fields = ('timestamp', 'task_id', 'input_bytes', 'pdf_quality', 'pdf_scale', 'trace')
+    actions = ['reprocess_failed', 'profile_next_run']
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        if CURSOR_VAR in request.GET:
+            request.GET = request.GET.copy()
+            timestamp, _, pk = request.GET.pop(CURSOR_VAR)[0].rpartition('_')
+            parsed = parse_datetime(timestamp)
+            if parsed is not None and pk.isdigit():
+                request.upload_cursor = (parsed, int(pk))
+        return super().changelist_view(request, extra_context)
+
+    def get_urls(self):
+        return [
+            path('dashboard/', self.admin_site.admin_view(self.dashboard_view), name='converter_imageupload_dashboard'),
+        ] + super().get_urls()
+
+    def dashboard_view(self, request):
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Upload dashboard',
+            'stats': dashboard_stats(),
+        }
+        return TemplateResponse(request, 'admin/converter/imageupload/dashboard.html', context)
+
+    @admin.action(description='Reprocess selected failed uploads')
+    def reprocess_failed(self, request, queryset):
+        selected = queryset.filter(status=ImageUpload.Status.FAILED).count()
+        requeued = requeue_failed_uploads(queryset)
+        self.message_user(request, f'Requeued {requeued} failed uploads.', messages.SUCCESS)
+        if requeued < selected:
+            self.message_user(
+                request,
+                f'Skipped {selected - requeued} uploads whose image was already cleaned up.',
+                messages.WARNING,
+            )
+
+    @admin.action(description='Profile the next conversion of selected uploads')
+    def profile_next_run(self, request, queryset):
+        updated = queryset.update(profile=True)
+        self.message_user(request, f'{updated} uploads will be profiled when they are converted.', messages.SUCCESS)
+
+
+@admin.register(WebhookDeadLetter)
+class WebhookDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('id', 'upload', 'url', 'attempts', 'error', 'created')
+    list_select_related = ('upload',)
+    readonly_fields = ('upload', 'url', 'payload', 'attempts', 'error', 'created')
+    ordering = ('-created',)
+    actions = ['redeliver']
+
+    @admin.action(description='Redeliver selected webhooks')
+    def redeliver(self, request, queryset):
+        count = 0
+        for dead_letter in queryset:
+            deliver_webhook.delay(dead_letter.upload_id, dead_letter.url, dead_letter.payload)
+            dead_letter.delete()
+            count += 1
+        self.message_user(request, f'Requeued {count} webhooks.', messages.SUCCESS)
+
+
+def dashboard_stats():
+    """Per-status counts and throughput for the last hour and day.
+
+    Computed with one grouped query over the timestamp index and cached for
+    ADMIN_DASHBOARD_CACHE_SECONDS.
+    """
+    stats = cache.get(DASHBOARD_CACHE_KEY)
+    if stats is not None:
+        return stats
+
+    now = timezone.now()
+    hour_ago = now - timedelta(hours=1)
+    rows = (
+        ImageUpload.objects.filter(timestamp__gte=now - timedelta(days=1))
+        .order_by()
+        .values('status')
+        .annotate(last_day=Count('id'), last_hour=Count('id', filter=Q(timestamp__gte=hour_ago)))
+    )
+    counts = {row['status']: row for row in rows}
+    statuses = [
+        {
+            'status': label,
+            'last_hour': counts.get(value, {}).get('last_hour', 0),
+            'last_day': counts.get(value, {}).get('last_day', 0),
+        }
+        for value, label in ImageUpload.Status.choices
+    ]
+    completed = counts.get(ImageUpload.Status.COMPLETED, {})
+    stats = {
+        'generated': now,
+        'statuses': statuses,
+        'total_hour': sum(row['last_hour'] for row in statuses),
+        'total_day': sum(row['last_day'] for row in statuses),
+        'completed_per_minute': completed.get('last_hour', 0) / 60,
+        'completed_per_hour': completed.get('last_day', 0) / 24,
+    }
+    cache.set(DASHBOARD_CACHE_KEY, stats, settings.ADMIN_DASHBOARD_CACHE_SECONDS)
+    return stats
@@ -0,0 +1,422 @@
+from PIL import Image, ImageSequence
+from .formats import DEFAULT_JPEG_QUALITY, DEFAULT_PRESET, PRESETS
+from .pdf import EncodedPage, PdfWriter
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import io
+import os
+import time
+import zlib
+import numpy as np
+
+DEFAULT_RESOLUTION = 100.0
+DEFAULT_BACKGROUND = '#ffffff'
+
+# (quality, scale) steps tried when a PDF has to fit a size target,
+# ordered from the largest to the smallest expected output
+SIZE_LADDER = [
+    (95, 1.0), (85, 1.0), (75, 1.0), (65, 1.0), (55, 1.0), (45, 1.0), (35, 1.0),
+    (60, 0.75), (45, 0.75), (35, 0.75),
+    (55, 0.5), (40, 0.5), (30, 0.5),
+    (40, 0.35), (30, 0.35), (30, 0.25),
+]
+DEFAULT_MAX_SEARCH_ITERATIONS = 6
+
+# Document mode detection, evaluated on a downsampled preview
+PREVIEW_SIZE = (256, 256)
+GRAY_MAX_CHROMA = 24  # Max channel spread for a pixel to count as neutral
+GRAY_MIN_FRACTION = 0.99  # Share of neutral pixels needed to encode as grayscale
+BILEVEL_MIN_SEPARABILITY = 0.85  # Otsu between-class / total variance needed to encode as 1-bit
+
+
+ConversionResult = namedtuple('ConversionResult', ['pages', 'quality', 'scale', 'size'])
+
+
+class ConversionError(Exception):
+    """Raised when an image cannot be turned into a PDF."""
+
+
+class _SizeLimitExceeded(Exception):
+    pass
+
+
+class _LimitedBuffer(io.BytesIO):
+    """In-memory buffer that aborts the encode as soon as it grows past ``limit`` bytes."""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def write(self, data):
+        if self.tell() + len(data) > self.limit:
+            raise _SizeLimitExceeded()
+        return super().write(data)
+
+
+def probe(image):
+    """Return the metadata of an opened image that is known without decoding pixels."""
+    return {
+        'format': image.format,
+        'mode': image.mode,
+        'width': image.width,
+        'height': image.height,
+        'frames': getattr(image, 'n_frames', 1),
+    }
+
+
+def _check_frames(info, max_pages):
+    if max_pages and info['frames'] > max_pages:
+        raise ConversionError(f"Image has {info['frames']} frames, the maximum is {max_pages}")
+
+
+def has_alpha(image):
+    """Return True if the image carries an alpha channel or palette transparency."""
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def flatten(image, background=DEFAULT_BACKGROUND):
+    """Composite a transparent image onto a solid background and return it as RGB.
+
+    Fully opaque images skip the blend: the alpha extrema are checked first
+    and the channel is simply dropped when every pixel is opaque.
+    """
+    if image.mode in ('P', 'PA'):
+        image = image.convert('RGBA')
+    alpha = image.getchannel('A')
+    if alpha.getextrema()[0] == 255:
+        return image.convert('RGB')
+
+    flattened = Image.new('RGB', image.size, background)
+    flattened.paste(image, mask=alpha)
+    return flattened
+
+
+def otsu(histogram):
+    """Return the Otsu threshold of a 256-bin histogram and how well it separates the two classes.
+
+    Separability is the between-class variance divided by the total variance:
+    close to 1 for ink on paper, much lower for photographs and gradients.
+    """
+    p = histogram / histogram.sum()
+    levels = np.arange(256)
+    weight = np.cumsum(p)
+    cumulative_mean = np.cumsum(p * levels)
+    mean = cumulative_mean[-1]
+    total_variance = (p * (levels - mean) ** 2).sum()
+    if total_variance == 0:
+        return 128, 1.0
+
+    denominator = weight * (1 - weight)
+    between = np.zeros(256)
+    np.divide((mean * weight - cumulative_mean) ** 2, denominator, out=between, where=denominator > 0)
+    threshold = int(between.argmax())
+    return threshold + 1, between[threshold] / total_variance
+
+
+def classify(image):
+    """Classify a page from a downsampled preview.
+
+    Returns ``(kind, threshold)`` where kind is 'bilevel', 'gray' or 'color'
+    and threshold is the luminance cut-off to use for bilevel pages.
+    """
+    # Nearest-neighbour sampling keeps the pixel value distribution intact,
+    # averaging filters would turn crisp text edges into midtones
+    preview = image.resize(
+        (min(image.width, PREVIEW_SIZE[0]), min(image.height, PREVIEW_SIZE[1])),
+        Image.Resampling.NEAREST,
+    )
+    pixels = np.asarray(preview.convert('RGB'), dtype=np.int16).reshape(-1, 3)
+
+    chroma = pixels.max(axis=1) - pixels.min(axis=1)
+    if np.count_nonzero(chroma <= GRAY_MAX_CHROMA) < GRAY_MIN_FRACTION * len(pixels):
+        return 'color', None
+
+    histogram = np.bincount(pixels.mean(axis=1).astype(np.uint8), minlength=256)
+    threshold, separability = otsu(histogram)
+    if separability >= BILEVEL_MIN_SEPARABILITY:
+        return 'bilevel', threshold
+    return 'gray', None
+
+
+def prepare_page(frame, background=DEFAULT_BACKGROUND, document_mode=False):
+    """Convert a decoded frame into a mode the PDF encoder accepts.
+
+    In document mode, neutral pages are reduced to 8-bit grayscale and pages
+    that are mostly ink on paper to 1-bit black and white.
+    """
+    if has_alpha(frame):
+        page = flatten(frame, background)
+    elif document_mode and frame.mode in ('1', 'L'):
+        page = frame
+    elif frame.mode != 'RGB':
+        page = frame.convert('RGB')
+    else:
+        page = frame
+
+    if not document_mode:
+        return page
+
+    if page.mode == '1':
+        return page
+    kind, threshold = classify(page)
+    if kind == 'bilevel':
+        return page.convert('L').point(lambda v: 255 if v >= threshold else 0, mode='1')
+    if kind == 'gray' and page.mode != 'L':
+        return page.convert('L')
+    return page
+
+
+def encode_page(image, quality=DEFAULT_JPEG_QUALITY):
+    """Compress a prepared page into a PDF image stream.
+
+    1-bit pages are Flate compressed. Grayscale and RGB pages are stored as
+    DCT (JPEG) streams, or Flate compressed when ``quality`` is None.
+    """
+    if image.mode == '1' or quality is None:
+        bits = 1 if image.mode == '1' else 8
+        return EncodedPage(
+            width=image.width,
+            height=image.height,
+            color_space='DeviceRGB' if image.mode == 'RGB' else 'DeviceGray',
+            bits_per_component=bits,
+            filter='FlateDecode',
+            data=zlib.compress(image.tobytes()),
+        )
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return EncodedPage(
+        width=image.width,
+        height=image.height,
+        color_space='DeviceGray' if image.mode == 'L' else 'DeviceRGB',
+        bits_per_component=8,
+        filter='DCTDecode',
+        data=buffer.getvalue(),
+    )
+
+
+def scale_page(page, scale):
+    """Downscale a page by ``scale``, returning it unchanged at full scale."""
+    if scale == 1.0:
+        return page
+    size = (max(1, round(page.width * scale)), max(1, round(page.height * scale)))
+    return page.resize(size, Image.Resampling.LANCZOS)
+
+
+def _encode_frame(frame, quality, scale, background, document_mode):
+    """Prepare, scale and encode a decoded frame; returns ``(EncodedPage, seconds)``."""
+    start = time.perf_counter()
+    prepared = prepare_page(frame, background, document_mode)
+    page = scale_page(prepared, scale)
+    encoded = encode_page(page, quality)
+    if page is not prepared:
+        page.close()
+    if prepared is not frame:
+        prepared.close()
+    return encoded, time.perf_counter() - start
+
+
+def iter_pages(image, quality, scale, background, document_mode, timings=None, threads=1, max_in_flight=None):
+    """Decode, prepare and encode the frames of an opened image.
+
+    Yields an EncodedPage per frame, in frame order. With ``threads`` > 1 and
+    several frames, frames are decoded one after another but prepared and
+    encoded in a thread pool; Pillow's resampling and encoders and zlib
+    release the GIL, so pages are compressed in parallel. At most
+    ``max_in_flight`` frames (2 per thread by default) are decoded but not
+    yet yielded, which bounds memory use.
+
+    Seconds spent decoding and encoding are added to ``timings`` when given;
+    encode seconds are summed over threads.
+    """
+    if timings is None:
+        timings = {}
+    if threads <= 1 or getattr(image, 'n_frames', 1) <= 1:
+        for frame in ImageSequence.Iterator(image):
+            start = time.perf_counter()
+            frame.load()
+            timings['decode'] = timings.get('decode', 0.0) + time.perf_counter() - start
+            encoded, seconds = _encode_frame(frame, quality, scale, background, document_mode)
+            timings['encode'] = timings.get('encode', 0.0) + seconds
+            yield encoded
+        return
+
+    max_in_flight = max_in_flight or 2 * threads
+    pending = deque()
+
+    def collect():
+        encoded, seconds = pending.popleft().result()
+        timings['encode'] = timings.get('encode', 0.0) + seconds
+        return encoded
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        try:
+            for frame in ImageSequence.Iterator(image):
+                while len(pending) >= max_in_flight:
+                    yield collect()
+                start = time.perf_counter()
+                frame.load()
+                # Seeking to the next frame reuses the image, so each task gets its own copy
+                decoded = frame.copy()
+                timings['decode'] = timings.get('decode', 0.0) + time.perf_counter() - start
+                pending.append(executor.submit(_encode_frame, decoded, quality, scale, background, document_mode))
+            while pending:
+                yield collect()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def write_pdf(image, output, quality, scale, resolution, background, document_mode, timings=None,
+              threads=1, max_in_flight=None):
+    """Encode every frame of an opened image into ``output`` and return the closed writer.
+
+    The page size stays the same at any ``scale``, only the pixel density drops.
+    """
+    writer = PdfWriter(output, resolution=resolution * scale)
+    pages = iter_pages(image, quality, scale, background, document_mode, timings, threads, max_in_flight)
+    # Closing the generator on errors, e.g. a size limit hit, stops its pool right away
+    with closing(pages):
+        for page in pages:
+            writer.add_page(page)
+    writer.close()
+    return writer
+
+
+def encode_file(source, max_pages=None, background=DEFAULT_BACKGROUND, document_mode=False,
+                preset=DEFAULT_PRESET):
+    """Return the encoded pages of an image file, for assembling into a larger PDF."""
+    with Image.open(source) as image:
+        _check_frames(probe(image), max_pages)
+        return list(iter_pages(
+            image, PRESETS[preset]['quality'], PRESETS[preset]['scale'], background, document_mode,
+        ))
+
+
+def _search_size(image, output, max_bytes, candidates, max_iterations, options):
+    """Find the best (quality, scale) whose PDF fits in ``max_bytes``.
+
+    The ``candidates`` are tried first and the search stops at the first one
+    that fits. Otherwise SIZE_LADDER is binary searched for the highest
+    quality that fits, with at most ``max_iterations`` encodes in total.
+    """
+    iterations = 0
+
+    def attempt(quality, scale):
+        nonlocal iterations
+        iterations += 1
+        buffer = _LimitedBuffer(max_bytes)
+        try:
+            write_pdf(image, buffer, quality, scale, **options)
+        except _SizeLimitExceeded:
+            return None
+        return buffer
+
+    for quality, scale in candidates:
+        if iterations >= max_iterations:
+            break
+        buffer = attempt(quality, scale)
+        if buffer is not None:
+            output.write(buffer.getvalue())
+            return quality, scale, buffer.tell()
+
+    best = None
+    low, high = 0, len(SIZE_LADDER) - 1
+    while low <= high and iterations < max_iterations:
+        middle = (low + high) // 2
+        buffer = attempt(*SIZE_LADDER[middle])
+        if buffer is not None:
+            best = (middle, buffer)
+            high = middle - 1
+        else:
+            low = middle + 1
+
+    if best is None:
+        raise ConversionError(f'Could not fit the PDF into {max_bytes} bytes')
+    index, buffer = best
+    output.write(buffer.getvalue())
+    return SIZE_LADDER[index] + (buffer.tell(),)
+
+
+def convert_to_pdf(source, output, max_pages=None, resolution=DEFAULT_RESOLUTION,
+                   background=DEFAULT_BACKGROUND, document_mode=False, preset=DEFAULT_PRESET,
+                   max_bytes=None, hint=None, max_iterations=DEFAULT_MAX_SEARCH_ITERATIONS,
+                   timings=None, threads=1, max_in_flight=None):
+    """Write every frame of ``source`` as its own page of a PDF to ``output``.
+
+    Frames are decoded, encoded and written one at a time, so memory use does
+    not grow with the number of pages. Transparent areas are filled with
+    ``background``. With ``document_mode`` scanned pages are stored as
+    grayscale or black and white when their content allows it.
+
+    Pages are encoded with the quality and scale of ``preset``. When
+    ``max_bytes`` is set and the preset's output is too large, a bounded
+    search over quality and scale is run in memory, starting from ``hint``
+    (a ``(quality, scale)`` pair that worked for a similar input) if given.
+
+    Decode and encode seconds, summed over all pages and search attempts, are
+    added to the ``timings`` dict when one is passed.
+
+    Multi-frame images are encoded by ``threads`` threads with at most
+    ``max_in_flight`` decoded pages held at once; pages are still written in
+    frame order.
+    """
+    with Image.open(source) as image:
+        info = probe(image)
+        _check_frames(info, max_pages)
+
+        quality, scale = PRESETS[preset]['quality'], PRESETS[preset]['scale']
+        options = {
+            'resolution': resolution,
+            'background': background,
+            'document_mode': document_mode,
+            'timings': timings,
+            'threads': threads,
+            'max_in_flight': max_in_flight,
+        }
+        if not max_bytes:
+            writer = write_pdf(image, output, quality, scale, **options)
+            return ConversionResult(len(writer.page_ids), quality, scale, writer.position)
+
+        candidates = [(quality, scale)]
+        if hint and tuple(hint) != (quality, scale):
+            candidates.append(tuple(hint))
+        quality, scale, size = _search_size(image, output, max_bytes, candidates, max_iterations, options)
+        return ConversionResult(info['frames'], quality, scale, size)
+
+
+def convert_file(job, options):
+    """Convert a ``(source, destination)`` pair of paths, for use as a process pool task.
+
+    Returns ``(source, destination, result, error)`` instead of raising, so one
+    bad file does not stop a batch. Lives here rather than next to its callers
+    so pool workers can import it without setting up Django.
+    """
+    source, destination = job
+    try:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, 'wb') as output:
+            return source, destination, convert_to_pdf(source, output, **options), None
+    except Exception as e:
+        return source, destination, None, str(e)
+
+
+def encode_file_task(source, options):
+    """Process pool counterpart of encode_file, returning ``(source, pages, error)``."""
+    try:
+        return source, encode_file(source, **options), None
+    except Exception as e:
+        return source, None, str(e)
+
+
+def warm_up():
+    """Load Pillow's plugins and run each encoder once, so the first real conversion does not pay for it."""
+    Image.init()
+    page = Image.new('RGB', (16, 16), DEFAULT_BACKGROUND)
+    encode_page(page)
+    encode_page(page, quality=None)
+    encode_page(page.convert('1'))
+    classify(page)
@@ -0,0 +1,44 @@
+"""Emails delivering converted PDFs, for a single upload or a digest of several."""
+from django.conf import settings
+from django.core.mail import EmailMessage
+import os
+
+
+def pdf_message(uploads):
+    """Build one message to the uploads' common address with their PDFs.
+
+    PDFs are attached until EMAIL_MAX_ATTACHMENT_BYTES is reached; the rest
+    are listed as signed download links. A digest also links to a ZIP export
+    of the address's recent PDFs.
+    """
+    attached = 0
+    links = []
+    message = EmailMessage(to=[uploads[0].email], from_email=settings.DEFAULT_FROM_EMAIL)
+    for upload in uploads:
+        name = os.path.basename(upload._pdf_file.name)
+        size = upload._pdf_file.size
+        if attached + size <= settings.EMAIL_MAX_ATTACHMENT_BYTES:
+            with upload._pdf_file.open('rb') as pdf:
+                message.attach(name, pdf.read(), 'application/pdf')
+            attached += size
+        else:
+            links.append(f'{name}: {settings.PUBLIC_BASE_URL.rstrip("/")}{upload.get_download_url()}')
+
+    count = len(uploads)
+    message.subject = settings.EMAIL_SUBJECT_PREFIX + (
+        'Your PDF is ready' if count == 1 else f'Your {count} PDFs are ready'
+    )
+    lines = ['Your converted PDF is ready.' if count == 1 else f'Your {count} converted PDFs are ready.']
+    if links:
+        lines += ['', 'These were too large to attach, download them from these links:', *links]
+    if count > 1:
+        # Sent to the address itself, so this is where its export token can be handed out
+        export_url = settings.PUBLIC_BASE_URL.rstrip('/') + uploads[0].get_export_url(uploads[0].email)
+        lines += ['', f'Download all PDFs of the last {settings.FILE_CLEANUP_MINUTES} minutes as one ZIP: {export_url}']
+    message.body = '\n'.join(lines) + '\n'
+    return message
+
+
+def send_pdfs(uploads):
+    """Send the PDFs of ``uploads`` in one message; returns the number of messages sent."""
+    return pdf_message(uploads).send()
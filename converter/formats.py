@@ -0,0 +1,27 @@
+"""Output presets and supported input formats.
+
+Importable without loading Pillow's codecs or numpy, so the web tier can
+use them without paying for the conversion engine.
+"""
+from functools import cache
+
+DEFAULT_JPEG_QUALITY = 75
+
+# quality=None stores pages losslessly (Flate) instead of as JPEG
+PRESETS = {
+    'smallest': {'quality': 40, 'scale': 0.75},
+    'balanced': {'quality': DEFAULT_JPEG_QUALITY, 'scale': 1.0},
+    'lossless': {'quality': None, 'scale': 1.0},
+}
+DEFAULT_PRESET = 'balanced'
+
+
+@cache
+def supported_extensions():
+    """Return the file extensions Pillow can open, e.g. ``('.jpg', '.png', ...)``.
+
+    Pillow and its plugins are imported on the first call only.
+    """
+    from PIL import Image
+
+    return tuple(sorted(ex for ex, f in Image.registered_extensions().items() if f in Image.OPEN))
@@ -0,0 +1,108 @@
+"""Replay of upload responses for requests carrying an ``Idempotency-Key`` header.
+
+The first request with a key claims it through the unique constraint on
+IdempotencyKey.key and stores its 201 response when done. Repeats within
+IDEMPOTENCY_KEY_TTL get that response back, from the cache when possible,
+without storing the file or enqueueing again. A claim that was not finished
+within IDEMPOTENCY_LEASE_SECONDS, e.g. because its worker was killed, is
+taken over by the next request with the key.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from collections import namedtuple
+from datetime import timedelta
+from .models import IdempotencyKey
+import hashlib
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+Replay = namedtuple('Replay', ['status', 'body'])
+
+
+class IdempotencyError(Exception):
+    """Raised when a keyed request cannot be processed or replayed."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def _cache_key(key):
+    return 'converter.idempotency.' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def fingerprint(data):
+    """Hash the fields and file contents of a parsed upload request."""
+    digest = hashlib.sha256()
+    for name in sorted(data.keys()):
+        for value in data.getlist(name):
+            digest.update(name.encode() + b'\0')
+            if hasattr(value, 'chunks'):
+                for chunk in value.chunks():
+                    digest.update(chunk)
+                value.seek(0)
+            else:
+                digest.update(str(value).encode())
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def begin(key, request_hash):
+    """Claim ``key`` for a new request, returning its IdempotencyKey row, or a Replay of the stored response.
+
+    Raises IdempotencyError when the key was used with a different request
+    body (422) or when the first request with it is still in flight (409).
+    """
+    cached = cache.get(_cache_key(key))
+    if cached is not None:
+        if cached['request_hash'] != request_hash:
+            raise IdempotencyError('Idempotency-Key was already used with a different request', 422)
+        return Replay(cached['status'], cached['body'])
+
+    now = timezone.now()
+    IdempotencyKey.objects.filter(
+        Q(created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL))
+        | Q(response_status__isnull=True, created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)),
+        key=key,
+    ).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, request_hash=request_hash)
+    except IntegrityError:
+        existing = IdempotencyKey.objects.filter(key=key).first()
+    if existing is None or existing.response_status is None:
+        raise IdempotencyError('A request with this Idempotency-Key is still being processed', 409)
+    if existing.request_hash != request_hash:
+        raise IdempotencyError('Idempotency-Key was already used with a different request', 422)
+    _cache(existing)
+    return Replay(existing.response_status, existing.response_body)
+
+
+def finish(record, status, body):
+    """Store the response of the request that claimed ``record``, unless its lease was taken over."""
+    record.response_status = status
+    record.response_body = body
+    record.upload_id = body.get('id')
+    if IdempotencyKey.objects.filter(pk=record.pk).update(
+        response_status=status, response_body=body, upload_id=record.upload_id,
+    ):
+        _cache(record)
+
+
+def release(record):
+    """Give up a claimed key after a failed request so the client can retry with it."""
+    record.delete()
+
+
+def _cache(record):
+    remaining = settings.IDEMPOTENCY_KEY_TTL - (timezone.now() - record.created).total_seconds()
+    if remaining > 0:
+        cache.set(_cache_key(record.key), {
+            'request_hash': record.request_hash,
+            'status': record.response_status,
+            'body': record.response_body,
+        }, remaining)
@@ -0,0 +1,185 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.utils import timezone
+from converter.conversion import DEFAULT_RESOLUTION, convert_file, encode_file_task
+from converter.formats import PRESETS, DEFAULT_PRESET, supported_extensions
+from converter.models import ImageUpload
+from converter.pdf import PdfWriter
+from functools import partial
+import json
+import multiprocessing
+import os
+import time
+
+CHECKPOINT_NAME = '.convert_bulk.checkpoint'
+
+
+class Progress:
+    """Single-line progress bar redrawn in place on ``stream``."""
+
+    def __init__(self, stream, total, width=30):
+        self.stream = stream
+        self.total = total
+        self.width = width
+        self.done = 0
+        self.started = time.monotonic()
+
+    def advance(self):
+        self.done += 1
+        filled = self.width * self.done // max(self.total, 1)
+        rate = self.done / max(time.monotonic() - self.started, 1e-6)
+        bar = '#' * filled + ' ' * (self.width - filled)
+        ending = '\n' if self.done == self.total else ''
+        self.stream.write(f'\r[{bar}] {self.done}/{self.total} files, {rate:.1f}/s', ending=ending)
+        self.stream.flush()
+
+
+class Command(BaseCommand):
+    help = 'Convert a directory or manifest of images to PDFs in parallel, outside the upload queue.'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--input-dir', help='Convert every supported image below this directory')
+        source.add_argument('--manifest', help='Text file with one image path per line')
+        parser.add_argument('--output-dir', required=True, help='Where PDFs (and the checkpoint) are written')
+        parser.add_argument('--combined', metavar='FILENAME',
+                            help='Write all images as pages of one PDF in the output directory instead')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Worker processes (default: number of cores)')
+        parser.add_argument('--preset', choices=list(PRESETS), default=DEFAULT_PRESET)
+        parser.add_argument('--document-mode', action='store_true')
+        parser.add_argument('--max-pdf-bytes', type=int, help='Size target per PDF (not with --combined)')
+        parser.add_argument('--register', metavar='EMAIL',
+                            help='Create COMPLETED ImageUpload rows for this email (output must be inside MEDIA_ROOT)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk_create (default: 500)')
+        parser.add_argument('--restart', action='store_true', help='Ignore and overwrite an existing checkpoint')
+
+    def handle(self, *args, **options):
+        output_dir = os.path.abspath(options['output_dir'])
+        sources = self._collect_sources(options)
+        if not sources:
+            raise CommandError('No images found')
+        if options['combined'] and (options['max_pdf_bytes'] or options['register']):
+            raise CommandError('--combined cannot be used with --max-pdf-bytes or --register')
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        if options['register'] and os.path.commonpath([media_root, output_dir]) != media_root:
+            raise CommandError('--register needs --output-dir inside MEDIA_ROOT')
+        os.makedirs(output_dir, exist_ok=True)
+
+        convert_options = {
+            'max_pages': settings.MAX_PDF_PAGES,
+            'background': settings.PDF_BACKGROUND_COLOR,
+            'document_mode': options['document_mode'],
+            'preset': options['preset'],
+        }
+        with multiprocessing.Pool(processes=options['workers']) as pool:
+            if options['combined']:
+                self._convert_combined(pool, sources, os.path.join(output_dir, options['combined']), convert_options)
+            else:
+                convert_options['max_bytes'] = options['max_pdf_bytes']
+                self._convert_separately(pool, sources, output_dir, convert_options, options)
+
+    def _collect_sources(self, options):
+        if options['manifest']:
+            with open(options['manifest']) as f:
+                return [os.path.abspath(line.strip()) for line in f if line.strip()]
+
+        extensions = supported_extensions()
+        sources = []
+        for root, dirs, files in os.walk(options['input_dir']):
+            dirs.sort()
+            sources.extend(
+                os.path.abspath(os.path.join(root, name))
+                for name in sorted(files) if name.lower().endswith(extensions)
+            )
+        return sources
+
+    def _convert_separately(self, pool, sources, output_dir, convert_options, options):
+        checkpoint_path = os.path.join(output_dir, CHECKPOINT_NAME)
+        done = set()
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as f:
+                done = {json.loads(line)['source'] for line in f if line.strip()}
+        base = os.path.abspath(options['input_dir'] or os.path.commonpath([os.path.dirname(s) for s in sources]))
+        jobs = [
+            (source, os.path.join(output_dir, os.path.splitext(os.path.relpath(source, base))[0] + '.pdf'))
+            for source in sources if source not in done
+        ]
+        if done:
+            self.stdout.write(f'Resuming: {len(done)} files already converted, {len(jobs)} left')
+
+        progress = Progress(self.stderr, len(jobs))
+        pending = []
+        failures = 0
+        with open(checkpoint_path, 'w' if options['restart'] else 'a') as checkpoint:
+
+            def flush():
+                # Checkpoint a file only once its row exists, so a resumed run never skips an unregistered PDF
+                if options['register']:
+                    ImageUpload.objects.bulk_create([row for _, row in pending])
+                checkpoint.writelines(line for line, _ in pending)
+                checkpoint.flush()
+                pending.clear()
+
+            try:
+                for source, destination, result, error in pool.imap_unordered(
+                    partial(convert_file, options=convert_options), jobs
+                ):
+                    progress.advance()
+                    if error:
+                        failures += 1
+                        self.stderr.write(f'\n{source}: {error}')
+                        continue
+                    line = json.dumps({'source': source, 'pdf': destination}) + '\n'
+                    row = self._row(options, source, destination, result) if options['register'] else None
+                    pending.append((line, row))
+                    if not options['register'] or len(pending) >= options['batch_size']:
+                        flush()
+            finally:
+                if pending:
+                    flush()
+
+        self.stdout.write(self.style.SUCCESS(f'Converted {len(jobs) - failures} files, {failures} failed'))
+
+    def _convert_combined(self, pool, sources, destination, convert_options):
+        progress = Progress(self.stderr, len(sources))
+        failures = 0
+        scale = PRESETS[convert_options['preset']]['scale']
+        with open(destination, 'wb') as output:
+            writer = PdfWriter(output, resolution=DEFAULT_RESOLUTION * scale)
+            # imap keeps input order while later files are still being encoded
+            for source, pages, error in pool.imap(partial(encode_file_task, options=convert_options), sources):
+                progress.advance()
+                if error:
+                    failures += 1
+                    self.stderr.write(f'\n{source}: {error}')
+                    continue
+                for page in pages:
+                    writer.add_page(page)
+            writer.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(writer.page_ids)} pages from {len(sources) - failures} files to {destination}, {failures} failed'
+        ))
+
+    def _row(self, options, source, destination, result):
+        return ImageUpload(
+            email=options['register'],
+            jpeg_file='',
+            _pdf_file=os.path.relpath(destination, settings.MEDIA_ROOT),
+            status=ImageUpload.Status.COMPLETED,
+            keep_files=True,
+            timestamp=timezone.now(),
+            document_mode=options['document_mode'],
+            preset=options['preset'],
+            max_pdf_bytes=options['max_pdf_bytes'],
+            input_bytes=os.path.getsize(source),
+            pdf_quality=result.quality,
+            pdf_scale=result.scale,
+            trace={
+                'engine': options['preset'] + ('+document' if options['document_mode'] else ''),
+                'pages': result.pages,
+                'input_bytes': os.path.getsize(source),
+                'output_bytes': result.size,
+                'source': source,
+            },
+        )
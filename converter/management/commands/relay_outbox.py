@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from converter import outbox
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Publish upload tasks written to the outbox (UPLOAD_OUTBOX) to the broker in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+                            help=f'Messages published per round trip (default: {settings.OUTBOX_BATCH_SIZE})')
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help=f'Seconds to wait when the outbox is empty (default: {settings.OUTBOX_POLL_INTERVAL})')
+        parser.add_argument('--once', action='store_true', help='Publish everything pending, then exit')
+
+    def handle(self, *args, **options):
+        total = 0
+        failures = 0
+        while True:
+            try:
+                sent = outbox.relay(options['batch_size'])
+                failures = 0
+            except Exception:
+                if options['once']:
+                    raise
+                # Messages stay unsent and are retried, backing off while the broker is down
+                failures += 1
+                logger.exception('Failed to publish outbox messages')
+                time.sleep(min(30, options['interval'] * 2 ** failures))
+                continue
+            total += sent
+            if sent < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Published {total} tasks'))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from converter.models import ImageUpload
+from converter.tasks import requeue_failed_uploads
+from datetime import timedelta
+import re
+
+
+class Command(BaseCommand):
+    help = 'Reset FAILED uploads to PENDING and enqueue them again in rate limited batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only uploads made at or after this ISO datetime')
+        parser.add_argument('--until', help='Only uploads made before this ISO datetime')
+        parser.add_argument('--minutes', type=int, help='Only uploads made in the last N minutes')
+        parser.add_argument('--error', metavar='REGEX', help='Only uploads whose error message matches (case-insensitive)')
+        parser.add_argument('--batch-size', type=int, default=settings.REPROCESS_BATCH_SIZE,
+                            help=f'Uploads enqueued per Celery group (default: {settings.REPROCESS_BATCH_SIZE})')
+        parser.add_argument('--rate', type=float, default=settings.REPROCESS_RATE,
+                            help=f'Uploads per second the batches are spread over (default: {settings.REPROCESS_RATE})')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many uploads would be requeued')
+
+    def handle(self, *args, **options):
+        uploads = ImageUpload.objects.filter(status=ImageUpload.Status.FAILED)
+        if options['since']:
+            uploads = uploads.filter(timestamp__gte=self._datetime(options['since']))
+        if options['until']:
+            uploads = uploads.filter(timestamp__lt=self._datetime(options['until']))
+        if options['minutes']:
+            uploads = uploads.filter(timestamp__gte=timezone.now() - timedelta(minutes=options['minutes']))
+        if options['error']:
+            try:
+                re.compile(options['error'])
+            except re.error as e:
+                raise CommandError(f'Invalid --error pattern: {e}')
+            uploads = uploads.filter(error_message__iregex=options['error'])
+
+        if options['dry_run']:
+            total = uploads.count()
+            pending = uploads.filter(jpeg_file__gt='').count()
+            self.stdout.write(f'Would requeue {pending} uploads, {total - pending} skipped without an image')
+            return
+
+        requeued = requeue_failed_uploads(uploads, options['batch_size'], options['rate'])
+        seconds = requeued / options['rate']
+        self.stdout.write(self.style.SUCCESS(f'Requeued {requeued} uploads over about {seconds:.0f} seconds'))
+
+    def _datetime(self, value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'Not an ISO datetime: {value}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
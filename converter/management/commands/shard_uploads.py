@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from converter.models import ImageUpload, UPLOAD_DIRS, sharded_name
+import os
+
+
+class Command(BaseCommand):
+    help = 'Move files stored in the flat uploads/ layout into hashed shard directories.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rows updated per query (default: 500)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be moved without touching files or rows')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        flat_dirs = set(UPLOAD_DIRS.values())
+        pending = []
+        moved = 0
+
+        for upload in ImageUpload.objects.only('id', 'jpeg_file', '_pdf_file').iterator(chunk_size=batch_size):
+            changed = False
+            for field_name in ('jpeg_file', '_pdf_file'):
+                name = getattr(upload, field_name).name
+                if not name or os.path.dirname(name) not in flat_dirs:
+                    continue
+                new_name = sharded_name(os.path.dirname(name), name)
+                if not dry_run and not self._move(name, new_name):
+                    continue
+                setattr(upload, field_name, new_name)
+                changed = True
+                moved += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{name} -> {new_name}')
+
+            if changed and not dry_run:
+                pending.append(upload)
+            if len(pending) >= batch_size:
+                ImageUpload.objects.bulk_update(pending, ['jpeg_file', '_pdf_file'])
+                pending = []
+
+        if pending:
+            ImageUpload.objects.bulk_update(pending, ['jpeg_file', '_pdf_file'])
+
+        verb = 'Would move' if dry_run else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {moved} files into sharded directories'))
+
+    def _move(self, name, new_name):
+        """Rename a file within MEDIA_ROOT, creating the shard directory as needed.
+
+        Files are moved before their rows are written, so a run that was
+        interrupted leaves moved files behind flat names. Those count as
+        moved, and the row is updated this time.
+        """
+        src = os.path.join(settings.MEDIA_ROOT, name)
+        dst = os.path.join(settings.MEDIA_ROOT, new_name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.replace(src, dst)
+        except FileNotFoundError:
+            if os.path.exists(dst):
+                return True
+            self.stderr.write(f'Missing file skipped: {name}')
+            return False
+        return True
@@ -0,0 +1,87 @@
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, multiprocess
+from contextlib import contextmanager
+import os
+import time
+
+# Set PROMETHEUS_MULTIPROC_DIR to a shared, emptied-at-startup directory when
+# running gunicorn or Celery with several processes, so every process writes
+# its samples there and /metrics merges them.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+LABELS = ['stage', 'format', 'engine', 'size_bucket']
+
+STAGE_SECONDS = Histogram(
+    'jpgtopdf_stage_duration_seconds',
+    'Time spent in each stage of handling an upload',
+    LABELS,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+STAGE_FAILURES = Counter(
+    'jpgtopdf_stage_failures_total',
+    'Stages that raised or reported a failure',
+    LABELS,
+)
+UPLOADS = Counter(
+    'jpgtopdf_uploads_total',
+    'Uploads that reached a terminal status',
+    ['status', 'format', 'engine', 'size_bucket'],
+)
+
+SIZE_BUCKETS = [
+    (100 * 1024, '<100KB'),
+    (1024 * 1024, '<1MB'),
+    (5 * 1024 * 1024, '<5MB'),
+]
+
+
+def size_bucket(size):
+    if size is None:
+        return 'unknown'
+    for limit, label in SIZE_BUCKETS:
+        if size < limit:
+            return label
+    return '>=5MB'
+
+
+def upload_labels(upload):
+    """Return the format, engine and size bucket labels describing an upload's input."""
+    try:
+        size = upload.input_bytes or upload.jpeg_file.size
+    except (OSError, ValueError):
+        size = None
+    extension = os.path.splitext(upload.jpeg_file.name or '')[1].lstrip('.').lower()
+    return {
+        'format': {'jpg': 'jpeg', 'tif': 'tiff'}.get(extension, extension) or 'unknown',
+        'engine': upload.engine,
+        'size_bucket': size_bucket(size),
+    }
+
+
+def observe(stage, seconds, labels, upload=None, started=None):
+    """Record a stage duration, and add it to the upload's trace when one is given."""
+    STAGE_SECONDS.labels(stage=stage, **labels).observe(seconds)
+    if upload is not None:
+        upload.record_stage(stage, started if started is not None else time.time() - seconds, seconds)
+
+
+@contextmanager
+def timed(stage, labels, upload=None):
+    """Record how long the block took; count it as a failure if it raises."""
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage=stage, **labels).inc()
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, labels, upload=upload, started=started)
+
+
+def registry():
+    """Return the registry to expose, merging every process' samples in multiprocess mode."""
+    if not MULTIPROCESS:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:36
+
+import converter.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0004_rename_jpgupload_to_imageupload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imageupload',
+            name='_pdf_file',
+            field=models.FileField(blank=True, null=True, upload_to=converter.models.pdf_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='jpeg_file',
+            field=models.FileField(upload_to=converter.models.image_upload_path),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0005_sharded_upload_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='document_mode',
+            field=models.BooleanField(default=False, help_text='Store scanned documents as grayscale or black and white pages when possible'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:43
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0006_imageupload_document_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='input_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='max_pdf_bytes',
+            field=models.PositiveIntegerField(blank=True, help_text='Reduce quality and resolution until the PDF fits in this many bytes', null=True, validators=[django.core.validators.MinValueValidator(10240)]),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='pdf_quality',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='pdf_scale',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='preset',
+            field=models.CharField(choices=[('smallest', 'Smallest'), ('balanced', 'Balanced'), ('lossless', 'Lossless')], default='balanced', max_length=20),
+        ),
+    ]
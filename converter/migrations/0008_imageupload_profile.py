@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0007_imageupload_size_presets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='profile',
+            field=models.BooleanField(default=False, help_text='Run the conversion under cProfile and tracemalloc and keep the dumps'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0008_imageupload_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='trace',
+            field=models.JSONField(blank=True, default=dict, help_text='Stage timings, worker, engine and byte counts of the last processing run'),
+        ),
+    ]
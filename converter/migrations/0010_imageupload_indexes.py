@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0009_imageupload_trace'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(fields=['-timestamp', '-id'], name='upload_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(fields=['status', '-timestamp', '-id'], name='upload_status_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(fields=['email', '-timestamp'], name='upload_email_timestamp_idx'),
+        ),
+    ]
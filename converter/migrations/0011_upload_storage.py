@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:59
+
+import converter.models
+import converter.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0010_imageupload_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imageupload',
+            name='_pdf_file',
+            field=models.FileField(blank=True, null=True, storage=converter.storage.upload_storage, upload_to=converter.models.pdf_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='jpeg_file',
+            field=models.FileField(storage=converter.storage.upload_storage, upload_to=converter.models.image_upload_path),
+        ),
+    ]
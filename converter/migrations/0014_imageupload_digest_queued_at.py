@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0013_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='digest_queued_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the PDF started waiting for the email digest, empty once it is sent', null=True),
+        ),
+    ]
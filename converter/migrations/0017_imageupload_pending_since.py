@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0016_outboxmessage_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='pending_since',
+            field=models.DateTimeField(blank=True, help_text='Start of the pending timeout when the upload was requeued, empty to count from the upload time', null=True),
+        ),
+    ]
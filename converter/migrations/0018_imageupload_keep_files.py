@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0017_imageupload_pending_since'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='keep_files',
+            field=models.BooleanField(default=False, help_text='Files are not removed after FILE_CLEANUP_MINUTES, e.g. PDFs registered by convert_bulk'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0018_imageupload_keep_files'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(condition=models.Q(('max_pdf_bytes__isnull', False), ('pdf_quality__isnull', False)), fields=['max_pdf_bytes', 'preset', 'input_bytes', 'document_mode', 'pdf_quality', 'pdf_scale', 'timestamp'], name='upload_size_search_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0019_imageupload_size_search_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='digest_claimed_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When a running digest claimed the PDF, empty once the digest finished it', null=True),
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='digest_queued_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the PDF started waiting for the email digest, empty once a digest claims it', null=True),
+        ),
+    ]
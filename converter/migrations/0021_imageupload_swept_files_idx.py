@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0020_imageupload_digest_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(condition=models.Q(models.Q(('jpeg_file__gt', ''), ('_pdf_file__gt', ''), _connector='OR'), ('keep_files', False)), fields=['timestamp'], name='upload_swept_files_idx'),
+        ),
+    ]
@@ -1,8 +1,61 @@
 from django.db import models
-from PIL import Image
-from django.core.files.base import ContentFile
-import io
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast
+from django.conf import settings
+from django.core.files.base import File
+from django.core import signing
+from django.urls import reverse
+from urllib.parse import urlencode
+from django.core.validators import MinValueValidator
+from .formats import PRESETS, DEFAULT_PRESET
+from . import metrics
+from .storage import upload_storage
+import hashlib
 import os
+import tempfile
+import time
+import uuid
+
+UPLOAD_DIRS = {
+    'jpg': 'uploads/jpg',
+    'pdf': 'uploads/pdf',
+}
+
+
+def sharded_name(directory, filename):
+    """Return ``directory/ab/cd/filename`` with the shard derived from the file stem.
+
+    Keeping each leaf directory small means storage lookups and deletes stay
+    cheap no matter how many uploads have accumulated.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    digest = hashlib.md5(stem.encode()).hexdigest()
+    return f'{directory}/{digest[:2]}/{digest[2:4]}/{os.path.basename(filename)}'
+
+
+def image_upload_path(instance, filename):
+    """Store source images under a random, collision-free name in a hashed shard."""
+    ext = os.path.splitext(filename)[1].lower()
+    return sharded_name(UPLOAD_DIRS['jpg'], f'{uuid.uuid4().hex}{ext}')
+
+
+def pdf_upload_path(instance, filename):
+    """Store PDFs in the shard matching the source image they were converted from."""
+    return sharded_name(UPLOAD_DIRS['pdf'], filename)
+
+
+def trace_seconds(stage):
+    """Expression for a stage duration stored in ``trace``, usable in annotate() and aggregate().
+
+    e.g. ``ImageUpload.objects.aggregate(Avg(trace_seconds('queue_wait')))``
+    """
+    return Cast(KT(f'trace__stages__{stage}__seconds'), models.FloatField())
+
+
+# Rows whose files cleanup_old_files removes; shared with its partial index so
+# the query matches the index condition
+SWEPT_FILES = (models.Q(jpeg_file__gt='') | models.Q(_pdf_file__gt='')) & models.Q(keep_files=False)
+
 
 class ImageUpload(models.Model):
     class Status(models.TextChoices):
@@ -14,8 +67,8 @@ class ImageUpload(models.Model):
 
     email = models.EmailField(null=False, blank=False)
     timestamp = models.DateTimeField(auto_now_add=True)
-    jpeg_file = models.FileField(upload_to='uploads/jpg/')
-    _pdf_file = models.FileField(upload_to='uploads/pdf/', blank=True, null=True)
+    jpeg_file = models.FileField(upload_to=image_upload_path, storage=upload_storage)
+    _pdf_file = models.FileField(upload_to=pdf_upload_path, storage=upload_storage, blank=True, null=True)
     status = models.CharField(
         max_length=20,
         choices=Status.choices,
@@ -23,12 +76,81 @@ class ImageUpload(models.Model):
     )
     error_message = models.TextField(blank=True, null=True)
     task_id = models.CharField(max_length=255, blank=True, null=True)
+    document_mode = models.BooleanField(
+        default=False,
+        help_text='Store scanned documents as grayscale or black and white pages when possible'
+    )
+    preset = models.CharField(
+        max_length=20,
+        choices=[(name, name.capitalize()) for name in PRESETS],
+        default=DEFAULT_PRESET
+    )
+    max_pdf_bytes = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(10 * 1024)],
+        help_text='Reduce quality and resolution until the PDF fits in this many bytes'
+    )
+    profile = models.BooleanField(
+        default=False,
+        help_text='Run the conversion under cProfile and tracemalloc and keep the dumps'
+    )
+    input_bytes = models.PositiveBigIntegerField(blank=True, null=True)
+    pdf_quality = models.PositiveSmallIntegerField(blank=True, null=True)
+    pdf_scale = models.FloatField(blank=True, null=True)
+    trace = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text='Stage timings, worker, engine and byte counts of the last processing run'
+    )
+    digest_queued_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_index=True,
+        help_text='When the PDF started waiting for the email digest, empty once a digest claims it'
+    )
+    digest_claimed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_index=True,
+        help_text='When a running digest claimed the PDF, empty once the digest finished it'
+    )
+    callback_url = models.URLField(
+        max_length=2048,
+        blank=True,
+        null=True,
+        help_text='Receives a signed POST when the upload completes or fails'
+    )
+    keep_files = models.BooleanField(
+        default=False,
+        help_text='Files are not removed after FILE_CLEANUP_MINUTES, e.g. PDFs registered by convert_bulk'
+    )
+    pending_since = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text='Start of the pending timeout when the upload was requeued, empty to count from the upload time'
+    )
 
     def __str__(self):
         return f"{self.email} - {self.timestamp} ({self.status})"
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp', '-id'], name='upload_timestamp_idx'),
+            models.Index(fields=['status', '-timestamp', '-id'], name='upload_status_timestamp_idx'),
+            models.Index(fields=['email', '-timestamp'], name='upload_email_timestamp_idx'),
+            # Covers size_search_hint, over the size-targeted uploads that have a result.
+            # document_mode follows the range column: False is queried as NOT document_mode,
+            # which cannot seek an index
+            models.Index(
+                fields=['max_pdf_bytes', 'preset', 'input_bytes', 'document_mode', 'pdf_quality', 'pdf_scale', 'timestamp'],
+                condition=models.Q(max_pdf_bytes__isnull=False, pdf_quality__isnull=False),
+                name='upload_size_search_idx',
+            ),
+            # cleanup_old_files only looks at rows that still hold swept files
+            models.Index(fields=['timestamp'], condition=SWEPT_FILES, name='upload_swept_files_idx'),
+        ]
 
     def update_status(self, status, error_message=None):
         self.status = status
@@ -36,6 +158,75 @@ class ImageUpload(models.Model):
             self.error_message = error_message
         self.save()
 
+    DOWNLOAD_SALT = 'converter.download'
+
+    def download_token(self):
+        """Signed, timestamped token identifying this upload's PDF for the download view."""
+        return signing.dumps(self.id, salt=self.DOWNLOAD_SALT, compress=True)
+
+    def get_download_url(self):
+        """Relative URL of the PDF download, valid for PDF_DOWNLOAD_MAX_AGE seconds."""
+        return reverse('converter:download', args=[self.download_token()])
+
+    @classmethod
+    def from_download_token(cls, token, max_age):
+        """Return the upload for a token, raising signing.BadSignature if it is invalid or expired."""
+        upload_id = signing.loads(token, salt=cls.DOWNLOAD_SALT, max_age=max_age)
+        return cls.objects.get(id=upload_id)
+
+    STATUS_SALT = 'converter.status'
+
+    def status_token(self):
+        """Signed token given only to the client that made the upload, for the status view."""
+        return signing.dumps(self.id, salt=self.STATUS_SALT, compress=True)
+
+    def get_status_url(self):
+        """Relative URL of the status view that also links to the PDF download."""
+        return reverse('converter:upload_status', args=[self.status_token()])
+
+    @classmethod
+    def from_status_token(cls, token):
+        """Return the upload for a status token, raising signing.BadSignature if it is invalid."""
+        return cls.objects.get(id=signing.loads(token, salt=cls.STATUS_SALT))
+
+    EXPORT_SALT = 'converter.export'
+
+    @classmethod
+    def export_token(cls, email, minutes=None):
+        """Signed, timestamped token for a ZIP of ``email``'s PDFs from the last ``minutes`` minutes."""
+        minutes = minutes or settings.FILE_CLEANUP_MINUTES
+        if not 0 < minutes <= settings.EXPORT_MAX_MINUTES:
+            raise ValueError(f'minutes must be between 1 and {settings.EXPORT_MAX_MINUTES}')
+        return signing.dumps({'email': email, 'minutes': minutes}, salt=cls.EXPORT_SALT, compress=True)
+
+    @classmethod
+    def get_export_url(cls, email, minutes=None):
+        """Relative URL of the ZIP export for ``export_token(email, minutes)``."""
+        return f"{reverse('converter:export')}?{urlencode({'token': cls.export_token(email, minutes)})}"
+
+    def record_stage(self, stage, started, seconds):
+        """Add a stage to the trace; it is persisted by the next save, usually the status update."""
+        stages = self.trace.setdefault('stages', {})
+        stages[stage] = {'start': round(started, 3), 'seconds': round(seconds, 4)}
+
+    @property
+    def engine(self):
+        """Short name of the conversion settings used for this upload, e.g. 'balanced+document'."""
+        return f"{self.preset}+document" if self.document_mode else self.preset
+
+    def size_search_hint(self):
+        """Return the (quality, scale) picked for the latest similar size-targeted upload."""
+        if not self.max_pdf_bytes or not self.input_bytes:
+            return None
+        return ImageUpload.objects.filter(
+            max_pdf_bytes=self.max_pdf_bytes,
+            preset=self.preset,
+            document_mode=self.document_mode,
+            input_bytes__range=(self.input_bytes * 0.8, self.input_bytes * 1.25),
+            pdf_quality__isnull=False,
+            pdf_scale__isnull=False,
+        ).exclude(id=self.id).values_list('pdf_quality', 'pdf_scale').first()
+
     @property
     def pdf_file(self):
         """Property that automatically generates PDF if it doesn't exist"""
@@ -46,27 +237,55 @@ class ImageUpload(models.Model):
             return self._pdf_file
 
         if not self._pdf_file and self.jpeg_file:
+            from .conversion import convert_to_pdf
+
+            labels = None
             try:
-                # Open the image
-                image = Image.open(self.jpeg_file)
-                
-                # Convert to RGB if necessary
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # Create PDF in memory
-                pdf_buffer = io.BytesIO()
-                image.save(pdf_buffer, format='PDF', resolution=100.0)
-                
-                # Save PDF to model
-                pdf_filename = os.path.splitext(os.path.basename(self.jpeg_file.name))[0] + '.pdf'
-                self._pdf_file.save(pdf_filename, ContentFile(pdf_buffer.getvalue()), save=True)
+                self.input_bytes = self.jpeg_file.size
+                labels = metrics.upload_labels(self)
+                timings = {}
+                started = time.time()
+
+                # Convert every frame into its own page, spooling large PDFs to disk
+                with tempfile.SpooledTemporaryFile(max_size=settings.PDF_SPOOL_MAX_MEMORY) as pdf_buffer:
+                    result = convert_to_pdf(
+                        self.jpeg_file,
+                        pdf_buffer,
+                        max_pages=settings.MAX_PDF_PAGES,
+                        background=settings.PDF_BACKGROUND_COLOR,
+                        document_mode=self.document_mode,
+                        preset=self.preset,
+                        max_bytes=self.max_pdf_bytes,
+                        hint=self.size_search_hint(),
+                        max_iterations=settings.PDF_SIZE_SEARCH_MAX_ITERATIONS,
+                        timings=timings,
+                        threads=settings.PDF_ENCODE_THREADS,
+                        max_in_flight=settings.PDF_PAGES_IN_FLIGHT,
+                    )
+                    for stage, seconds in timings.items():
+                        metrics.observe(stage, seconds, labels, upload=self, started=started)
+                    pdf_buffer.seek(0)
+                    self.pdf_quality = result.quality
+                    self.pdf_scale = result.scale
+                    self.trace.update({
+                        'engine': self.engine,
+                        'pages': result.pages,
+                        'input_bytes': self.input_bytes,
+                        'output_bytes': result.size,
+                    })
+
+                    # Save PDF to model
+                    pdf_filename = os.path.splitext(os.path.basename(self.jpeg_file.name))[0] + '.pdf'
+                    with metrics.timed('storage_write', labels, upload=self):
+                        self._pdf_file.save(pdf_filename, File(pdf_buffer), save=True)
                 
                 # Update status to COMPLETED if PDF is successfully created
                 self.status = self.Status.COMPLETED
                 self.save()
                 
             except Exception as e:
+                if labels:
+                    metrics.STAGE_FAILURES.labels(stage='convert', **labels).inc()
                 self.error_message = f"Error converting image to PDF: {str(e)}"
                 self.status = self.Status.FAILED
                 self.save()
@@ -81,10 +300,62 @@ class ImageUpload(models.Model):
         if not self.pdf_file:
             return False
         try:
-            # Logic to send email with PDF attachment
-            # This is a placeholder for the actual email sending logic
+            from .emails import send_pdfs
+            send_pdfs([self])
             return True
         except Exception as e:
             self.error_message = f"Error sending email: {str(e)}"
             self.save()
             return False
+
+class IdempotencyKey(models.Model):
+    """Client-supplied ``Idempotency-Key`` of an upload request and the response it got.
+
+    ``response_status`` stays empty while the first request is in flight.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    request_hash = models.CharField(max_length=64)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    upload = models.ForeignKey(ImageUpload, null=True, blank=True, on_delete=models.CASCADE)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return self.key
+
+
+class OutboxMessage(models.Model):
+    """Celery task written in the same transaction as the upload it belongs to.
+
+    ``manage.py relay_outbox`` publishes unsent messages to the broker under
+    their preassigned ``task_id`` and sets ``sent_at``. ``claimed_at`` is
+    set by the relay that is publishing the message.
+    """
+    upload = models.ForeignKey(ImageUpload, on_delete=models.CASCADE)
+    task_name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    task_id = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(sent_at__isnull=True), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task_name}{tuple(self.args)} ({self.task_id})"
+
+
+class WebhookDeadLetter(models.Model):
+    """Completion webhook that was not delivered after all retries."""
+    upload = models.ForeignKey(ImageUpload, null=True, blank=True, on_delete=models.CASCADE)
+    url = models.URLField(max_length=2048)
+    payload = models.JSONField()
+    attempts = models.PositiveSmallIntegerField()
+    error = models.TextField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.url} ({self.error})"
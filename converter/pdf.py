@@ -0,0 +1,101 @@
+from collections import namedtuple
+
+# An image that has already been compressed into a PDF-ready stream.
+EncodedPage = namedtuple('EncodedPage', [
+    'width', 'height', 'color_space', 'bits_per_component', 'filter', 'data',
+])
+
+
+def _pdf_name(value):
+    return b'/' + value.encode('ascii')
+
+
+class PdfWriter:
+    """Minimal streaming PDF writer that places one image on each page.
+
+    Every page is written to ``fp`` as soon as it is added, so only the byte
+    offsets of the objects are kept in memory regardless of the page count.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, fp, resolution=72.0):
+        self.fp = fp
+        self.resolution = resolution
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = self.PAGES_ID + 1
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.position += len(data)
+
+    def _allocate(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, dictionary, stream=None):
+        self.offsets[obj_id] = self.position
+        if stream is not None:
+            dictionary = dictionary + b' /Length %d' % len(stream)
+        self._write(b'%d 0 obj\n<<%s>>\n' % (obj_id, dictionary))
+        if stream is not None:
+            self._write(b'stream\n')
+            self._write(stream)
+            self._write(b'\nendstream\n')
+        self._write(b'endobj\n')
+
+    def add_page(self, page):
+        """Write an EncodedPage as a new page sized to the image at the writer's resolution."""
+        image_id = self._allocate()
+        contents_id = self._allocate()
+        page_id = self._allocate()
+
+        self._write_object(
+            image_id,
+            b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s'
+            b' /BitsPerComponent %d /Filter %s' % (
+                page.width, page.height, _pdf_name(page.color_space),
+                page.bits_per_component, _pdf_name(page.filter),
+            ),
+            stream=page.data,
+        )
+
+        width = page.width * 72.0 / self.resolution
+        height = page.height * 72.0 / self.resolution
+        self._write_object(
+            contents_id, b'',
+            stream=b'q %f 0 0 %f 0 0 cm /image Do Q' % (width, height),
+        )
+        self._write_object(
+            page_id,
+            b'/Type /Page /Parent %d 0 R /MediaBox [0 0 %f %f]'
+            b' /Resources <</XObject <</image %d 0 R>>>> /Contents %d 0 R' % (
+                self.PAGES_ID, width, height, image_id, contents_id,
+            ),
+        )
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        self._write_object(
+            self.PAGES_ID,
+            b'/Type /Pages /Kids [%s] /Count %d' % (kids, len(self.page_ids)),
+        )
+        self._write_object(self.CATALOG_ID, b'/Type /Catalog /Pages %d 0 R' % self.PAGES_ID)
+
+        xref_offset = self.position
+        self._write(b'xref\n0 %d\n' % self.next_id)
+        self._write(b'0000000000 65535 f \n')
+        for obj_id in range(1, self.next_id):
+            self._write(b'%010d 00000 n \n' % self.offsets[obj_id])
+        self._write(
+            b'trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (
+                self.next_id, self.CATALOG_ID, xref_offset,
+            )
+        )
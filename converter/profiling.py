@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+from django.conf import settings
+import cProfile
+import logging
+import os
+import random
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+TOP_ALLOCATIONS = 25
+
+
+def should_profile(upload):
+    """Return True if this upload was flagged for profiling or picked by sampling."""
+    if upload.profile:
+        return True
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def _rotate(directory, keep):
+    """Delete the oldest files in ``directory`` so at most ``keep`` remain."""
+    entries = sorted(
+        (entry for entry in os.scandir(directory) if entry.is_file()),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in entries[:max(0, len(entries) - keep)]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def _write_allocations(path, snapshot, peak):
+    with open(path, 'w') as f:
+        f.write(f'Peak traced memory: {peak / 1024:.1f} KiB\n')
+        f.write(f'Top {TOP_ALLOCATIONS} allocation sites:\n')
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            f.write(f'{stat}\n')
+
+
+@contextmanager
+def profile_upload(upload):
+    """Run the block under cProfile and tracemalloc if the upload should be profiled.
+
+    Writes ``<upload id>-<time>.prof`` (load it with pstats or snakeviz) and
+    ``<upload id>-<time>.alloc.txt`` to PROFILE_DIR, keeping at most
+    PROFILE_MAX_FILES files there. Does nothing otherwise.
+    """
+    if not should_profile(upload):
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+
+        try:
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            prefix = os.path.join(settings.PROFILE_DIR, f'{upload.id}-{int(time.time())}')
+            profiler.dump_stats(f'{prefix}.prof')
+            _write_allocations(f'{prefix}.alloc.txt', snapshot, peak)
+            _rotate(settings.PROFILE_DIR, settings.PROFILE_MAX_FILES)
+            logger.info(f"Upload {upload.id}: profile written to {prefix}.prof")
+        except OSError as e:
+            logger.error(f"Upload {upload.id}: could not write profile: {str(e)}")
@@ -1,22 +1,33 @@
 from rest_framework import serializers
 from .models import ImageUpload
-from PIL import Image
+from .formats import supported_extensions
 
 class ImageUploadSerializer(serializers.ModelSerializer):
     status = serializers.CharField(read_only=True)
     error_message = serializers.CharField(read_only=True)
     task_id = serializers.CharField(read_only=True)
+    pdf_quality = serializers.IntegerField(read_only=True)
+    pdf_scale = serializers.FloatField(read_only=True)
 
     class Meta:
         model = ImageUpload
-        fields = ['id', 'email', 'jpeg_file', 'timestamp', 'status', 'error_message', 'task_id']
-        read_only_fields = ['id', 'timestamp', 'status', 'error_message', 'task_id']
+        fields = [
+            'id', 'email', 'jpeg_file', 'document_mode', 'preset', 'max_pdf_bytes', 'profile', 'callback_url',
+            'timestamp', 'status', 'error_message', 'task_id', 'pdf_quality', 'pdf_scale',
+        ]
+        read_only_fields = ['id', 'timestamp', 'status', 'error_message', 'task_id', 'pdf_quality', 'pdf_scale']
+        # Callback URLs often carry secrets, and the plain status endpoint is guessable
+        extra_kwargs = {'callback_url': {'write_only': True}}
 
     def validate_jpeg_file(self, value):
-        exts = Image.registered_extensions()
-        supported_extensions = {ex for ex, f in exts.items() if f in Image.OPEN}
-        if not value.name.lower().endswith(tuple(supported_extensions)):
-            raise serializers.ValidationError(f"Only image files with supported formats are allowed: {', '.join(supported_extensions)}.")
+        extensions = supported_extensions()
+        if not value.name.lower().endswith(extensions):
+            raise serializers.ValidationError(f"Only image files with supported formats are allowed: {', '.join(extensions)}.")
         if value.size > 10 * 1024 * 1024:  # 10MB limit
             raise serializers.ValidationError("File size cannot exceed 10MB.")
         return value
+
+    def validate_callback_url(self, value):
+        if value and not value.lower().startswith(('http://', 'https://')):
+            raise serializers.ValidationError("Callback URL must use http or https.")
+        return value
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, Storage, default_storage
+import errno
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EphemeralStorage(Storage):
+    """Keep short-lived files on a size-capped tmpfs, falling back to MEDIA_ROOT when it is full.
+
+    ``location`` should be a tmpfs mount dedicated to these files, its size
+    being the cap (``EPHEMERAL_STORAGE_MAX_BYTES`` can lower it further).
+    A save that does not fit waits up to ``EPHEMERAL_STORAGE_ADMISSION_WAIT``
+    seconds for the cleanup tasks to free space, then goes to disk instead.
+    Reads look in the ephemeral location first, so names stay the same
+    wherever a file ended up.
+    """
+
+    def __init__(self, location=None, max_bytes=None, admission_wait=None):
+        self._location = location
+        self._max_bytes = max_bytes
+        self._admission_wait = admission_wait
+        # Without an explicit location FileSystemStorage follows MEDIA_ROOT changes itself
+        self.disk = FileSystemStorage()
+        self._ephemeral = None
+        self._ephemeral_key = None
+
+    @property
+    def ephemeral(self):
+        location = os.path.abspath(self._location or settings.EPHEMERAL_STORAGE_ROOT)
+        key = (location, self._base_url(location))
+        if self._ephemeral is None or self._ephemeral_key != key:
+            self._ephemeral = FileSystemStorage(location=location, base_url=key[1])
+            self._ephemeral_key = key
+        return self._ephemeral
+
+    @staticmethod
+    def _base_url(location):
+        """MEDIA_URL of ``location`` when it is mounted inside MEDIA_ROOT, else None (MEDIA_URL)."""
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        location = os.path.abspath(location)
+        if os.path.commonpath([media_root, location]) != media_root:
+            return None
+        relative = os.path.relpath(location, media_root).replace(os.sep, '/')
+        return settings.MEDIA_URL if relative == '.' else f'{settings.MEDIA_URL.rstrip("/")}/{relative}/'
+
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes if self._max_bytes is not None else settings.EPHEMERAL_STORAGE_MAX_BYTES
+
+    @property
+    def admission_wait(self):
+        return self._admission_wait if self._admission_wait is not None else settings.EPHEMERAL_STORAGE_ADMISSION_WAIT
+
+    def has_room(self, size):
+        """Return True if ``size`` more bytes fit under the cap."""
+        os.makedirs(self.ephemeral.location, exist_ok=True)
+        usage = shutil.disk_usage(self.ephemeral.location)
+        if self.max_bytes and usage.used + size > self.max_bytes:
+            return False
+        return size < usage.free
+
+    def _admit(self, size):
+        deadline = time.monotonic() + self.admission_wait
+        while not self.has_room(size):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _storage_for(self, name):
+        return self.ephemeral if os.path.exists(self.ephemeral.path(name)) else self.disk
+
+    def _save(self, name, content):
+        if self._admit(content.size):
+            try:
+                return self.ephemeral._save(name, content)
+            except OSError as e:
+                # Another process may have taken the room since it was checked
+                if e.errno != errno.ENOSPC:
+                    raise
+                if os.path.exists(self.ephemeral.path(name)):
+                    os.remove(self.ephemeral.path(name))
+                content.seek(0)
+        logger.warning(f"Ephemeral storage full, writing {name} to disk")
+        return self.disk._save(name, content)
+
+    def _open(self, name, mode='rb'):
+        return self._storage_for(name)._open(name, mode)
+
+    def delete(self, name):
+        self._storage_for(name).delete(name)
+
+    def exists(self, name):
+        return self.ephemeral.exists(name) or self.disk.exists(name)
+
+    def path(self, name):
+        return self._storage_for(name).path(name)
+
+    def size(self, name):
+        return self._storage_for(name).size(name)
+
+    def url(self, name):
+        return self._storage_for(name).url(name)
+
+    def listdir(self, path):
+        directories, files = self.disk.listdir(path) if self.disk.exists(path) else ([], [])
+        if self.ephemeral.exists(path):
+            more_directories, more_files = self.ephemeral.listdir(path)
+            directories = sorted(set(directories) | set(more_directories))
+            files = sorted(set(files) | set(more_files))
+        return directories, files
+
+    def get_modified_time(self, name):
+        return self._storage_for(name).get_modified_time(name)
+
+    def get_accessed_time(self, name):
+        return self._storage_for(name).get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self._storage_for(name).get_created_time(name)
+
+
+ephemeral_storage = EphemeralStorage()
+
+
+def upload_storage():
+    """Storage for uploaded images and PDFs, selected by UPLOAD_STORAGE."""
+    if settings.UPLOAD_STORAGE == 'ephemeral':
+        return ephemeral_storage
+    return default_storage
+
+
+def storage_roots():
+    """Directories upload files can be stored under."""
+    roots = [settings.MEDIA_ROOT]
+    if settings.UPLOAD_STORAGE == 'ephemeral':
+        roots.append(ephemeral_storage.ephemeral.location)
+    return roots
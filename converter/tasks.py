@@ -1,5 +1,9 @@
-from celery import shared_task
-from .models import ImageUpload
+from celery import group, shared_task
+from .models import IdempotencyKey, ImageUpload, OutboxMessage, SWEPT_FILES, UPLOAD_DIRS, WebhookDeadLetter
+from . import emails, metrics, webhooks
+from .profiling import profile_upload
+from .storage import storage_roots
+from enum import Enum
 import logging
 import time
 from django.utils import timezone
@@ -8,48 +12,323 @@ from celery.schedules import crontab
 from celery import Celery
 import os
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
 
 logger = logging.getLogger(__name__)
 
-@shared_task
+class Outcome(str, Enum):
+    """Result stored for process_image_upload; details live on the ImageUpload row."""
+    COMPLETED = 'completed'
+    TIMED_OUT = 'timed_out'
+    CONVERT_FAILED = 'convert_failed'
+    EMAIL_FAILED = 'email_failed'
+    DIGEST_QUEUED = 'digest_queued'
+    NOT_FOUND = 'not_found'
+    ERROR = 'error'
+
+def _remove_file(field_file):
+    """Delete the file behind a FieldFile, tolerating files that are already gone."""
+    try:
+        os.remove(field_file.path)
+    except FileNotFoundError:
+        pass
+
+@shared_task(ignore_result=True)
 def cleanup_old_files():
     """Clean up JPG and PDF files that are older than FILE_CLEANUP_MINUTES minutes."""
     cleanup_threshold = timezone.now() - timedelta(minutes=settings.FILE_CLEANUP_MINUTES)
-    old_uploads = ImageUpload.objects.filter(timestamp__lt=cleanup_threshold)
+    # Requeued uploads keep their old timestamp, so their retention counts from pending_since
+    old_uploads = ImageUpload.objects.filter(SWEPT_FILES, timestamp__lt=cleanup_threshold).exclude(
+        pending_since__gte=cleanup_threshold,
+    )
 
-    logger.info(f"Cleaning up old files: {old_uploads.count()} uploads found")
-    
-    for upload in old_uploads:
+    cleaned = 0
+    for upload in old_uploads.iterator():
         try:
             # Delete JPG file
-            if upload.jpeg_file and os.path.exists(upload.jpeg_file.path):
-                os.remove(upload.jpeg_file.path)
+            if upload.jpeg_file:
+                _remove_file(upload.jpeg_file)
                 upload.jpeg_file = None
             
             # Delete PDF file
-            if upload._pdf_file and os.path.exists(upload._pdf_file.path):
-                os.remove(upload._pdf_file.path)
+            if upload._pdf_file:
+                _remove_file(upload._pdf_file)
                 upload._pdf_file = None
             
             upload.save()
+            cleaned += 1
             logger.info(f"Cleaned up files for upload {upload.id}")
             
         except Exception as e:
             logger.error(f"Error cleaning up files for upload {upload.id}: {str(e)}")
+    logger.info(f"Cleaned up old files of {cleaned} uploads")
 
-@shared_task
+@shared_task(ignore_result=True)
 def cleanup_stuck_uploads():
     """Clean up any stuck pending uploads that are older than the timeout."""
     timeout_threshold = timezone.now() - timedelta(seconds=settings.PENDING_TIMEOUT_SECONDS)
-    stuck_uploads = ImageUpload.objects.filter(
-        status=ImageUpload.Status.PENDING,
-        timestamp__lt=timeout_threshold
+    stuck_uploads = ImageUpload.objects.filter(status=ImageUpload.Status.PENDING).filter(
+        Q(pending_since__isnull=True, timestamp__lt=timeout_threshold)
+        | Q(pending_since__lt=timeout_threshold)
     )
     
     for upload in stuck_uploads:
         error_msg = f'Upload timed out after {settings.PENDING_TIMEOUT_SECONDS} seconds'
         logger.error(f"Upload {upload.id}: {error_msg}")
         upload.update_status(ImageUpload.Status.FAILED, error_msg)
+        _notify(upload)
+
+    if settings.EMAIL_DIGEST_SECONDS:
+        _send_overdue_digests()
+
+def _send_overdue_digests():
+    """Send digests whose task was lost, e.g. to a broker restart, or died after claiming its PDFs."""
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.EMAIL_DIGEST_CLAIM_SECONDS)
+    # Claims keep their time, so requeued PDFs are overdue straight away
+    requeued = ImageUpload.objects.filter(digest_claimed_at__lt=stale).update(
+        digest_queued_at=F('digest_claimed_at'), digest_claimed_at=None,
+    )
+    if requeued:
+        logger.warning(f"Requeued {requeued} PDFs claimed by email digests that did not finish")
+    overdue = now - timedelta(seconds=2 * settings.EMAIL_DIGEST_SECONDS)
+    # Deduplicated here rather than with DISTINCT, which would scan the email index
+    emails = set(
+        ImageUpload.objects.filter(digest_queued_at__lt=overdue).order_by().values_list('email', flat=True)
+    )
+    for email in sorted(emails):
+        logger.warning(f"Email digest for {email} is overdue, sending it now")
+        send_email_digest.delay(email)
+
+def _purge_rows(queryset, order_by='timestamp'):
+    """Delete ``queryset`` in primary key chunks, pausing between chunks so other writers get the lock."""
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by(order_by, 'id').values_list('id', flat=True)[:settings.PURGE_CHUNK_SIZE])
+        if not ids:
+            return deleted
+        deleted += model.objects.filter(id__in=ids).delete()[1].get(model._meta.label, 0)
+        time.sleep(settings.PURGE_CHUNK_SLEEP)
+
+@shared_task(ignore_result=True)
+def purge_old_uploads():
+    """Delete upload rows older than the retention policy.
+
+    FAILED rows are kept for FAILED_UPLOAD_RETENTION_DAYS so they can still be
+    inspected and reprocessed, all others for UPLOAD_RETENTION_DAYS. Files left
+    behind by deleted rows are removed by reconcile_upload_files. Idempotency
+    keys older than IDEMPOTENCY_KEY_TTL and outbox messages sent more than
+    OUTBOX_RETENTION_HOURS ago are deleted as well.
+    """
+    now = timezone.now()
+    deleted = _purge_rows(ImageUpload.objects.filter(
+        timestamp__lt=now - timedelta(days=settings.UPLOAD_RETENTION_DAYS),
+    ).exclude(status=ImageUpload.Status.FAILED))
+    deleted += _purge_rows(ImageUpload.objects.filter(
+        status=ImageUpload.Status.FAILED,
+        timestamp__lt=now - timedelta(days=settings.FAILED_UPLOAD_RETENTION_DAYS),
+    ))
+    logger.info(f"Purged {deleted} uploads past retention")
+    _purge_rows(IdempotencyKey.objects.filter(
+        created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    ), order_by='created')
+    _purge_rows(OutboxMessage.objects.filter(
+        sent_at__lt=now - timedelta(hours=settings.OUTBOX_RETENTION_HOURS),
+    ), order_by='sent_at')
+    return deleted
+
+def _scan_files(directory, older_than):
+    """Yield paths of files below ``directory`` last modified before the ``older_than`` timestamp."""
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path, older_than)
+            elif entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < older_than:
+                yield entry.path
+
+def _remove_orphans(root, paths):
+    """Remove the files in ``paths`` that no upload row references, returning how many were removed."""
+    names = {os.path.relpath(path, root).replace(os.sep, '/'): path for path in paths}
+    referenced = set()
+    for jpeg_file, pdf_file in ImageUpload.objects.filter(
+        Q(jpeg_file__in=names) | Q(_pdf_file__in=names)
+    ).values_list('jpeg_file', '_pdf_file'):
+        referenced.update((jpeg_file, pdf_file))
+    removed = 0
+    for name, path in names.items():
+        if name not in referenced:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+@shared_task(ignore_result=True)
+def reconcile_upload_files():
+    """Delete files under the upload directories that no ImageUpload row references.
+
+    Files younger than ORPHAN_MIN_AGE_MINUTES are left alone, since an upload's
+    file is written just before its row is inserted.
+    """
+    older_than = time.time() - settings.ORPHAN_MIN_AGE_MINUTES * 60
+    removed = 0
+    for root in storage_roots():
+        batch = []
+        for directory in UPLOAD_DIRS.values():
+            for path in _scan_files(os.path.join(root, directory), older_than):
+                batch.append(path)
+                if len(batch) >= settings.PURGE_CHUNK_SIZE:
+                    removed += _remove_orphans(root, batch)
+                    batch = []
+        if batch:
+            removed += _remove_orphans(root, batch)
+    logger.info(f"Removed {removed} orphaned upload files")
+    return removed
+
+def _finish(image_upload, labels, status, error_message=None):
+    """Move an upload to a terminal status, saving its trace in the same update."""
+    metrics.observe(
+        'end_to_end',
+        (timezone.now() - image_upload.timestamp).total_seconds(),
+        labels,
+        upload=image_upload,
+        started=image_upload.timestamp.timestamp(),
+    )
+    image_upload.update_status(status, error_message)
+    metrics.UPLOADS.labels(status=status, **labels).inc()
+    _notify(image_upload)
+
+def _notify(image_upload):
+    """Enqueue the completion webhook of an upload that reached a terminal status."""
+    if not image_upload.callback_url:
+        return
+    try:
+        deliver_webhook.delay(image_upload.id, image_upload.callback_url, webhooks.payload(image_upload))
+    except Exception:
+        logger.exception(f"Upload {image_upload.id}: Failed to enqueue completion webhook")
+
+@shared_task(bind=True, ignore_result=True, max_retries=None)
+def deliver_webhook(self, upload_id, url, payload):
+    """POST an upload's completion payload to its callback URL, retrying with exponential backoff.
+
+    Retries are bounded by WEBHOOK_MAX_RETRIES rather than Celery's max_retries,
+    so the last failure is dead-lettered instead of raising MaxRetriesExceededError.
+    """
+    try:
+        webhooks.deliver(url, webhooks.encode(payload))
+    except webhooks.DeliveryError as e:
+        if e.retry and self.request.retries < settings.WEBHOOK_MAX_RETRIES:
+            logger.warning(f"Upload {upload_id}: Webhook delivery failed ({e}), retrying")
+            raise self.retry(countdown=webhooks.backoff(self.request.retries))
+        logger.error(f"Upload {upload_id}: Webhook delivery to {url} failed for good: {e}")
+        WebhookDeadLetter.objects.create(
+            upload=ImageUpload.objects.filter(id=upload_id).first(),
+            url=url,
+            payload=payload,
+            attempts=self.request.retries + 1,
+            error=str(e),
+        )
+
+def _hold_for_digest(image_upload):
+    """Queue a converted upload for its address's email digest, scheduling the digest if none is pending."""
+    waiting = ImageUpload.objects.filter(email=image_upload.email, digest_queued_at__isnull=False)
+    # Checked before joining, so two racing uploads may both schedule a digest,
+    # which is harmless. An upload that joins after the scheduled digest has
+    # claimed its PDFs is left without one until the overdue sweep sends it.
+    scheduled = waiting.exists()
+    image_upload.digest_queued_at = timezone.now()
+    image_upload.save(update_fields=['digest_queued_at'])
+    if waiting.count() >= settings.EMAIL_DIGEST_MAX_UPLOADS:
+        send_email_digest.delay(image_upload.email)
+    elif not scheduled:
+        send_email_digest.apply_async((image_upload.email,), countdown=settings.EMAIL_DIGEST_SECONDS)
+
+@shared_task(ignore_result=True)
+def send_email_digest(email):
+    """Send every PDF waiting in ``email``'s digest in one message and finish their uploads."""
+    uploads = []
+    claimed_at = timezone.now()
+    for upload in ImageUpload.objects.filter(email=email, digest_queued_at__isnull=False).order_by('id'):
+        # Claim each row so an overlapping digest for the same address cannot send it again.
+        # The claim is cleared when the upload is finished; the sweep requeues stale ones.
+        if ImageUpload.objects.filter(id=upload.id, digest_queued_at__isnull=False).update(
+            digest_queued_at=None, digest_claimed_at=claimed_at,
+        ):
+            upload.digest_queued_at = None
+            upload.digest_claimed_at = None
+            uploads.append(upload)
+    if not uploads:
+        return
+    with_pdf = [upload for upload in uploads if upload._pdf_file]
+    error_msg = None
+    started = time.time()
+    start = time.perf_counter()
+    if with_pdf:
+        try:
+            emails.send_pdfs(with_pdf)
+        except Exception as e:
+            error_msg = f"Error sending email: {str(e)}"
+            logger.exception(f"Email digest for {email} failed")
+    seconds = time.perf_counter() - start
+
+    for upload in uploads:
+        labels = metrics.upload_labels(upload)
+        if not upload._pdf_file:
+            _finish(upload, labels, ImageUpload.Status.FAILED, 'PDF was cleaned up before the email digest was sent')
+            continue
+        metrics.observe('email_send', seconds, labels, upload=upload, started=started)
+        if error_msg:
+            metrics.STAGE_FAILURES.labels(stage='email_send', **labels).inc()
+        _finish(upload, labels, ImageUpload.Status.FAILED if error_msg else ImageUpload.Status.COMPLETED, error_msg)
+    logger.info(f"Sent email digest of {len(with_pdf)} PDFs to {email}")
+
+def requeue_failed_uploads(uploads, batch_size=None, rate=None):
+    """Reset FAILED uploads to PENDING and enqueue them again at ``rate`` uploads per second.
+
+    ``uploads`` is narrowed to FAILED rows that still have their image, so
+    uploads already swept by cleanup_old_files are skipped. Each upload gets
+    its own countdown, and its pending timeout starts when that countdown
+    ends. Rows are reset with one UPDATE per batch of ``batch_size`` and each
+    batch is sent as a Celery group. Returns the number of uploads enqueued.
+    """
+    batch_size = batch_size or settings.REPROCESS_BATCH_SIZE
+    rate = rate or settings.REPROCESS_RATE
+    ids = list(
+        uploads.filter(status=ImageUpload.Status.FAILED, jpeg_file__gt='')
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    if not ids:
+        return 0
+
+    countdowns = {upload_id: index / rate for index, upload_id in enumerate(ids)}
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    now = timezone.now()
+    with transaction.atomic():
+        for batch in batches:
+            ImageUpload.objects.filter(id__in=batch, status=ImageUpload.Status.FAILED).update(
+                status=ImageUpload.Status.PENDING,
+                error_message=None,
+                task_id=None,
+                trace={},
+                pending_since=Case(*[
+                    When(id=upload_id, then=Value(now + timedelta(seconds=countdowns[upload_id])))
+                    for upload_id in batch
+                ]),
+            )
+    for batch in batches:
+        group([
+            process_image_upload.s(upload_id).set(countdown=countdowns[upload_id]) for upload_id in batch
+        ]).apply_async()
+    logger.info(f"Requeued {len(ids)} failed uploads in {len(batches)} batches")
+    return len(ids)
 
 @shared_task(bind=True)
 def process_image_upload(self, upload_id):
@@ -57,15 +336,25 @@ def process_image_upload(self, upload_id):
     try:
         image_upload = ImageUpload.objects.get(id=upload_id)
         image_upload.task_id = self.request.id
+        image_upload.trace = {'worker': self.request.hostname}
         image_upload.save()
+        labels = metrics.upload_labels(image_upload)
 
         # Check if the upload has been pending for too long
-        time_since_upload = timezone.now() - image_upload.timestamp
+        pending_since = image_upload.pending_since or image_upload.timestamp
+        time_since_upload = timezone.now() - pending_since
+        metrics.observe(
+            'queue_wait',
+            time_since_upload.total_seconds(),
+            labels,
+            upload=image_upload,
+            started=pending_since.timestamp(),
+        )
         if time_since_upload > timedelta(seconds=settings.PENDING_TIMEOUT_SECONDS):
             error_msg = f'Upload timed out after {settings.PENDING_TIMEOUT_SECONDS} seconds'
             logger.error(f"Upload {upload_id}: {error_msg}")
-            image_upload.update_status(ImageUpload.Status.FAILED, error_msg)
-            return {'status': 'error', 'message': error_msg}
+            _finish(image_upload, labels, ImageUpload.Status.FAILED, error_msg)
+            return Outcome.TIMED_OUT.value
         
         # Add initial delay to show PENDING status
         time.sleep(2)
@@ -75,35 +364,44 @@ def process_image_upload(self, upload_id):
         time.sleep(3)  # Show converting status for 3 seconds
         
         # Access pdf_file property which will trigger conversion if needed
-        if not image_upload.pdf_file:
+        with profile_upload(image_upload), metrics.timed('convert', labels, upload=image_upload):
+            converted = image_upload.pdf_file
+        if not converted:
             error_msg = 'Failed to convert image to PDF'
             logger.error(f"Upload {upload_id}: {error_msg}")
-            image_upload.update_status(ImageUpload.Status.FAILED, error_msg)
-            return {'status': 'error', 'message': error_msg}
+            _finish(image_upload, labels, ImageUpload.Status.FAILED, error_msg)
+            return Outcome.CONVERT_FAILED.value
             
         # Send email
         image_upload.update_status(ImageUpload.Status.SENDING)
+        if settings.EMAIL_DIGEST_SECONDS:
+            _hold_for_digest(image_upload)
+            return Outcome.DIGEST_QUEUED.value
         time.sleep(2)  # Show sending status for 2 seconds
         
-        if not image_upload.send_pdf_email():
+        with metrics.timed('email_send', labels, upload=image_upload):
+            sent = image_upload.send_pdf_email()
+        if not sent:
             error_msg = 'Failed to send email'
             logger.error(f"Upload {upload_id}: {error_msg}")
-            image_upload.update_status(ImageUpload.Status.FAILED, error_msg)
-            return {'status': 'error', 'message': error_msg}
+            metrics.STAGE_FAILURES.labels(stage='email_send', **labels).inc()
+            _finish(image_upload, labels, ImageUpload.Status.FAILED, error_msg)
+            return Outcome.EMAIL_FAILED.value
         
-        image_upload.update_status(ImageUpload.Status.COMPLETED)
-        return {'status': 'success', 'message': 'File processed and sent successfully'}
+        _finish(image_upload, labels, ImageUpload.Status.COMPLETED)
+        return Outcome.COMPLETED.value
         
     except ImageUpload.DoesNotExist:
         error_msg = 'Upload not found'
         logger.error(f"Upload {upload_id}: {error_msg}")
-        return {'status': 'error', 'message': error_msg}
+        return Outcome.NOT_FOUND.value
         
     except Exception as e:
         error_msg = str(e)
         logger.exception(f"Upload {upload_id}: Unexpected error during processing")
         try:
             image_upload.update_status(ImageUpload.Status.FAILED, error_msg)
+            _notify(image_upload)
         except:
             pass
-        return {'status': 'error', 'message': error_msg} 
\ No newline at end of file
+        return Outcome.ERROR.value 
\ No newline at end of file
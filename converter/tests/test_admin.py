@@ -0,0 +1,126 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from unittest.mock import patch
+from ..admin import ImageUploadAdmin, dashboard_stats
+from ..models import ImageUpload
+
+
+class ImageUploadAdminTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.failed = ImageUpload.objects.create(email='a@example.com', jpeg_file='uploads/jpg/a.jpg')
+        self.swept = ImageUpload.objects.create(email='b@example.com', jpeg_file='')
+        ImageUpload.objects.update(status=ImageUpload.Status.FAILED, error_message='Failed to send email')
+
+    @patch('converter.tasks.group')
+    def test_reprocess_action_skips_swept_uploads(self, mock_group):
+        """Test the action requeues failed uploads that still have an image"""
+        response = self.client.post(reverse('admin:converter_imageupload_changelist'), {
+            'action': 'reprocess_failed',
+            '_selected_action': [self.failed.id, self.swept.id],
+        }, follow=True)
+        self.assertContains(response, 'Requeued 1 failed uploads.')
+        self.assertContains(response, 'Skipped 1 uploads')
+        self.failed.refresh_from_db()
+        self.swept.refresh_from_db()
+        self.assertEqual(self.failed.status, ImageUpload.Status.PENDING)
+        self.assertEqual(self.swept.status, ImageUpload.Status.FAILED)
+        mock_group.return_value.apply_async.assert_called_once()
+
+    def test_profile_action(self):
+        """Test the action flags uploads for profiling"""
+        self.client.post(reverse('admin:converter_imageupload_changelist'), {
+            'action': 'profile_next_run',
+            '_selected_action': [self.failed.id],
+        })
+        self.failed.refresh_from_db()
+        self.assertTrue(self.failed.profile)
+
+
+class ImageUploadChangeListTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        now = timezone.now()
+        self.uploads = [
+            ImageUpload.objects.create(email=f'user{i}@example.com', jpeg_file='uploads/jpg/x.jpg')
+            for i in range(5)
+        ]
+        for i, upload in enumerate(self.uploads):
+            upload.timestamp = now - timedelta(minutes=i)
+            upload.status = ImageUpload.Status.COMPLETED if i % 2 else ImageUpload.Status.FAILED
+            upload.save()
+        self.url = reverse('admin:converter_imageupload_changelist')
+
+    def ids(self, response):
+        return [upload.id for upload in response.context['cl'].result_list]
+
+    @patch.object(ImageUploadAdmin, 'list_per_page', 2)
+    def test_keyset_pagination(self):
+        """Test pages follow the cursor without gaps or repeats"""
+        seen = []
+        response = self.client.get(self.url)
+        while True:
+            seen += self.ids(response)
+            next_url = response.context['cl'].next_url
+            if not next_url:
+                break
+            self.assertIn('after=', next_url)
+            response = self.client.get(self.url + next_url)
+        self.assertEqual(seen, [upload.id for upload in self.uploads])
+
+    @patch.object(ImageUploadAdmin, 'list_per_page', 2)
+    def test_cursor_is_kept_out_of_filters(self):
+        """Test the cursor combines with the status filter"""
+        response = self.client.get(self.url, {'status__exact': ImageUpload.Status.FAILED})
+        self.assertEqual(self.ids(response), [self.uploads[0].id, self.uploads[2].id])
+        response = self.client.get(self.url + response.context['cl'].next_url)
+        self.assertEqual(self.ids(response), [self.uploads[4].id])
+        self.assertIsNone(response.context['cl'].next_url)
+
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_count_is_capped(self):
+        """Test the result count stops at ADMIN_COUNT_LIMIT"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertContains(response, 'More than 3')
+
+
+class DashboardTest(TestCase):
+    def setUp(self):
+        cache.delete('converter.admin.dashboard')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        now = timezone.now()
+        for minutes, status in [(5, 'COMPLETED'), (90, 'COMPLETED'), (30, 'FAILED'), (3000, 'COMPLETED')]:
+            upload = ImageUpload.objects.create(email='a@example.com', jpeg_file='uploads/jpg/x.jpg')
+            ImageUpload.objects.filter(id=upload.id).update(
+                status=status, timestamp=now - timedelta(minutes=minutes))
+
+    def tearDown(self):
+        cache.delete('converter.admin.dashboard')
+
+    def test_counts_per_status_and_window(self):
+        """Test hour and day counts come from one query"""
+        with self.assertNumQueries(1):
+            stats = dashboard_stats()
+        rows = {row['status']: row for row in stats['statuses']}
+        self.assertEqual((rows['Completed']['last_hour'], rows['Completed']['last_day']), (1, 2))
+        self.assertEqual((rows['Failed']['last_hour'], rows['Failed']['last_day']), (1, 1))
+        self.assertEqual(stats['total_day'], 3)
+        self.assertAlmostEqual(stats['completed_per_hour'], 2 / 24)
+
+    def test_stats_are_cached(self):
+        """Test repeated loads reuse the cached aggregate"""
+        dashboard_stats()
+        with self.assertNumQueries(0):
+            dashboard_stats()
+
+    def test_dashboard_page(self):
+        """Test the dashboard renders for staff"""
+        response = self.client.get(reverse('admin:converter_imageupload_dashboard'))
+        self.assertContains(response, 'Upload dashboard')
+        self.assertContains(response, 'Completed')
@@ -0,0 +1,202 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+from ..models import ImageUpload, sharded_name
+from .test_utils import TestFileManager
+from ..tasks import cleanup_old_files
+from faker import Faker
+from PIL import Image, PdfParser
+from io import StringIO
+from datetime import timedelta
+from unittest.mock import patch
+import os
+import shutil
+import tempfile
+
+
+class ShardUploadsCommandTest(TestCase):
+    def setUp(self):
+        self.fake = Faker()
+        test_file = TestFileManager.create_test_image(
+            format='JPEG',
+            mode='RGB',
+            size=(100, 100),
+            color='red'
+        )
+        self.upload = ImageUpload.objects.create(
+            email=self.fake.email(),
+            jpeg_file=test_file
+        )
+        # Move the file back into the legacy flat layout
+        self.legacy_name = f'uploads/jpg/{os.path.basename(self.upload.jpeg_file.name)}'
+        shutil.move(self.upload.jpeg_file.path, os.path.join(settings.MEDIA_ROOT, self.legacy_name))
+        ImageUpload.objects.filter(id=self.upload.id).update(jpeg_file=self.legacy_name)
+
+    def tearDown(self):
+        self.upload.refresh_from_db()
+        if self.upload.jpeg_file and os.path.exists(self.upload.jpeg_file.path):
+            os.remove(self.upload.jpeg_file.path)
+
+    def test_moves_flat_files_into_shards(self):
+        """Test legacy files are moved and the row is updated"""
+        call_command('shard_uploads', stdout=StringIO())
+        self.upload.refresh_from_db()
+        expected = sharded_name('uploads/jpg', self.legacy_name)
+        self.assertEqual(self.upload.jpeg_file.name, expected)
+        self.assertTrue(os.path.exists(self.upload.jpeg_file.path))
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, self.legacy_name)))
+
+    def test_dry_run_changes_nothing(self):
+        """Test dry run leaves files and rows untouched"""
+        out = StringIO()
+        call_command('shard_uploads', '--dry-run', stdout=out)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.jpeg_file.name, self.legacy_name)
+        self.assertIn('Would move 1', out.getvalue())
+
+    def test_resumes_after_interrupted_run(self):
+        """Test a file moved by a run that died before updating its row gets the row fixed"""
+        expected = sharded_name('uploads/jpg', self.legacy_name)
+        os.makedirs(os.path.dirname(os.path.join(settings.MEDIA_ROOT, expected)), exist_ok=True)
+        shutil.move(os.path.join(settings.MEDIA_ROOT, self.legacy_name), os.path.join(settings.MEDIA_ROOT, expected))
+        err = StringIO()
+        call_command('shard_uploads', stdout=StringIO(), stderr=err)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.jpeg_file.name, expected)
+        self.assertEqual(err.getvalue(), '')
+
+    def test_already_sharded_files_are_skipped(self):
+        """Test running twice is a no-op the second time"""
+        call_command('shard_uploads', stdout=StringIO())
+        out = StringIO()
+        call_command('shard_uploads', stdout=out)
+        self.assertIn('Moved 0', out.getvalue())
+
+
+class ConvertBulkCommandTest(TestCase):
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(settings.MEDIA_ROOT, 'test-bulk', os.path.basename(self.input_dir))
+        os.makedirs(os.path.join(self.input_dir, 'nested'))
+        for name, color in [('a.jpg', 'red'), ('b.png', 'blue'), ('nested/c.jpg', 'green')]:
+            Image.new('RGB', (40, 30), color).save(os.path.join(self.input_dir, name))
+        with open(os.path.join(self.input_dir, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, 'test-bulk'), ignore_errors=True)
+
+    def convert(self, *args):
+        out = StringIO()
+        call_command(
+            'convert_bulk', '--input-dir', self.input_dir, '--output-dir', self.output_dir,
+            '--workers', '2', *args, stdout=out, stderr=StringIO(),
+        )
+        return out.getvalue()
+
+    def test_converts_directory_keeping_structure(self):
+        """Test each image becomes a PDF at the same relative path"""
+        self.convert()
+        for name in ('a.pdf', 'b.pdf', 'nested/c.pdf'):
+            with open(os.path.join(self.output_dir, name), 'rb') as f:
+                self.assertTrue(f.read().startswith(b'%PDF'))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'notes.pdf')))
+
+    def test_resumes_from_checkpoint(self):
+        """Test a second run skips files already converted"""
+        self.convert()
+        os.remove(os.path.join(self.output_dir, 'a.pdf'))
+        out = self.convert()
+        self.assertIn('Converted 0 files', out)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'a.pdf')))
+
+        self.convert('--restart')
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'a.pdf')))
+
+    def test_combined_pdf_keeps_input_order(self):
+        """Test --combined writes one page per image in path order"""
+        self.convert('--combined', 'all.pdf')
+        with PdfParser.PdfParser(os.path.join(self.output_dir, 'all.pdf')) as pdf:
+            self.assertEqual(len(pdf.pages), 3)
+
+    def test_register_creates_completed_uploads(self):
+        """Test --register bulk creates rows pointing at the PDFs"""
+        self.convert('--register', 'partner@example.com', '--batch-size', '2')
+        uploads = ImageUpload.objects.filter(email='partner@example.com')
+        self.assertEqual(uploads.count(), 3)
+        for upload in uploads:
+            self.assertEqual(upload.status, ImageUpload.Status.COMPLETED)
+            self.assertTrue(os.path.exists(upload._pdf_file.path))
+            self.assertEqual(upload.trace['pages'], 1)
+
+        # Registered PDFs outlive the FILE_CLEANUP_MINUTES sweep
+        uploads.update(timestamp=timezone.now() - timedelta(days=1))
+        cleanup_old_files()
+        for upload in uploads:
+            self.assertTrue(os.path.exists(upload._pdf_file.path))
+
+    def test_register_checkpoints_only_created_rows(self):
+        """Test files whose rows were never written are converted and registered again on resume"""
+        with patch.object(ImageUpload.objects, 'bulk_create', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                self.convert('--register', 'partner@example.com', '--batch-size', '2')
+        out = self.convert('--register', 'partner@example.com', '--batch-size', '2')
+        self.assertIn('Converted 3 files', out)
+        self.assertEqual(ImageUpload.objects.filter(email='partner@example.com').count(), 3)
+
+    def test_register_requires_output_in_media_root(self):
+        """Test --register refuses PDFs that storage could not serve"""
+        with self.assertRaises(CommandError):
+            call_command(
+                'convert_bulk', '--input-dir', self.input_dir, '--output-dir', self.input_dir,
+                '--register', 'partner@example.com', stdout=StringIO(),
+            )
+
+
+class ReprocessFailedCommandTest(TestCase):
+    def setUp(self):
+        self.fake = Faker()
+        now = timezone.now()
+        self.smtp = ImageUpload.objects.create(email=self.fake.email(), jpeg_file='uploads/jpg/a.jpg')
+        self.broker = ImageUpload.objects.create(email=self.fake.email(), jpeg_file='uploads/jpg/b.jpg')
+        self.old = ImageUpload.objects.create(email=self.fake.email(), jpeg_file='uploads/jpg/c.jpg')
+        ImageUpload.objects.filter(id=self.smtp.id).update(
+            status=ImageUpload.Status.FAILED, error_message='Failed to send email')
+        ImageUpload.objects.filter(id=self.broker.id).update(
+            status=ImageUpload.Status.FAILED, error_message='Failed to start processing task')
+        ImageUpload.objects.filter(id=self.old.id).update(
+            status=ImageUpload.Status.FAILED, error_message='Failed to send email',
+            timestamp=now - timedelta(days=2))
+
+    @patch('converter.management.commands.reprocess_failed.requeue_failed_uploads', return_value=1)
+    def test_filters_by_error_and_window(self, mock_requeue):
+        """Test only failures matching the pattern inside the window are passed on"""
+        call_command('reprocess_failed', '--error', 'send email', '--minutes', '60', stdout=StringIO())
+        uploads = mock_requeue.call_args.args[0]
+        self.assertEqual(list(uploads), [self.smtp])
+
+    def test_dry_run_reports_count(self):
+        """Test dry run reports matches without resetting rows"""
+        out = StringIO()
+        call_command('reprocess_failed', '--error', '^Failed', '--dry-run', stdout=out)
+        self.assertIn('Would requeue 3 uploads', out.getvalue())
+        self.assertEqual(ImageUpload.objects.filter(status=ImageUpload.Status.FAILED).count(), 3)
+
+    def test_invalid_pattern(self):
+        """Test a broken regex is reported instead of reaching the database"""
+        with self.assertRaises(CommandError):
+            call_command('reprocess_failed', '--error', '(', stdout=StringIO())
+
+
+class RelayOutboxCommandTest(TestCase):
+    @patch('converter.management.commands.relay_outbox.outbox.relay', side_effect=[2, 2, 1])
+    def test_once_drains_outbox(self, mock_relay):
+        """Test --once keeps publishing full batches and stops after a partial one"""
+        out = StringIO()
+        call_command('relay_outbox', '--once', '--batch-size', '2', stdout=out)
+        self.assertEqual(mock_relay.call_count, 3)
+        self.assertIn('Published 5 tasks', out.getvalue())
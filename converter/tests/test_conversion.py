@@ -0,0 +1,231 @@
+from django.test import SimpleTestCase
+from PIL import Image, ImageDraw, PdfParser
+from unittest.mock import patch
+from ..conversion import (
+    SIZE_LADDER, convert_to_pdf, classify, encode_page, flatten, iter_pages, prepare_page, ConversionError,
+)
+from .. import conversion
+import io
+
+
+def make_multiframe(format, frames, size=(64, 48)):
+    """Build a multi-frame image in memory with a different colour per frame."""
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+    images = [Image.new('RGB', size, colors[i % len(colors)]) for i in range(frames)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format=format, save_all=True, append_images=images[1:])
+    buffer.seek(0)
+    return buffer
+
+
+def page_count(pdf_bytes):
+    return len(PdfParser.PdfParser(buf=pdf_bytes).pages)
+
+
+class ConvertToPdfTest(SimpleTestCase):
+    def convert(self, source, **kwargs):
+        output = io.BytesIO()
+        result = convert_to_pdf(source, output, **kwargs)
+        return result.pages, output.getvalue()
+
+    def test_single_frame_image(self):
+        """Test a plain JPEG becomes a one-page PDF"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100), 'red').save(buffer, format='JPEG')
+        buffer.seek(0)
+        pages, pdf = self.convert(buffer)
+        self.assertEqual(pages, 1)
+        self.assertEqual(page_count(pdf), 1)
+        self.assertTrue(pdf.startswith(b'%PDF-'))
+
+    def test_multipage_tiff(self):
+        """Test every TIFF page becomes a PDF page"""
+        pages, pdf = self.convert(make_multiframe('TIFF', 5))
+        self.assertEqual(pages, 5)
+        self.assertEqual(page_count(pdf), 5)
+
+    def test_animated_gif(self):
+        """Test every GIF frame becomes a PDF page"""
+        pages, pdf = self.convert(make_multiframe('GIF', 3))
+        self.assertEqual(pages, 3)
+        self.assertEqual(page_count(pdf), 3)
+
+    def test_page_size_follows_resolution(self):
+        """Test the media box is derived from pixel size and resolution"""
+        _, pdf = self.convert(make_multiframe('TIFF', 1, size=(200, 100)), resolution=100.0)
+        parser = PdfParser.PdfParser(buf=pdf)
+        page = parser.read_indirect(parser.pages[0])
+        self.assertEqual([float(v) for v in page[b'MediaBox']], [0, 0, 144.0, 72.0])
+
+    def test_frame_cap(self):
+        """Test inputs with more frames than allowed are rejected before decoding"""
+        with self.assertRaises(ConversionError):
+            self.convert(make_multiframe('TIFF', 4), max_pages=3)
+
+
+class ParallelPagesTest(SimpleTestCase):
+    def test_threaded_output_matches_serial(self):
+        """Test pages encoded in threads are assembled into the same PDF, in frame order"""
+        outputs = []
+        for threads in (1, 3):
+            output = io.BytesIO()
+            result = convert_to_pdf(make_multiframe('TIFF', 9), output, threads=threads, max_in_flight=2)
+            self.assertEqual(result.pages, 9)
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(page_count(outputs[1]), 9)
+
+    def test_threaded_size_search(self):
+        """Test the size search works with threaded encoding"""
+        output = io.BytesIO()
+        result = convert_to_pdf(make_multiframe('TIFF', 4, size=(400, 300)), output,
+                                max_bytes=20 * 1024, threads=2)
+        self.assertLessEqual(result.size, 20 * 1024)
+        self.assertEqual(page_count(output.getvalue()), 4)
+
+    def test_pages_in_flight_are_bounded(self):
+        """Test no more than max_in_flight frames are decoded ahead of the consumer"""
+        encoded = []
+        real_encode = conversion._encode_frame
+
+        def encode(*args):
+            encoded.append(args[0])
+            return real_encode(*args)
+
+        with patch('converter.conversion._encode_frame', side_effect=encode), \
+                Image.open(make_multiframe('TIFF', 8)) as image:
+            pages = iter_pages(image, 75, 1.0, '#ffffff', False, threads=4, max_in_flight=3)
+            next(pages)
+            self.assertLessEqual(len(encoded), 4)
+            self.assertEqual(len(list(pages)), 7)
+
+    def test_page_errors_propagate(self):
+        """Test a failing page fails the conversion"""
+        with patch('converter.conversion.encode_page', side_effect=OSError('encoder error')):
+            with self.assertRaises(OSError):
+                convert_to_pdf(make_multiframe('TIFF', 4), io.BytesIO(), threads=2)
+
+
+class FlattenTest(SimpleTestCase):
+    def test_transparent_pixels_take_background(self):
+        """Test fully transparent pixels become the background colour"""
+        image = Image.new('RGBA', (10, 10), (255, 0, 0, 0))
+        flattened = flatten(image, background='#00ff00')
+        self.assertEqual(flattened.mode, 'RGB')
+        self.assertEqual(flattened.getpixel((0, 0)), (0, 255, 0))
+
+    def test_partial_alpha_is_blended(self):
+        """Test half transparent pixels are blended with the background"""
+        image = Image.new('RGBA', (10, 10), (0, 0, 0, 128))
+        r, g, b = flatten(image, background='#ffffff').getpixel((5, 5))
+        self.assertTrue(120 <= r <= 135)
+
+    def test_opaque_alpha_is_dropped(self):
+        """Test fully opaque images keep their colours"""
+        image = Image.new('RGBA', (10, 10), (10, 20, 30, 255))
+        self.assertEqual(flatten(image, background='#ffffff').getpixel((0, 0)), (10, 20, 30))
+
+    def test_palette_transparency(self):
+        """Test palette images with a transparent index are flattened"""
+        image = Image.new('P', (10, 10), 0)
+        image.putpalette([0, 0, 0, 255, 0, 0])
+        image.info['transparency'] = 0
+        self.assertEqual(prepare_page(image, background='#0000ff').getpixel((0, 0)), (0, 0, 255))
+
+    def test_luminance_alpha(self):
+        """Test LA images are flattened to RGB"""
+        image = Image.new('LA', (10, 10), (0, 0))
+        self.assertEqual(prepare_page(image).getpixel((0, 0)), (255, 255, 255))
+
+
+def make_letter(size=(600, 800), paper=(250, 248, 245), ink=(20, 20, 25)):
+    """Draw a page of dark text lines on light paper."""
+    image = Image.new('RGB', size, paper)
+    draw = ImageDraw.Draw(image)
+    for y in range(40, size[1] - 40, 24):
+        draw.rectangle((40, y, size[0] - 40, y + 6), fill=ink)
+    return image
+
+
+class DocumentModeTest(SimpleTestCase):
+    def test_classify_text_page_as_bilevel(self):
+        """Test ink on paper is detected as black and white"""
+        self.assertEqual(classify(make_letter())[0], 'bilevel')
+
+    def test_classify_neutral_photo_as_gray(self):
+        """Test a neutral page with midtones is detected as grayscale"""
+        gradient = Image.linear_gradient('L').resize((300, 300)).convert('RGB')
+        self.assertEqual(classify(gradient)[0], 'gray')
+
+    def test_classify_colour_image(self):
+        """Test colourful content is left in colour"""
+        self.assertEqual(classify(make_letter(ink=(200, 30, 30), paper=(30, 120, 200)))[0], 'color')
+
+    def test_prepare_page_only_reduces_in_document_mode(self):
+        """Test pages keep RGB unless document mode is requested"""
+        page = make_letter()
+        self.assertEqual(prepare_page(page).mode, 'RGB')
+        self.assertEqual(prepare_page(page, document_mode=True).mode, '1')
+
+    def test_bilevel_page_encoding(self):
+        """Test 1-bit pages are stored as Flate compressed DeviceGray"""
+        encoded = encode_page(prepare_page(make_letter(), document_mode=True))
+        self.assertEqual(encoded.bits_per_component, 1)
+        self.assertEqual(encoded.color_space, 'DeviceGray')
+        self.assertEqual(encoded.filter, 'FlateDecode')
+
+    def test_document_mode_shrinks_output(self):
+        """Test a scanned letter produces a smaller PDF in document mode"""
+        buffer = io.BytesIO()
+        make_letter().save(buffer, format='PNG')
+        colour, bilevel = io.BytesIO(), io.BytesIO()
+        buffer.seek(0)
+        convert_to_pdf(buffer, colour)
+        buffer.seek(0)
+        convert_to_pdf(buffer, bilevel, document_mode=True)
+        self.assertLess(len(bilevel.getvalue()), len(colour.getvalue()))
+        self.assertEqual(page_count(bilevel.getvalue()), 1)
+
+
+def make_noise(size=(800, 600)):
+    """Random noise compresses badly, which makes size targets easy to exercise."""
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 80).convert('RGB').save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+class SizeTargetTest(SimpleTestCase):
+    def test_presets_order_by_size(self):
+        """Test smallest < balanced < lossless for the same input"""
+        sizes = {}
+        for preset in ('smallest', 'balanced', 'lossless'):
+            output = io.BytesIO()
+            sizes[preset] = convert_to_pdf(make_noise(), output, preset=preset).size
+            self.assertEqual(sizes[preset], len(output.getvalue()))
+        self.assertLess(sizes['smallest'], sizes['balanced'])
+        self.assertLess(sizes['balanced'], sizes['lossless'])
+
+    def test_preset_kept_when_it_fits(self):
+        """Test no search happens when the preset output is under the target"""
+        result = convert_to_pdf(make_noise(), io.BytesIO(), max_bytes=10 * 1024 * 1024)
+        self.assertEqual((result.quality, result.scale), (75, 1.0))
+
+    def test_search_fits_target(self):
+        """Test the search lowers quality or scale until the PDF fits"""
+        output = io.BytesIO()
+        result = convert_to_pdf(make_noise(), output, max_bytes=60 * 1024)
+        self.assertLessEqual(len(output.getvalue()), 60 * 1024)
+        self.assertEqual(result.size, len(output.getvalue()))
+        self.assertIn((result.quality, result.scale), SIZE_LADDER)
+        self.assertEqual(page_count(output.getvalue()), 1)
+
+    def test_hint_is_used_when_it_fits(self):
+        """Test a fitting hint short-circuits the search"""
+        result = convert_to_pdf(make_noise(), io.BytesIO(), max_bytes=60 * 1024, hint=(30, 0.25))
+        self.assertEqual((result.quality, result.scale), (30, 0.25))
+
+    def test_unreachable_target(self):
+        """Test an impossible target fails once the iteration cap is reached"""
+        with self.assertRaises(ConversionError):
+            convert_to_pdf(make_noise(), io.BytesIO(), max_bytes=100, max_iterations=3)
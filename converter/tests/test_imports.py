@@ -0,0 +1,25 @@
+from django.test import SimpleTestCase
+from ..formats import supported_extensions
+import os
+import subprocess
+import sys
+
+
+class LazyImportTest(SimpleTestCase):
+    def test_web_tier_does_not_load_pillow(self):
+        """Test loading the app and URLconf leaves Pillow and numpy unimported"""
+        code = (
+            'import sys, django; django.setup(); import jpgtopdf.urls; '
+            'print(",".join(m for m in ("PIL", "numpy") if m in sys.modules))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='jpgtopdf.settings'),
+            capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_supported_extensions(self):
+        """Test the lazily built extension list covers the common formats"""
+        for extension in ('.jpg', '.jpeg', '.png', '.tif', '.gif'):
+            self.assertIn(extension, supported_extensions())
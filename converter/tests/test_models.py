@@ -1,7 +1,7 @@
 from django.test import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.files.base import ContentFile
-from PIL import Image
+from PIL import Image, PdfParser
 import io
 import os
 from ..models import ImageUpload
@@ -60,6 +60,17 @@ class ImageUploadModelTest(TestCase):
         self.assertTrue(self.upload.jpeg_file.name.startswith('uploads/jpg/'))
         self.assertTrue(self.upload.jpeg_file.name.endswith('.jpg'))
 
+    def test_file_paths_are_sharded(self):
+        """Test uploads land in a two-level shard with a unique name"""
+        parts = self.upload.jpeg_file.name.split('/')
+        self.assertEqual(len(parts), 5)
+        self.assertEqual(len(parts[2]), 2)
+        self.assertEqual(len(parts[3]), 2)
+        self.assertNotEqual(parts[4], 'test.jpg')
+
+        pdf_file = self.upload.pdf_file
+        self.assertEqual(pdf_file.name.split('/')[2:4], parts[2:4])
+
     def test_pdf_file_property_creates_pdf(self):
         """Test that accessing pdf_file property creates PDF if it doesn't exist"""
         # Access pdf_file property
@@ -249,6 +260,58 @@ class ImageUploadModelTest(TestCase):
         if large_upload._pdf_file and os.path.exists(large_upload._pdf_file.path):
             os.remove(large_upload._pdf_file.path)
 
+    def test_pdf_file_property_with_multipage_tiff(self):
+        """Test pdf_file property keeps every page of a multi-page TIFF"""
+        pages = [Image.new('RGB', (100, 100), color) for color in ('red', 'green', 'blue')]
+        buffer = io.BytesIO()
+        pages[0].save(buffer, format='TIFF', save_all=True, append_images=pages[1:])
+        tiff_upload = ImageUpload.objects.create(
+            email="test@example.com",
+            jpeg_file=SimpleUploadedFile('fax.tiff', buffer.getvalue(), content_type='image/tiff')
+        )
+        # Access pdf_file property
+        pdf_file = tiff_upload.pdf_file
+        # Check all three pages were written
+        self.assertIsNotNone(pdf_file)
+        with open(pdf_file.path, 'rb') as f:
+            self.assertEqual(len(PdfParser.PdfParser(buf=f.read()).pages), 3)
+        # Clean up
+        if tiff_upload.jpeg_file and os.path.exists(tiff_upload.jpeg_file.path):
+            os.remove(tiff_upload.jpeg_file.path)
+        if tiff_upload._pdf_file and os.path.exists(tiff_upload._pdf_file.path):
+            os.remove(tiff_upload._pdf_file.path)
+
+    def test_pdf_file_property_records_size_search(self):
+        """Test the chosen quality and scale are stored and reused as a hint"""
+        noise = io.BytesIO()
+        Image.effect_noise((800, 600), 80).convert('RGB').save(noise, format='PNG')
+        uploads = [
+            ImageUpload.objects.create(
+                email="test@example.com",
+                jpeg_file=SimpleUploadedFile('noise.png', noise.getvalue(), content_type='image/png'),
+                max_pdf_bytes=60 * 1024
+            )
+            for _ in range(2)
+        ]
+        # Convert the first upload
+        self.assertIsNotNone(uploads[0].pdf_file)
+        uploads[0].refresh_from_db()
+        self.assertIsNotNone(uploads[0].pdf_quality)
+        self.assertIsNotNone(uploads[0].pdf_scale)
+        self.assertLessEqual(uploads[0]._pdf_file.size, 60 * 1024)
+        # The second upload starts from the first upload's result
+        uploads[1].input_bytes = uploads[1].jpeg_file.size
+        self.assertEqual(
+            uploads[1].size_search_hint(),
+            (uploads[0].pdf_quality, uploads[0].pdf_scale)
+        )
+        # Clean up
+        for upload in uploads:
+            if upload.jpeg_file and os.path.exists(upload.jpeg_file.path):
+                os.remove(upload.jpeg_file.path)
+            if upload._pdf_file and os.path.exists(upload._pdf_file.path):
+                os.remove(upload._pdf_file.path)
+
     def test_pdf_file_property_preserves_filename(self):
         """Test that PDF filename is derived from original image filename"""
         # Access pdf_file property
@@ -0,0 +1,63 @@
+from django.test import TestCase, override_settings
+from ..models import ImageUpload
+from ..profiling import profile_upload
+from .test_utils import TestFileManager
+from faker import Faker
+import os
+import pstats
+import shutil
+import tempfile
+
+
+class ProfileUploadTest(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.upload = ImageUpload.objects.create(
+            email=Faker().email(),
+            jpeg_file=TestFileManager.create_test_image()
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        for path in (self.upload.jpeg_file, self.upload._pdf_file):
+            if path and os.path.exists(path.path):
+                os.remove(path.path)
+
+    def test_disabled_by_default(self):
+        """Test nothing is written when profiling is off"""
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_SAMPLE_RATE=0):
+            with profile_upload(self.upload):
+                self.upload.pdf_file
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_flagged_upload_is_profiled(self):
+        """Test a flagged upload produces a loadable profile and an allocation report"""
+        self.upload.profile = True
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_SAMPLE_RATE=0):
+            with profile_upload(self.upload):
+                self.upload.pdf_file
+        files = sorted(os.listdir(self.profile_dir))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].endswith('.alloc.txt'))
+        self.assertTrue(files[1].endswith('.prof'))
+        pstats.Stats(os.path.join(self.profile_dir, files[1]))
+        with open(os.path.join(self.profile_dir, files[0])) as f:
+            self.assertIn('Peak traced memory', f.read())
+
+    def test_sampling_rate(self):
+        """Test a sample rate of 1 profiles every upload"""
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_SAMPLE_RATE=1.0):
+            with profile_upload(self.upload):
+                pass
+        self.assertEqual(len(os.listdir(self.profile_dir)), 2)
+
+    def test_directory_is_bounded(self):
+        """Test old dumps are rotated out"""
+        for i in range(5):
+            with open(os.path.join(self.profile_dir, f'old-{i}.prof'), 'w'):
+                pass
+        self.upload.profile = True
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_MAX_FILES=3):
+            with profile_upload(self.upload):
+                pass
+        self.assertEqual(len(os.listdir(self.profile_dir)), 3)
@@ -35,6 +35,42 @@ class ImageUploadSerializerTest(APITestCase):
         serializer = ImageUploadSerializer(data=self.valid_data)
         self.assertTrue(serializer.is_valid())
 
+    def test_callback_url_must_be_http(self):
+        """Test the callback URL accepts http(s) only"""
+        for url, valid in [('https://client.example.com/hook', True), ('ftp://client.example.com/hook', False)]:
+            with self.subTest(url=url):
+                serializer = ImageUploadSerializer(data={**self.valid_data, 'callback_url': url})
+                self.assertEqual(serializer.is_valid(), valid)
+
+    def test_callback_url_is_write_only(self):
+        """Test the callback URL is accepted but never returned"""
+        serializer = ImageUploadSerializer(data={**self.valid_data, 'callback_url': 'https://client.example.com/hook?token=s3cret'})
+        self.assertTrue(serializer.is_valid())
+        self.assertNotIn('callback_url', ImageUploadSerializer(ImageUpload(callback_url='https://client.example.com/hook')).data)
+
+    def test_document_mode_defaults_off(self):
+        """Test document mode is optional and disabled by default"""
+        serializer = ImageUploadSerializer(data=self.valid_data)
+        self.assertTrue(serializer.is_valid())
+        self.assertFalse(serializer.validated_data.get('document_mode', False))
+
+        serializer = ImageUploadSerializer(data={**self.valid_data, 'document_mode': True})
+        self.assertTrue(serializer.is_valid())
+        self.assertTrue(serializer.validated_data['document_mode'])
+
+    def test_size_target_options(self):
+        """Test preset and max_pdf_bytes validation"""
+        serializer = ImageUploadSerializer(data={**self.valid_data, 'preset': 'smallest', 'max_pdf_bytes': 1024 * 1024})
+        self.assertTrue(serializer.is_valid())
+
+        serializer = ImageUploadSerializer(data={**self.valid_data, 'preset': 'tiny'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('preset', serializer.errors)
+
+        serializer = ImageUploadSerializer(data={**self.valid_data, 'max_pdf_bytes': 100})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('max_pdf_bytes', serializer.errors)
+
     def test_invalid_email(self):
         """Test serializer with invalid email"""
         serializer = ImageUploadSerializer(data=self.invalid_email_data)
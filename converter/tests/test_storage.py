@@ -0,0 +1,101 @@
+from django.test import TestCase, override_settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from unittest.mock import patch
+from ..models import ImageUpload
+from ..storage import EphemeralStorage, upload_storage, storage_roots
+from .test_utils import TestFileManager
+import errno
+import os
+import shutil
+import tempfile
+
+
+class EphemeralStorageTest(TestCase):
+    def setUp(self):
+        self.ephemeral_root = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.ephemeral_root)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_saves_to_ephemeral_location(self):
+        """Test files that fit are written to the ephemeral location"""
+        storage = EphemeralStorage(location=self.ephemeral_root, admission_wait=0)
+        name = storage.save('uploads/pdf/a.pdf', ContentFile(b'%PDF-1.4'))
+        self.assertTrue(os.path.exists(os.path.join(self.ephemeral_root, name)))
+        self.assertEqual(storage.path(name), os.path.join(self.ephemeral_root, name))
+        with storage.open(name) as f:
+            self.assertEqual(f.read(), b'%PDF-1.4')
+        storage.delete(name)
+        self.assertFalse(storage.exists(name))
+
+    def test_falls_back_to_disk_when_full(self):
+        """Test a save over the cap goes to MEDIA_ROOT under the same name"""
+        storage = EphemeralStorage(location=self.ephemeral_root, max_bytes=1, admission_wait=0)
+        name = storage.save('uploads/pdf/a.pdf', ContentFile(b'%PDF-1.4'))
+        self.assertEqual(name, 'uploads/pdf/a.pdf')
+        self.assertEqual(storage.path(name), os.path.join(self.media_root, name))
+        self.assertEqual(storage.size(name), 8)
+
+    def test_url_follows_file_location(self):
+        """Test URLs point below the mount for ephemeral files and at MEDIA_URL for disk files"""
+        ephemeral_root = os.path.join(self.media_root, 'ephemeral')
+        storage = EphemeralStorage(location=ephemeral_root, admission_wait=0)
+        name = storage.save('uploads/pdf/a.pdf', ContentFile(b'%PDF-1.4'))
+        self.assertEqual(storage.url(name), '/media/ephemeral/uploads/pdf/a.pdf')
+
+        storage = EphemeralStorage(location=ephemeral_root, max_bytes=1, admission_wait=0)
+        name = storage.save('uploads/pdf/b.pdf', ContentFile(b'%PDF-1.4'))
+        self.assertEqual(storage.url(name), '/media/uploads/pdf/b.pdf')
+
+    def test_falls_back_to_disk_when_mount_fills_up(self):
+        """Test ENOSPC from a save that passed admission goes to MEDIA_ROOT"""
+        storage = EphemeralStorage(location=self.ephemeral_root, admission_wait=0)
+        real_save = FileSystemStorage._save
+
+        def save(fs, name, content):
+            if fs.location == self.ephemeral_root:
+                open(fs.path(name), 'wb').close()
+                raise OSError(errno.ENOSPC, 'No space left on device')
+            return real_save(fs, name, content)
+
+        os.makedirs(os.path.join(self.ephemeral_root, 'uploads/pdf'))
+        with patch.object(FileSystemStorage, '_save', save):
+            name = storage.save('uploads/pdf/a.pdf', ContentFile(b'%PDF-1.4'))
+        self.assertFalse(os.path.exists(os.path.join(self.ephemeral_root, name)))
+        self.assertEqual(storage.path(name), os.path.join(self.media_root, name))
+        with storage.open(name) as f:
+            self.assertEqual(f.read(), b'%PDF-1.4')
+
+    def test_waits_for_room_before_falling_back(self):
+        """Test admission retries until space is freed"""
+        storage = EphemeralStorage(location=self.ephemeral_root, admission_wait=5)
+        with patch.object(EphemeralStorage, 'has_room', side_effect=[False, False, True]), \
+                patch('converter.storage.time.sleep') as mock_sleep:
+            name = storage.save('uploads/pdf/a.pdf', ContentFile(b'%PDF'))
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.ephemeral_root, name)))
+
+    def test_upload_storage_setting(self):
+        """Test UPLOAD_STORAGE selects the storage used by the file fields"""
+        self.assertIs(upload_storage(), default_storage)
+        with override_settings(UPLOAD_STORAGE='ephemeral', EPHEMERAL_STORAGE_ROOT=self.ephemeral_root):
+            self.assertIsInstance(upload_storage(), EphemeralStorage)
+            self.assertIn(self.ephemeral_root, storage_roots())
+
+    def test_upload_round_trip(self):
+        """Test an upload and its PDF live in the ephemeral location"""
+        # The storage callable is evaluated once when the model is loaded
+        storage = EphemeralStorage(location=self.ephemeral_root)
+        with patch.object(ImageUpload._meta.get_field('jpeg_file'), 'storage', storage), \
+                patch.object(ImageUpload._meta.get_field('_pdf_file'), 'storage', storage):
+            upload = ImageUpload.objects.create(
+                email='a@example.com',
+                jpeg_file=TestFileManager.create_test_image(format='JPEG', mode='RGB', size=(50, 50), color='red'),
+            )
+            self.assertTrue(upload.pdf_file)
+            self.assertTrue(upload.jpeg_file.path.startswith(self.ephemeral_root))
+            self.assertTrue(upload._pdf_file.path.startswith(self.ephemeral_root))
@@ -1,14 +1,29 @@
 from django.test import TestCase, override_settings
 from unittest.mock import patch, PropertyMock
 from celery import Task
-from ..models import ImageUpload
-from ..tasks import process_image_upload, cleanup_old_files, cleanup_stuck_uploads
+from ..models import ImageUpload, trace_seconds
+from django.db.models import Max
+from ..tasks import (
+    process_image_upload, cleanup_old_files, cleanup_stuck_uploads, requeue_failed_uploads,
+    purge_old_uploads, reconcile_upload_files, send_email_digest, Outcome,
+)
 from .test_utils import TestFileManager
 from faker import Faker
+import io
 import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
 from django.utils import timezone
 from datetime import timedelta
 from django.conf import settings
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from jpgtopdf.celery import start_metrics_server
+from types import SimpleNamespace
+from prometheus_client import REGISTRY
 
 @override_settings(
     CELERY_TASK_ALWAYS_EAGER=True,
@@ -48,8 +63,47 @@ class TaskTests(TestCase):
         """Test successful processing of an upload"""
         result = process_image_upload(self.upload.id)
         self.upload.refresh_from_db()
-        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result, Outcome.COMPLETED)
         self.assertEqual(self.upload.status, ImageUpload.Status.COMPLETED)
+        [message] = mail.outbox
+        self.assertEqual(message.to, [self.upload.email])
+        self.assertEqual(len(message.attachments), 1)
+
+    @patch('time.sleep', return_value=None)
+    def test_processing_records_trace(self, mock_sleep):
+        """Test the trace is stored with the final status and can be aggregated"""
+        process_image_upload(self.upload.id)
+        self.upload.refresh_from_db()
+        trace = self.upload.trace
+        self.assertEqual(trace['engine'], 'balanced')
+        self.assertEqual(trace['pages'], 1)
+        self.assertEqual(trace['input_bytes'], self.upload.jpeg_file.size)
+        self.assertEqual(trace['output_bytes'], self.upload._pdf_file.size)
+        self.assertIn('worker', trace)
+        for stage in ('queue_wait', 'convert', 'decode', 'encode', 'storage_write', 'email_send', 'end_to_end'):
+            self.assertIn(stage, trace['stages'])
+            self.assertGreaterEqual(trace['stages'][stage]['seconds'], 0)
+
+        result = ImageUpload.objects.aggregate(convert=Max(trace_seconds('convert')))
+        self.assertEqual(result['convert'], trace['stages']['convert']['seconds'])
+
+    @patch('time.sleep', return_value=None)
+    def test_processing_records_stage_metrics(self, mock_sleep):
+        """Test processing records worker stage timings and the outcome"""
+        labels = {'format': 'jpeg', 'engine': 'balanced', 'size_bucket': '<100KB'}
+
+        def count(name, **extra):
+            return REGISTRY.get_sample_value(name, {**labels, **extra}) or 0
+
+        before = {
+            stage: count('jpgtopdf_stage_duration_seconds_count', stage=stage)
+            for stage in ('queue_wait', 'decode', 'encode', 'storage_write', 'email_send', 'end_to_end')
+        }
+        completed = count('jpgtopdf_uploads_total', status='COMPLETED')
+        process_image_upload(self.upload.id)
+        for stage, value in before.items():
+            self.assertEqual(count('jpgtopdf_stage_duration_seconds_count', stage=stage), value + 1, stage)
+        self.assertEqual(count('jpgtopdf_uploads_total', status='COMPLETED'), completed + 1)
 
     @patch('time.sleep', return_value=None)
     @patch('converter.models.ImageUpload.pdf_file', new_callable=PropertyMock, return_value=None)
@@ -59,7 +113,7 @@ class TaskTests(TestCase):
         self.upload.save()
         result = process_image_upload(self.upload.id)
         self.upload.refresh_from_db()
-        self.assertEqual(result['status'], 'error')
+        self.assertEqual(result, Outcome.CONVERT_FAILED)
         self.assertEqual(self.upload.status, ImageUpload.Status.FAILED)
         self.assertIsNotNone(self.upload.error_message)
 
@@ -67,8 +121,7 @@ class TaskTests(TestCase):
     def test_nonexistent_upload(self, mock_sleep):
         """Test handling of non-existent upload ID"""
         result = process_image_upload(99999)
-        self.assertEqual(result['status'], 'error')
-        self.assertEqual(result['message'], 'Upload not found')
+        self.assertEqual(result, Outcome.NOT_FOUND)
 
     def test_cleanup_old_files(self):
         """Test cleanup of old files"""
@@ -107,4 +160,255 @@ class TaskTests(TestCase):
         cleanup_stuck_uploads()
         stuck_upload.refresh_from_db()
         self.assertEqual(stuck_upload.status, ImageUpload.Status.FAILED)
-        self.assertIsNotNone(stuck_upload.error_message) 
\ No newline at end of file
+        self.assertIsNotNone(stuck_upload.error_message)
+
+    @patch('time.sleep', return_value=None)
+    def test_requeue_failed_uploads(self, mock_sleep):
+        """Test failed uploads are reset and processed again in batches"""
+        second = ImageUpload.objects.create(
+            email=self.fake.email(),
+            jpeg_file=TestFileManager.create_test_image(format='JPEG', mode='RGB', size=(50, 50), color='blue')
+        )
+        swept = ImageUpload.objects.create(email=self.fake.email(), jpeg_file='')
+        ImageUpload.objects.update(status=ImageUpload.Status.FAILED, error_message='Failed to send email')
+
+        requeued = requeue_failed_uploads(ImageUpload.objects.all(), batch_size=1, rate=100)
+
+        self.assertEqual(requeued, 2)
+        self.upload.refresh_from_db()
+        second.refresh_from_db()
+        swept.refresh_from_db()
+        self.assertEqual(self.upload.status, ImageUpload.Status.COMPLETED)
+        self.assertEqual(second.status, ImageUpload.Status.COMPLETED)
+        self.assertIsNone(second.error_message)
+        self.assertEqual(swept.status, ImageUpload.Status.FAILED)
+        second.jpeg_file.delete(save=False)
+        second._pdf_file.delete(save=False)
+
+    @patch('converter.tasks.group')
+    def test_requeue_spaces_uploads_by_rate(self, mock_group):
+        """Test every upload gets its own countdown and a matching pending start"""
+        for _ in range(2):
+            ImageUpload.objects.create(email=self.fake.email(), jpeg_file='uploads/jpg/missing.jpg')
+        ImageUpload.objects.update(status=ImageUpload.Status.FAILED)
+        timestamp = ImageUpload.objects.order_by('-id').first().timestamp
+        before = timezone.now()
+
+        requeue_failed_uploads(ImageUpload.objects.all(), batch_size=2, rate=1)
+
+        self.assertEqual(mock_group.call_count, 2)
+        countdowns = [
+            [signature.options['countdown'] for signature in call.args[0]]
+            for call in mock_group.call_args_list
+        ]
+        self.assertEqual(countdowns, [[0.0, 1.0], [2.0]])
+        latest = ImageUpload.objects.order_by('-id').first()
+        self.assertEqual(latest.status, ImageUpload.Status.PENDING)
+        self.assertEqual(latest.timestamp, timestamp)
+        self.assertGreaterEqual(latest.pending_since, before + timedelta(seconds=2))
+
+        # Rows still waiting for their countdown are not swept as stuck
+        ImageUpload.objects.update(timestamp=timezone.now() - timedelta(days=1))
+        cleanup_stuck_uploads()
+        self.assertEqual(ImageUpload.objects.get(id=latest.id).status, ImageUpload.Status.PENDING)
+
+        # ... and keep their image until their task has run
+        with patch('converter.tasks._remove_file') as mock_remove:
+            cleanup_old_files()
+        mock_remove.assert_not_called()
+        self.assertEqual(ImageUpload.objects.get(id=latest.id).jpeg_file.name, 'uploads/jpg/missing.jpg')
+
+    def test_sweeps_do_not_store_results(self):
+        """Test periodic sweeps skip the result backend"""
+        for task in (cleanup_old_files, cleanup_stuck_uploads, purge_old_uploads, reconcile_upload_files):
+            self.assertTrue(task.ignore_result, task.name)
+        self.assertFalse(process_image_upload.ignore_result)
+
+
+@override_settings(PURGE_CHUNK_SIZE=2, PURGE_CHUNK_SLEEP=0)
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def make_upload(self, days, status, **fields):
+        upload = ImageUpload.objects.create(email='a@example.com', jpeg_file='', **fields)
+        ImageUpload.objects.filter(id=upload.id).update(status=status, timestamp=self.now - timedelta(days=days))
+        return upload
+
+    def test_purge_old_uploads(self):
+        """Test rows past retention are deleted in chunks, FAILED rows kept longer"""
+        old = [self.make_upload(settings.UPLOAD_RETENTION_DAYS + 1, ImageUpload.Status.COMPLETED) for _ in range(5)]
+        recent = self.make_upload(1, ImageUpload.Status.COMPLETED)
+        failed = self.make_upload(settings.UPLOAD_RETENTION_DAYS + 1, ImageUpload.Status.FAILED)
+        expired = self.make_upload(settings.FAILED_UPLOAD_RETENTION_DAYS + 1, ImageUpload.Status.FAILED)
+
+        with patch('converter.tasks.time.sleep') as mock_sleep:
+            self.assertEqual(purge_old_uploads(), 6)
+
+        self.assertEqual(mock_sleep.call_count, 4)
+        remaining = set(ImageUpload.objects.values_list('id', flat=True))
+        self.assertEqual(remaining, {recent.id, failed.id})
+        self.assertFalse(remaining & {upload.id for upload in old + [expired]})
+
+    def test_reconcile_upload_files(self):
+        """Test unreferenced files are removed and referenced or fresh ones kept"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        directory = os.path.join(media_root, 'uploads/pdf/zz/zz')
+        os.makedirs(directory, exist_ok=True)
+        paths = {name: os.path.join(directory, name) for name in ('kept.pdf', 'orphan1.pdf', 'orphan2.pdf', 'orphan3.pdf', 'fresh.pdf')}
+        for name, path in paths.items():
+            with open(path, 'wb') as f:
+                f.write(b'%PDF')
+            if name != 'fresh.pdf':
+                old = time.time() - (settings.ORPHAN_MIN_AGE_MINUTES + 1) * 60
+                os.utime(path, (old, old))
+        self.make_upload(1, ImageUpload.Status.COMPLETED, _pdf_file='uploads/pdf/zz/zz/kept.pdf')
+
+        with override_settings(MEDIA_ROOT=media_root):
+            self.assertEqual(reconcile_upload_files(), 3)
+        self.assertEqual(sorted(os.listdir(directory)), ['fresh.pdf', 'kept.pdf'])
+
+
+@override_settings(EMAIL_DIGEST_SECONDS=30, EMAIL_DIGEST_MAX_UPLOADS=5)
+class EmailDigestTests(TestCase):
+    def setUp(self):
+        self.email = 'digest@example.com'
+        self.uploads = [
+            ImageUpload.objects.create(email=self.email, jpeg_file=TestFileManager.create_test_image())
+            for _ in range(3)
+        ]
+
+    def tearDown(self):
+        for upload in ImageUpload.objects.all():
+            for field_file in (upload.jpeg_file, upload._pdf_file):
+                if field_file and os.path.exists(field_file.path):
+                    os.remove(field_file.path)
+
+    @patch('time.sleep', return_value=None)
+    def process_all(self, mock_sleep):
+        with patch('converter.tasks.send_email_digest.apply_async') as mock_schedule, \
+                patch('converter.tasks.send_email_digest.delay') as mock_send:
+            results = [process_image_upload(upload.id) for upload in self.uploads]
+        return results, mock_schedule, mock_send
+
+    def test_uploads_wait_for_one_digest(self):
+        """Test converted uploads are held and one digest is scheduled per window"""
+        results, mock_schedule, mock_send = self.process_all()
+
+        self.assertEqual(results, [Outcome.DIGEST_QUEUED] * 3)
+        mock_schedule.assert_called_once_with((self.email,), countdown=30)
+        mock_send.assert_not_called()
+        self.assertEqual(mail.outbox, [])
+        for upload in self.uploads:
+            upload.refresh_from_db()
+            self.assertEqual(upload.status, ImageUpload.Status.SENDING)
+            self.assertIsNotNone(upload.digest_queued_at)
+
+    def test_digest_sends_one_message(self):
+        """Test the digest sends all waiting PDFs in one message and completes the uploads"""
+        self.process_all()
+        send_email_digest(self.email)
+
+        [message] = mail.outbox
+        self.assertEqual(message.to, [self.email])
+        self.assertIn('3 PDFs', message.subject)
+        self.assertEqual(len(message.attachments), 3)
+        for upload in self.uploads:
+            upload.refresh_from_db()
+            self.assertEqual(upload.status, ImageUpload.Status.COMPLETED)
+            self.assertIsNone(upload.digest_queued_at)
+            self.assertIsNone(upload.digest_claimed_at)
+            self.assertIn('email_send', upload.trace['stages'])
+
+        send_email_digest(self.email)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(EMAIL_MAX_ATTACHMENT_BYTES=1, PUBLIC_BASE_URL='https://example.com')
+    def test_digest_links_pdfs_over_attachment_limit(self):
+        """Test PDFs that do not fit the attachment limit are sent as download links"""
+        self.process_all()
+        send_email_digest(self.email)
+
+        [message] = mail.outbox
+        self.assertEqual(message.attachments, [])
+        self.assertEqual(message.body.count('https://example.com/api/converter/download/'), 3)
+
+    @override_settings(PUBLIC_BASE_URL='https://example.com')
+    def test_digest_links_zip_export(self):
+        """Test a digest hands the address an export link for all its recent PDFs"""
+        self.process_all()
+        send_email_digest(self.email)
+
+        [message] = mail.outbox
+        [export_url] = re.findall(r'https://example\.com(/api/converter/export/\S+)', message.body)
+        response = self.client.get(export_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))).namelist()), 3)
+
+    @override_settings(EMAIL_DIGEST_MAX_UPLOADS=2)
+    def test_full_digest_is_sent_early(self):
+        """Test a digest is sent right away once EMAIL_DIGEST_MAX_UPLOADS PDFs wait"""
+        _, mock_schedule, mock_send = self.process_all()
+
+        mock_schedule.assert_called_once()
+        self.assertEqual(mock_send.call_count, 2)
+
+    @patch('converter.tasks.send_email_digest.delay')
+    def test_overdue_digest_is_sent_by_sweep(self, mock_send):
+        """Test cleanup_stuck_uploads sends digests whose task was lost"""
+        self.process_all()
+        ImageUpload.objects.filter(id=self.uploads[0].id).update(
+            digest_queued_at=timezone.now() - timedelta(minutes=5)
+        )
+        cleanup_stuck_uploads()
+        mock_send.assert_called_once_with(self.email)
+
+    @patch('converter.tasks.send_email_digest.delay')
+    def test_sweep_requeues_stale_claims(self, mock_send):
+        """Test PDFs claimed by a digest that died are sent again by the sweep"""
+        self.process_all()
+        with patch('converter.tasks.emails.send_pdfs', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                send_email_digest(self.email)
+        self.assertEqual(ImageUpload.objects.filter(digest_claimed_at__isnull=False).count(), 3)
+
+        cleanup_stuck_uploads()
+        mock_send.assert_not_called()
+
+        ImageUpload.objects.update(digest_claimed_at=timezone.now() - timedelta(minutes=10))
+        cleanup_stuck_uploads()
+        mock_send.assert_called_once_with(self.email)
+        send_email_digest(self.email)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(ImageUpload.objects.exclude(status=ImageUpload.Status.COMPLETED).exists())
+
+    @patch('converter.tasks.send_email_digest.delay')
+    def test_sweep_skips_digests_when_disabled(self, mock_send):
+        """Test the overdue digest query is not run with EMAIL_DIGEST_SECONDS=0"""
+        self.process_all()
+        ImageUpload.objects.update(digest_queued_at=timezone.now() - timedelta(minutes=5))
+        with override_settings(EMAIL_DIGEST_SECONDS=0), patch('converter.tasks._send_overdue_digests') as mock_overdue:
+            cleanup_stuck_uploads()
+        mock_overdue.assert_not_called()
+        mock_send.assert_not_called()
+
+
+class WorkerMetricsServerTest(TestCase):
+    def worker(self, pool):
+        return SimpleNamespace(pool_cls=SimpleNamespace(__module__=f'celery.concurrency.{pool}'))
+
+    @override_settings(METRICS_WORKER_PORT=9100)
+    @patch('prometheus_client.start_http_server')
+    def test_prefork_requires_multiprocess_dir(self, mock_start):
+        """Test the port is not served from a prefork parent that never sees task samples"""
+        with patch('converter.metrics.MULTIPROCESS', False):
+            with self.assertRaises(ImproperlyConfigured):
+                start_metrics_server(sender=self.worker('prefork'))
+            mock_start.assert_not_called()
+
+            start_metrics_server(sender=self.worker('solo'))
+            mock_start.assert_called_once()
+        with patch('converter.metrics.MULTIPROCESS', True), patch('converter.metrics.multiprocess.MultiProcessCollector'):
+            start_metrics_server(sender=self.worker('prefork'))
+        self.assertEqual(mock_start.call_count, 2)
@@ -1,11 +1,22 @@
-from django.test import TestCase
+from django.test import AsyncRequestFactory, TestCase, override_settings
 from django.urls import reverse
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
 from rest_framework.test import APITestCase
 from rest_framework import status
-from converter.models import ImageUpload
+from converter.models import IdempotencyKey, ImageUpload, OutboxMessage
+from converter import idempotency, outbox
+from converter.tasks import process_image_upload
+from converter.views import AsyncImageUploadStatusView, AsyncImageUploadView
 from .test_utils import TestFileManager
 from django.core.files.uploadedfile import SimpleUploadedFile
+import io
+import json
 import os
+import zipfile
 from unittest.mock import patch, MagicMock
 from faker import Faker
 
@@ -102,15 +113,464 @@ class ImageUploadViewTest(APITestCase):
         response = self.client.post(self.upload_url, self.valid_payload, format='multipart')
         upload_id = response.data['id']
         
+        self.assertIn(reverse('converter:upload_status', args=[ImageUpload.objects.get(id=upload_id).status_token()]),
+                      response.data['status_url'])
+
         # Test status endpoint
         status_url = reverse('converter:status', args=[upload_id])
         response = self.client.get(status_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('status', response.data)
+        self.assertIn('trace', response.data)
         self.assertIn('data', response.data)
 
     def test_status_nonexistent_upload(self):
         """Test status endpoint with non-existent upload ID"""
         status_url = reverse('converter:status', args=[99999])
         response = self.client.get(status_url)
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND) 
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND) 
+
+class MetricsViewTest(APITestCase):
+    def tearDown(self):
+        for image_upload in ImageUpload.objects.all():
+            if image_upload.jpeg_file and os.path.exists(image_upload.jpeg_file.path):
+                os.unlink(image_upload.jpeg_file.path)
+
+    @patch('converter.tasks.process_image_upload.delay')
+    def test_metrics_include_upload_stages(self, mock_delay):
+        """Test upload stages show up in the Prometheus output"""
+        mock_delay.return_value = MagicMock(id='test-task-id')
+        payload = {
+            'email': Faker().email(),
+            'jpeg_file': TestFileManager.create_test_image(format='PNG'),
+        }
+        self.client.post(reverse('converter:upload'), payload, format='multipart')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        for stage in ('upload_receive', 'db_insert', 'enqueue'):
+            self.assertIn(
+                f'jpgtopdf_stage_duration_seconds_count{{engine="balanced",format="png",'
+                f'size_bucket="<100KB",stage="{stage}"}}',
+                body
+            )
+
+
+class PdfDownloadViewTest(APITestCase):
+    def setUp(self):
+        self.upload = ImageUpload.objects.create(
+            email=Faker().email(),
+            jpeg_file=TestFileManager.create_test_image()
+        )
+        self.upload.pdf_file
+        with open(self.upload._pdf_file.path, 'rb') as f:
+            self.content = f.read()
+        self.url = self.upload.get_download_url()
+
+    def tearDown(self):
+        for path in (self.upload.jpeg_file, self.upload._pdf_file):
+            if path and os.path.exists(path.path):
+                os.unlink(path.path)
+
+    def test_full_download(self):
+        """Test a valid link returns the whole PDF with caching headers"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('ETag', response)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_status_includes_download_url(self):
+        """Test the signed status URL links to the download once the PDF exists"""
+        response = self.client.get(self.upload.get_status_url())
+        self.assertIn('/api/converter/download/', response.data['download_url'])
+
+    def test_status_by_id_hides_download_url(self):
+        """Test the guessable status URL does not hand out download links"""
+        response = self.client.get(reverse('converter:status', args=[self.upload.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['download_url'])
+
+    def test_status_bad_token(self):
+        """Test a tampered status token is treated as not found"""
+        response = self.client.get(reverse('converter:upload_status', args=['1:bogus']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_range_request(self):
+        """Test a byte range returns 206 with just that slice"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+
+    def test_suffix_range_request(self):
+        """Test a suffix range returns the last bytes"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+    def test_unsatisfiable_range(self):
+        """Test a range past the end is rejected"""
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_if_none_match(self):
+        """Test a matching ETag returns 304 without a body"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_tampered_token(self):
+        """Test a modified token is rejected"""
+        response = self.client.get(self.url.replace('/download/', '/download/x'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_token(self):
+        """Test expired links return 410"""
+        with override_settings(PDF_DOWNLOAD_MAX_AGE=-1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    @override_settings(PDF_SENDFILE_HEADER='X-Accel-Redirect', PDF_SENDFILE_PREFIX='/protected/')
+    def test_accel_redirect(self):
+        """Test the body is handed to nginx when configured"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.upload._pdf_file.name)
+        self.assertEqual(response.content, b'')
+
+
+class PdfExportViewTest(APITestCase):
+    def setUp(self):
+        self.email = Faker().email()
+        self.uploads = []
+        for color in ('red', 'blue'):
+            upload = ImageUpload.objects.create(
+                email=self.email,
+                jpeg_file=TestFileManager.create_test_image(color=color)
+            )
+            upload.pdf_file
+            self.uploads.append(upload)
+        self.url = reverse('converter:export')
+
+    def tearDown(self):
+        for upload in self.uploads:
+            for path in (upload.jpeg_file, upload._pdf_file):
+                if path and os.path.exists(path.path):
+                    os.unlink(path.path)
+
+    def read_zip(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def tokens(self):
+        return ','.join(upload.download_token() for upload in self.uploads)
+
+    def test_export_by_tokens(self):
+        """Test the archive holds exactly the PDFs whose download tokens were passed"""
+        archive = self.read_zip(self.client.get(self.url, {'tokens': self.tokens()}))
+        self.assertEqual(len(archive.namelist()), 2)
+        for upload in self.uploads:
+            name = f'{upload.id}-{os.path.basename(upload._pdf_file.name)}'
+            with open(upload._pdf_file.path, 'rb') as f:
+                self.assertEqual(archive.read(name), f.read())
+            self.assertEqual(archive.getinfo(name).compress_type, zipfile.ZIP_STORED)
+
+    def test_export_by_email_token_with_deflate(self):
+        """Test selecting recent uploads by an export token and compressing entries"""
+        token = ImageUpload.export_token(self.email, minutes=5)
+        response = self.client.get(self.url, {'token': token, 'compression': 'deflate'})
+        archive = self.read_zip(response)
+        self.assertEqual(len(archive.namelist()), 2)
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.infolist()[0].compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_export_skips_unfinished_uploads(self):
+        """Test only completed uploads are exported"""
+        ImageUpload.objects.filter(id=self.uploads[0].id).update(status=ImageUpload.Status.FAILED)
+        archive = self.read_zip(self.client.get(self.url, {'token': ImageUpload.export_token(self.email)}))
+        self.assertEqual(len(archive.namelist()), 1)
+
+    def test_export_requires_selection(self):
+        """Test a request without tokens is rejected"""
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_rejects_unsigned_selection(self):
+        """Test plain ids, emails and forged tokens do not export anything"""
+        ids = ','.join(str(upload.id) for upload in self.uploads)
+        self.assertEqual(self.client.get(self.url, {'ids': ids}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'email': self.email}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'tokens': ids}).status_code, status.HTTP_404_NOT_FOUND)
+        # A status token is signed with another salt
+        token = self.uploads[0].status_token()
+        self.assertEqual(self.client.get(self.url, {'tokens': token}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_expired_token(self):
+        """Test expired tokens return 410"""
+        tokens = self.tokens()
+        with self.settings(PDF_DOWNLOAD_MAX_AGE=-1):
+            response = self.client.get(self.url, {'tokens': tokens})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_export_minutes_capped(self):
+        """Test export tokens cannot cover more than EXPORT_MAX_MINUTES"""
+        with self.assertRaises(ValueError):
+            ImageUpload.export_token(self.email, minutes=10 ** 9)
+
+    def test_export_nothing_found(self):
+        """Test an empty selection returns 404"""
+        response = self.client.get(self.url, {'token': ImageUpload.export_token('nobody@example.com')})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@patch('converter.tasks.process_image_upload.delay', return_value=MagicMock(id='task-1'))
+class IdempotencyKeyTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.upload_url = reverse('converter:upload')
+        self.image = TestFileManager.create_test_image(format='JPEG', mode='RGB', size=(50, 50), color='red').read()
+
+    def tearDown(self):
+        for image_upload in ImageUpload.objects.all():
+            if image_upload.jpeg_file and os.path.exists(image_upload.jpeg_file.path):
+                os.unlink(image_upload.jpeg_file.path)
+
+    def post(self, key, email='a@example.com', image=None):
+        payload = {
+            'email': email,
+            'jpeg_file': SimpleUploadedFile('test.jpg', image or self.image, content_type='image/jpeg'),
+        }
+        return self.client.post(self.upload_url, payload, format='multipart', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self, mock_delay):
+        """Test a repeated request gets the original 201 without a second upload"""
+        first = self.post('retry-1')
+        second = self.post('retry-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(ImageUpload.objects.count(), 1)
+        mock_delay.assert_called_once()
+
+    def test_replay_after_cache_loss(self, mock_delay):
+        """Test the stored response is used when the cache entry is gone"""
+        first = self.post('retry-2')
+        cache.clear()
+        second = self.post('retry-2')
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(ImageUpload.objects.count(), 1)
+
+    def test_different_body_is_rejected(self, mock_delay):
+        """Test reusing a key with another request body fails"""
+        self.post('retry-3')
+        response = self.post('retry-3', email='b@example.com')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(ImageUpload.objects.count(), 1)
+
+    def test_in_flight_key_conflicts(self, mock_delay):
+        """Test a retry while the first request is still running gets 409"""
+        IdempotencyKey.objects.create(key='retry-4', request_hash='pending')
+        response = self.post('retry-4')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_abandoned_claim_is_taken_over(self, mock_delay):
+        """Test a retry takes over a claim whose request died without finishing"""
+        IdempotencyKey.objects.create(key='retry-6', request_hash='pending')
+        IdempotencyKey.objects.update(created=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS + 1))
+        stale = IdempotencyKey.objects.get()
+        response = self.post('retry-6')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(IdempotencyKey.objects.get().response_status, status.HTTP_201_CREATED)
+
+        # The original request finishing late does not overwrite the new response
+        idempotency.finish(stale, 500, {'id': None})
+        record = IdempotencyKey.objects.get()
+        self.assertEqual(record.response_status, status.HTTP_201_CREATED)
+        self.assertEqual(record.response_body['id'], response.data['id'])
+
+    def test_expired_key_is_reused(self, mock_delay):
+        """Test a key past its TTL starts a new upload"""
+        self.post('retry-5')
+        cache.clear()
+        IdempotencyKey.objects.update(created=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL + 1))
+        response = self.post('retry-5')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ImageUpload.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.get().upload_id, response.data['id'])
+
+    def test_failed_request_releases_key(self, mock_delay):
+        """Test a rejected request does not keep the key"""
+        response = self.post('retry-6', email='not-an-email')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post('retry-6').status_code, status.HTTP_201_CREATED)
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    async def test_async_upload(self):
+        """Test the async upload view stores the file, inserts the row and enqueues"""
+        image = TestFileManager.create_test_image(format='JPEG', mode='RGB', size=(50, 50), color='red')
+        request = self.factory.post('/api/converter/upload/', {'email': 'a@example.com', 'jpeg_file': image})
+        with patch('converter.views.process_image_upload.delay', return_value=MagicMock(id='task-1')) as mock_delay:
+            response = await AsyncImageUploadView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        body = json.loads(response.content)
+        upload = await ImageUpload.objects.aget(id=body['id'])
+        self.addCleanup(os.remove, upload.jpeg_file.path)
+        mock_delay.assert_called_once_with(upload.id)
+        self.assertEqual(upload.task_id, 'task-1')
+        self.assertTrue(os.path.exists(upload.jpeg_file.path))
+        self.assertTrue(body['status_url'].endswith(upload.get_status_url()))
+
+    async def test_async_upload_validation(self):
+        """Test invalid uploads are rejected before anything is stored"""
+        request = self.factory.post('/api/converter/upload/', {'email': 'not-an-email'})
+        response = await AsyncImageUploadView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', json.loads(response.content))
+        self.assertFalse(await ImageUpload.objects.aexists())
+
+    async def test_async_upload_broker_failure(self):
+        """Test a failed enqueue marks the upload FAILED"""
+        image = TestFileManager.create_test_image(format='JPEG', mode='RGB', size=(50, 50), color='red')
+        request = self.factory.post('/api/converter/upload/', {'email': 'a@example.com', 'jpeg_file': image})
+        with patch('converter.views.process_image_upload.delay', side_effect=Exception('broker down')):
+            response = await AsyncImageUploadView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        upload = await ImageUpload.objects.aget()
+        self.addCleanup(os.remove, upload.jpeg_file.path)
+        self.assertEqual(upload.status, ImageUpload.Status.FAILED)
+
+    async def test_async_status(self):
+        """Test the async status view matches the sync payload"""
+        upload = await ImageUpload.objects.acreate(email='a@example.com', jpeg_file='uploads/jpg/a.jpg')
+        request = self.factory.get(f'/api/converter/status/{upload.id}/')
+        response = await AsyncImageUploadStatusView.as_view()(request, pk=upload.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = json.loads(response.content)
+        self.assertEqual(body['status'], ImageUpload.Status.PENDING)
+        self.assertEqual(body['data']['id'], upload.id)
+
+        response = await AsyncImageUploadStatusView.as_view()(request, pk=upload.id + 1)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = await AsyncImageUploadStatusView.as_view()(request, token=upload.status_token())
+        self.assertEqual(json.loads(response.content)['data']['id'], upload.id)
+        response = await AsyncImageUploadStatusView.as_view()(request, token='bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_upload_idempotency_key(self):
+        """Test the async view replays keyed retries"""
+        image = TestFileManager.create_test_image(format='JPEG', mode='RGB', size=(50, 50), color='red').read()
+        responses = []
+        with patch('converter.views.process_image_upload.delay', return_value=MagicMock(id='task-1')) as mock_delay:
+            for _ in range(2):
+                request = self.factory.post(
+                    '/api/converter/upload/',
+                    {'email': 'a@example.com', 'jpeg_file': SimpleUploadedFile('a.jpg', image, content_type='image/jpeg')},
+                    headers={'Idempotency-Key': 'async-1'},
+                )
+                responses.append(await AsyncImageUploadView.as_view()(request))
+        self.assertEqual(json.loads(responses[0].content), json.loads(responses[1].content))
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        mock_delay.assert_called_once()
+        upload = await ImageUpload.objects.aget()
+        self.addCleanup(os.remove, upload.jpeg_file.path)
+
+
+@override_settings(UPLOAD_OUTBOX=True)
+class OutboxTest(TestCase):
+    def tearDown(self):
+        for upload in ImageUpload.objects.all():
+            if upload.jpeg_file and os.path.exists(upload.jpeg_file.path):
+                os.remove(upload.jpeg_file.path)
+
+    def image(self):
+        return TestFileManager.create_test_image(format='JPEG', mode='RGB', size=(50, 50), color='red')
+
+    @patch('converter.views.process_image_upload.delay', side_effect=Exception('broker down'))
+    def test_upload_writes_outbox_message(self, mock_delay):
+        """Test the upload commits its task to the outbox instead of publishing it"""
+        response = self.client.post(reverse('converter:upload'), {'email': 'a@example.com', 'jpeg_file': self.image()})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        mock_delay.assert_not_called()
+
+        upload = ImageUpload.objects.get()
+        message = OutboxMessage.objects.get()
+        self.assertEqual(upload.status, ImageUpload.Status.PENDING)
+        self.assertEqual(message.upload, upload)
+        self.assertEqual(message.task_name, 'converter.tasks.process_image_upload')
+        self.assertEqual(message.args, [upload.id])
+        self.assertEqual(message.task_id, upload.task_id)
+        self.assertIsNone(message.sent_at)
+
+    async def test_async_upload_writes_outbox_message(self):
+        """Test the async upload view writes the outbox message with the row"""
+        request = AsyncRequestFactory().post('/api/converter/upload/', {'email': 'a@example.com', 'jpeg_file': self.image()})
+        with patch('converter.views.process_image_upload.delay') as mock_delay:
+            response = await AsyncImageUploadView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        mock_delay.assert_not_called()
+        upload = await ImageUpload.objects.aget(id=json.loads(response.content)['id'])
+        message = await OutboxMessage.objects.aget()
+        self.assertEqual((message.upload_id, message.task_id), (upload.id, upload.task_id))
+
+    @patch('converter.outbox.current_app')
+    def test_relay_publishes_in_batches(self, mock_app):
+        """Test the relay publishes oldest messages first over one producer and marks them sent"""
+        uploads = [ImageUpload.objects.create(email='a@example.com', jpeg_file='uploads/jpg/a.jpg') for _ in range(3)]
+        task_ids = [outbox.add(upload, process_image_upload) for upload in uploads]
+        producer = mock_app.producer_or_acquire.return_value.__enter__.return_value
+
+        self.assertEqual(outbox.relay(batch_size=2), 2)
+        self.assertEqual(mock_app.producer_or_acquire.call_count, 1)
+        self.assertEqual([call.kwargs['task_id'] for call in mock_app.send_task.call_args_list], task_ids[:2])
+        self.assertTrue(all(call.kwargs['producer'] is producer for call in mock_app.send_task.call_args_list))
+        self.assertEqual(OutboxMessage.objects.filter(sent_at__isnull=True).count(), 1)
+
+        self.assertEqual(outbox.relay(batch_size=2), 1)
+        self.assertEqual(mock_app.send_task.call_args.kwargs['args'], [uploads[2].id])
+        self.assertEqual(outbox.relay(batch_size=2), 0)
+        self.assertEqual(mock_app.send_task.call_count, 3)
+
+    @patch('converter.outbox.current_app')
+    def test_relay_publishes_outside_transaction(self, mock_app):
+        """Test no transaction is held open while the batch goes to the broker"""
+        upload = ImageUpload.objects.create(email='a@example.com', jpeg_file='uploads/jpg/a.jpg')
+        outbox.add(upload, process_image_upload)
+        depth = len(connection.atomic_blocks)
+        depths = []
+        mock_app.send_task.side_effect = lambda *args, **kwargs: depths.append(len(connection.atomic_blocks))
+        self.assertEqual(outbox.relay(), 1)
+        self.assertEqual(depths, [depth])
+        self.assertIsNotNone(OutboxMessage.objects.get().sent_at)
+
+    @patch('converter.outbox.current_app')
+    def test_relay_skips_claimed_messages(self, mock_app):
+        """Test a batch claimed by another relay is left alone until the claim expires"""
+        upload = ImageUpload.objects.create(email='a@example.com', jpeg_file='uploads/jpg/a.jpg')
+        outbox.add(upload, process_image_upload)
+        OutboxMessage.objects.update(claimed_at=timezone.now())
+        self.assertEqual(outbox.relay(), 0)
+        OutboxMessage.objects.update(claimed_at=timezone.now() - timedelta(seconds=settings.OUTBOX_CLAIM_SECONDS + 1))
+        self.assertEqual(outbox.relay(), 1)
+
+    @patch('converter.outbox.current_app')
+    def test_relay_releases_claim_on_broker_error(self, mock_app):
+        """Test a failed publish leaves the batch unsent and claimable for the next round"""
+        upload = ImageUpload.objects.create(email='a@example.com', jpeg_file='uploads/jpg/a.jpg')
+        outbox.add(upload, process_image_upload)
+        mock_app.send_task.side_effect = ConnectionError('broker down')
+        with self.assertRaises(ConnectionError):
+            outbox.relay()
+        message = OutboxMessage.objects.get()
+        self.assertIsNone(message.claimed_at)
+        self.assertIsNone(message.sent_at)
@@ -0,0 +1,237 @@
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ..models import ImageUpload, WebhookDeadLetter
+from ..tasks import deliver_webhook, process_image_upload
+from .. import webhooks
+from jpgtopdf import settings as project_settings
+from .test_utils import TestFileManager
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+
+
+class StandIn:
+    """Local HTTP server recording webhook requests and answering with scripted statuses."""
+
+    def __init__(self, statuses=(200,), delay=0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                with stand_in.lock:
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                    status = stand_in.statuses.pop(0) if len(stand_in.statuses) > 1 else stand_in.statuses[0]
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(stand_in.delay)
+                with stand_in.lock:
+                    stand_in.requests.append((self.path, dict(self.headers), body))
+                    stand_in.connections.add(self.client_address)
+                    stand_in.in_flight -= 1
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/hooks/jpgtopdf?source=test'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(WEBHOOK_SECRET='test-secret', WEBHOOK_MAX_RETRIES=2, PUBLIC_BASE_URL='https://example.com',
+                   WEBHOOK_ALLOW_PRIVATE=True)
+class WebhookDeliveryTest(TestCase):
+    def setUp(self):
+        self.upload = ImageUpload.objects.create(
+            email='user@example.com',
+            jpeg_file=TestFileManager.create_test_image(),
+            status=ImageUpload.Status.FAILED,
+            error_message='Failed to convert image to PDF',
+        )
+        self.payload = webhooks.payload(self.upload)
+        # Each test gets its own pool so connections to earlier stand-ins are not reused
+        webhooks._pool = None
+
+    def tearDown(self):
+        if self.upload.jpeg_file and os.path.exists(self.upload.jpeg_file.path):
+            os.remove(self.upload.jpeg_file.path)
+
+    def stand_in(self, *args, **kwargs):
+        stand_in = StandIn(*args, **kwargs)
+        self.addCleanup(stand_in.close)
+        return stand_in
+
+    def test_posts_signed_payload(self):
+        stand_in = self.stand_in()
+        deliver_webhook.apply(args=(self.upload.id, stand_in.url, self.payload))
+
+        [(path, headers, body)] = stand_in.requests
+        self.assertEqual(path, '/hooks/jpgtopdf?source=test')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(body), {
+            'event': 'upload.finished',
+            'id': self.upload.id,
+            'status': 'FAILED',
+            'error_message': 'Failed to convert image to PDF',
+            'download_url': None,
+            'timestamp': self.upload.timestamp.isoformat(),
+        })
+        timestamp = headers[webhooks.SIGNATURE_HEADER].split(',')[0][2:]
+        self.assertEqual(headers[webhooks.SIGNATURE_HEADER], webhooks.sign(body, timestamp))
+        self.assertFalse(WebhookDeadLetter.objects.exists())
+
+    def test_payload_links_pdf_download(self):
+        self.upload._pdf_file.name = 'uploads/pdf/ab/cd/test.pdf'
+        payload = webhooks.payload(self.upload)
+        self.assertTrue(payload['download_url'].startswith('https://example.com/'))
+
+    def test_retries_server_errors(self):
+        stand_in = self.stand_in(statuses=[503, 500, 204])
+        deliver_webhook.apply(args=(self.upload.id, stand_in.url, self.payload))
+
+        self.assertEqual(len(stand_in.requests), 3)
+        self.assertFalse(WebhookDeadLetter.objects.exists())
+
+    def test_dead_letters_after_retries(self):
+        stand_in = self.stand_in(statuses=[503])
+        deliver_webhook.apply(args=(self.upload.id, stand_in.url, self.payload))
+
+        self.assertEqual(len(stand_in.requests), 3)
+        dead_letter = WebhookDeadLetter.objects.get()
+        self.assertEqual(dead_letter.upload, self.upload)
+        self.assertEqual(dead_letter.url, stand_in.url)
+        self.assertEqual(dead_letter.payload, self.payload)
+        self.assertEqual(dead_letter.attempts, 3)
+        self.assertEqual(dead_letter.error, 'HTTP 503')
+
+    def test_dead_letters_after_default_retries(self):
+        stand_in = self.stand_in(statuses=[503])
+        with override_settings(WEBHOOK_MAX_RETRIES=project_settings.WEBHOOK_MAX_RETRIES), \
+                patch('converter.tasks.webhooks.backoff', return_value=0):
+            result = deliver_webhook.apply(args=(self.upload.id, stand_in.url, self.payload))
+
+        self.assertTrue(result.successful())
+        self.assertEqual(len(stand_in.requests), project_settings.WEBHOOK_MAX_RETRIES + 1)
+        self.assertEqual(WebhookDeadLetter.objects.get().attempts, project_settings.WEBHOOK_MAX_RETRIES + 1)
+
+    def test_client_errors_are_not_retried(self):
+        stand_in = self.stand_in(statuses=[410])
+        deliver_webhook.apply(args=(self.upload.id, stand_in.url, self.payload))
+
+        self.assertEqual(len(stand_in.requests), 1)
+        self.assertEqual(WebhookDeadLetter.objects.get().attempts, 1)
+
+    def test_unreachable_host_is_dead_lettered(self):
+        stand_in = self.stand_in()
+        url = stand_in.url
+        stand_in.close()
+        deliver_webhook.apply(args=(self.upload.id, url, self.payload))
+
+        self.assertEqual(WebhookDeadLetter.objects.get().attempts, 3)
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE=False)
+    def test_private_addresses_are_refused(self):
+        stand_in = self.stand_in()
+        deliver_webhook.apply(args=(self.upload.id, stand_in.url, self.payload))
+
+        self.assertEqual(stand_in.requests, [])
+        dead_letter = WebhookDeadLetter.objects.get()
+        self.assertEqual(dead_letter.attempts, 1)
+        self.assertIn('non-public address 127.0.0.1', dead_letter.error)
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE=False)
+    def test_resolve_checks_every_address(self):
+        for address in ('10.0.0.5', '169.254.169.254', '::1', '::ffff:192.168.0.1', 'fe80::1'):
+            with self.subTest(address=address), \
+                    patch('socket.getaddrinfo', return_value=[(None, None, None, '', (address, 80))]):
+                with self.assertRaises(webhooks.DeliveryError) as cm:
+                    webhooks.resolve('hooks.example.com', 80)
+                self.assertFalse(cm.exception.retry)
+        public = [(None, None, None, '', ('93.184.216.34', 443))]
+        with patch('socket.getaddrinfo', return_value=public):
+            self.assertEqual(webhooks.resolve('hooks.example.com', 443), ('93.184.216.34', 443))
+        with patch('socket.getaddrinfo', return_value=public + [(None, None, None, '', ('127.0.0.1', 443))]):
+            with self.assertRaises(webhooks.DeliveryError):
+                webhooks.resolve('hooks.example.com', 443)
+
+    def test_backoff_doubles_up_to_limit(self):
+        with override_settings(WEBHOOK_BACKOFF_SECONDS=10, WEBHOOK_BACKOFF_MAX=60):
+            self.assertTrue(5 <= webhooks.backoff(0) <= 10)
+            self.assertTrue(20 <= webhooks.backoff(2) <= 40)
+            self.assertTrue(30 <= webhooks.backoff(10) <= 60)
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE=True)
+class ConnectionPoolTest(TestCase):
+    def stand_in(self, *args, **kwargs):
+        stand_in = StandIn(*args, **kwargs)
+        self.addCleanup(stand_in.close)
+        return stand_in
+
+    def test_reuses_connections(self):
+        stand_in = self.stand_in()
+        pool = webhooks.ConnectionPool(max_per_host=2, timeout=5)
+        for _ in range(3):
+            self.assertEqual(pool.post(stand_in.url, b'{}', {})[0], 200)
+        self.assertEqual(len(stand_in.requests), 3)
+        self.assertEqual(len(stand_in.connections), 1)
+
+    def test_bounds_requests_per_host(self):
+        stand_in = self.stand_in(delay=0.05)
+        pool = webhooks.ConnectionPool(max_per_host=2, timeout=5)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(lambda _: pool.post(stand_in.url, b'{}', {})[0], range(8)))
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(stand_in.max_in_flight, 2)
+        self.assertLessEqual(len(stand_in.connections), 2)
+
+
+class WebhookEnqueueTest(TestCase):
+    def setUp(self):
+        self.upload = ImageUpload.objects.create(
+            email='user@example.com',
+            jpeg_file=TestFileManager.create_test_image(),
+            callback_url='https://client.example.com/hook',
+        )
+
+    def tearDown(self):
+        self.upload.refresh_from_db()
+        for field_file in (self.upload.jpeg_file, self.upload._pdf_file):
+            if field_file and os.path.exists(field_file.path):
+                os.remove(field_file.path)
+
+    @patch('time.sleep', return_value=None)
+    @patch('converter.tasks.deliver_webhook.delay')
+    def test_terminal_status_enqueues_delivery(self, mock_delay, mock_sleep):
+        process_image_upload(self.upload.id)
+
+        mock_delay.assert_called_once()
+        upload_id, url, payload = mock_delay.call_args.args
+        self.assertEqual((upload_id, url), (self.upload.id, 'https://client.example.com/hook'))
+        self.assertEqual(payload['status'], ImageUpload.Status.COMPLETED)
+        self.assertIsNotNone(payload['download_url'])
+
+    @patch('time.sleep', return_value=None)
+    @patch('converter.tasks.deliver_webhook.delay')
+    def test_no_delivery_without_callback_url(self, mock_delay, mock_sleep):
+        ImageUpload.objects.filter(id=self.upload.id).update(callback_url=None)
+        process_image_upload(self.upload.id)
+        mock_delay.assert_not_called()
@@ -1,9 +1,21 @@
+from django.conf import settings
 from django.urls import path
-from .views import ImageUploadView, ImageUploadStatusView
+from .views import (
+    AsyncImageUploadStatusView, AsyncImageUploadView, ImageUploadStatusView, ImageUploadView,
+    PdfDownloadView, PdfExportView,
+)
 
 app_name = 'converter'
 
+if settings.ASYNC_VIEWS:
+    upload_view, status_view = AsyncImageUploadView, AsyncImageUploadStatusView
+else:
+    upload_view, status_view = ImageUploadView, ImageUploadStatusView
+
 urlpatterns = [
-    path('upload/', ImageUploadView.as_view(), name='upload'),
-    path('status/<int:pk>/', ImageUploadStatusView.as_view(), name='status'),
+    path('upload/', upload_view.as_view(), name='upload'),
+    path('status/<int:pk>/', status_view.as_view(), name='status'),
+    path('status/<str:token>/', status_view.as_view(), name='upload_status'),
+    path('download/<str:token>/', PdfDownloadView.as_view(), name='download'),
+    path('export/', PdfExportView.as_view(), name='export'),
 ] 
\ No newline at end of file
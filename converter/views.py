@@ -1,14 +1,32 @@
 from django.shortcuts import render
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.utils.http import http_date
+from django.views import View
 from rest_framework import generics, status
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
-from django.http import Http404
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from .models import ImageUpload
 from .serializers import ImageUploadSerializer
 from .tasks import process_image_upload
+from . import idempotency, metrics, outbox
 from kombu.exceptions import OperationalError
+from contextlib import nullcontext
+import json
 import logging
+import os
+import re
+import time
+import zipfile
+from datetime import timedelta
+from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
@@ -40,19 +58,56 @@ class ImageUploadView(generics.CreateAPIView):
             raise ValidationError(str(e))
 
     def create(self, request, *args, **kwargs):
+        key = request.headers.get(idempotency.HEADER)
+        if key is None:
+            return self._create(request)
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            return Response({'error': 'Invalid Idempotency-Key'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            claim = idempotency.begin(key, idempotency.fingerprint(request.data))
+        except idempotency.IdempotencyError as e:
+            return Response({'error': str(e)}, status=e.status)
+        if isinstance(claim, idempotency.Replay):
+            return Response(claim.body, status=claim.status, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = self._create(request)
+        except BaseException:
+            idempotency.release(claim)
+            raise
+        if response.status_code == status.HTTP_201_CREATED:
+            idempotency.finish(claim, response.status_code, response.data)
+        else:
+            idempotency.release(claim)
+        return response
+
+    def _create(self, request):
+        started = time.perf_counter()
         serializer = self.get_serializer(data=request.data)
+        received = time.perf_counter()
         serializer.is_valid(raise_exception=True)
         
         try:
-            # Create the upload instance
-            image_upload = serializer.save()
-            
-            # Start the processing task
-            task = process_image_upload.delay(image_upload.id)
-            image_upload.task_id = task.id
-            image_upload.save()
+            # With the outbox the task commits together with the upload and
+            # relay_outbox publishes it, so the request never waits on the broker
+            with transaction.atomic() if settings.UPLOAD_OUTBOX else nullcontext():
+                # Create the upload instance
+                image_upload = serializer.save()
+                saved = time.perf_counter()
+                labels = metrics.upload_labels(image_upload)
+                metrics.observe('upload_receive', received - started, labels)
+                metrics.observe('db_insert', saved - received, labels)
+
+                # Start the processing task
+                with metrics.timed('enqueue', labels):
+                    if settings.UPLOAD_OUTBOX:
+                        image_upload.task_id = outbox.add(image_upload, process_image_upload)
+                    else:
+                        image_upload.task_id = process_image_upload.delay(image_upload.id).id
+                image_upload.save()
             
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(_created_payload(request, image_upload, serializer.data), status=status.HTTP_201_CREATED)
             
         except Exception as e:
             # If anything goes wrong, update status and return error
@@ -62,19 +117,44 @@ class ImageUploadView(generics.CreateAPIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+def _created_payload(request, upload, data):
+    """201 body: the upload plus its status URL, which only the uploading client learns."""
+    return {**data, 'status_url': request.build_absolute_uri(upload.get_status_url())}
+
+def _status_payload(request, upload, with_download=False):
+    # The download link is only handed out through the signed status URL;
+    # anyone can walk the sequential ids of the plain one
+    download_url = None
+    if with_download and upload._pdf_file:
+        download_url = request.build_absolute_uri(upload.get_download_url())
+    return {
+        'status': upload.status,
+        'error_message': upload.error_message,
+        'download_url': download_url,
+        'trace': upload.trace,
+        'data': ImageUploadSerializer(upload, context={'request': request}).data,
+    }
+
 class ImageUploadStatusView(generics.RetrieveAPIView):
+    """Status of an upload, by id or by the signed token from its ``status_url``.
+
+    Only the token form includes the PDF ``download_url``.
+    """
     queryset = ImageUpload.objects.all()
     serializer_class = ImageUploadSerializer
+
+    def get_object(self):
+        if 'token' not in self.kwargs:
+            return super().get_object()
+        try:
+            return ImageUpload.from_status_token(self.kwargs['token'])
+        except (signing.BadSignature, ImageUpload.DoesNotExist):
+            raise Http404
     
     def retrieve(self, request, *args, **kwargs):
         try:
             instance = self.get_object()
-            serializer = self.get_serializer(instance)
-            return Response({
-                'status': instance.status,
-                'error_message': instance.error_message,
-                'data': serializer.data
-            })
+            return Response(_status_payload(request, instance, with_download='token' in kwargs))
         except Http404:
             return Response({
                 'message': 'Upload not found'
@@ -85,3 +165,322 @@ class ImageUploadStatusView(generics.RetrieveAPIView):
                 'message': 'Failed to retrieve status',
                 'error': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _parse_upload(request):
+    data = request.POST.copy()
+    data.update(request.FILES)
+    return data
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncImageUploadView(View):
+    """Async counterpart of ImageUploadView, used by the ASGI entry point.
+
+    Body parsing, the file write and the broker publish run in worker
+    threads and the rows are written with the async ORM, so a slow upload
+    does not hold up other requests on the event loop.
+    """
+
+    async def post(self, request):
+        started = time.perf_counter()
+        data = await sync_to_async(_parse_upload, thread_sensitive=False)(request)
+        key = request.headers.get(idempotency.HEADER)
+        if key is None:
+            return await self._create(request, data, started)
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            return JsonResponse({'error': 'Invalid Idempotency-Key'}, status=status.HTTP_400_BAD_REQUEST)
+
+        request_hash = await sync_to_async(idempotency.fingerprint, thread_sensitive=False)(data)
+        try:
+            claim = await sync_to_async(idempotency.begin)(key, request_hash)
+        except idempotency.IdempotencyError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        if isinstance(claim, idempotency.Replay):
+            return JsonResponse(claim.body, status=claim.status, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = await self._create(request, data, started)
+        except BaseException:
+            await sync_to_async(idempotency.release)(claim)
+            raise
+        if response.status_code == status.HTTP_201_CREATED:
+            await sync_to_async(idempotency.finish)(claim, response.status_code, json.loads(response.content))
+        else:
+            await sync_to_async(idempotency.release)(claim)
+        return response
+
+    async def _create(self, request, data, started):
+        received = time.perf_counter()
+        serializer = ImageUploadSerializer(data=data, context={'request': request})
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        image_file = serializer.validated_data.pop('jpeg_file')
+        image_upload = ImageUpload(**serializer.validated_data)
+        field = image_upload.jpeg_file.field
+        name = field.generate_filename(image_upload, image_file.name)
+        image_upload.jpeg_file.name = await sync_to_async(field.storage.save, thread_sensitive=False)(
+            name, image_file, max_length=field.max_length
+        )
+        if settings.UPLOAD_OUTBOX:
+            # The row and its task commit together, relay_outbox publishes the task
+            await sync_to_async(outbox.save_upload)(image_upload, process_image_upload)
+        else:
+            await image_upload.asave()
+        saved = time.perf_counter()
+        labels = metrics.upload_labels(image_upload)
+        metrics.observe('upload_receive', received - started, labels)
+        metrics.observe('db_insert', saved - received, labels)
+        if settings.UPLOAD_OUTBOX:
+            return JsonResponse(
+                _created_payload(request, image_upload, ImageUploadSerializer(image_upload, context={'request': request}).data),
+                status=status.HTTP_201_CREATED,
+            )
+
+        try:
+            with metrics.timed('enqueue', labels):
+                task = await sync_to_async(process_image_upload.delay, thread_sensitive=False)(image_upload.id)
+        except Exception as e:
+            logger.error("Failed to start processing task: %s", str(e))
+            await ImageUpload.objects.filter(id=image_upload.id).aupdate(
+                status=ImageUpload.Status.FAILED, error_message='Failed to start processing task'
+            )
+            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Only the task id, the worker may already have moved the status on
+        image_upload.task_id = task.id
+        await ImageUpload.objects.filter(id=image_upload.id).aupdate(task_id=task.id)
+        return JsonResponse(
+            _created_payload(request, image_upload, ImageUploadSerializer(image_upload, context={'request': request}).data),
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class AsyncImageUploadStatusView(View):
+    """Async counterpart of ImageUploadStatusView, used by the ASGI entry point."""
+
+    async def get(self, request, pk=None, token=None):
+        try:
+            if token is None:
+                upload = await ImageUpload.objects.aget(pk=pk)
+            else:
+                upload = await sync_to_async(ImageUpload.from_status_token)(token)
+        except (signing.BadSignature, ImageUpload.DoesNotExist):
+            return JsonResponse({'message': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(_status_payload(request, upload, with_download=token is not None))
+
+
+def metrics_view(request):
+    """Expose stage timings and counters in the Prometheus text format."""
+    return HttpResponse(generate_latest(metrics.registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _parse_range(header, size):
+    """Return (start, end) inclusive for a single-range header, None to ignore it, or False if unsatisfiable."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class PdfDownloadView(View):
+    """Serve a converted PDF through a signed, expiring link.
+
+    Supports conditional requests (ETag / If-None-Match) and single byte
+    ranges. When PDF_SENDFILE_HEADER is set the body is handed to the front
+    proxy (X-Sendfile or X-Accel-Redirect) instead of being streamed here.
+    """
+
+    def get(self, request, token):
+        try:
+            upload = ImageUpload.from_download_token(token, max_age=settings.PDF_DOWNLOAD_MAX_AGE)
+        except signing.SignatureExpired:
+            return HttpResponse('Download link has expired', status=status.HTTP_410_GONE)
+        except (signing.BadSignature, ImageUpload.DoesNotExist):
+            raise Http404('Download not found')
+        if not upload._pdf_file:
+            raise Http404('Download not found')
+
+        path = upload._pdf_file.path
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise Http404('Download not found')
+
+        etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(stat.st_mtime),
+            'Cache-Control': f'private, max-age={settings.PDF_DOWNLOAD_MAX_AGE}',
+            'Accept-Ranges': 'bytes',
+        }
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        filename = os.path.basename(upload._pdf_file.name)
+        sendfile_header = settings.PDF_SENDFILE_HEADER
+        if sendfile_header:
+            # The proxy handles ranges and conditional requests itself
+            response = HttpResponse(content_type='application/pdf')
+            if sendfile_header == 'X-Accel-Redirect':
+                relative = os.path.relpath(path, settings.MEDIA_ROOT)
+                response[sendfile_header] = settings.PDF_SENDFILE_PREFIX.rstrip('/') + '/' + relative
+            else:
+                response[sendfile_header] = path
+        else:
+            byte_range = None
+            if 'Range' in request.headers:
+                if_range = request.headers.get('If-Range')
+                if not if_range or if_range == etag:
+                    byte_range = _parse_range(request.headers['Range'], stat.st_size)
+            if byte_range is False:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+            if byte_range:
+                start, end = byte_range
+                response = StreamingHttpResponse(
+                    _read_range(path, start, end - start + 1),
+                    status=status.HTTP_206_PARTIAL_CONTENT,
+                    content_type='application/pdf',
+                )
+                response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+                response['Content-Length'] = str(end - start + 1)
+            else:
+                response = FileResponse(open(path, 'rb'), content_type='application/pdf')
+
+        for name, value in headers.items():
+            response[name] = value
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class _ZipStream:
+    """Write-only, unseekable sink for zipfile whose output is drained chunk by chunk."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _zip_uploads(uploads, compression, chunk_size=64 * 1024):
+    """Yield a ZIP archive of the uploads' PDFs, reading one chunk of one file at a time."""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, mode='w', compression=compression) as archive:
+        for upload in uploads:
+            try:
+                source = upload._pdf_file.open('rb')
+            except FileNotFoundError:
+                logger.warning(f"Upload {upload.id}: PDF missing, skipped from export")
+                continue
+            with source:
+                info = zipfile.ZipInfo(
+                    f'{upload.id}-{os.path.basename(upload._pdf_file.name)}',
+                    date_time=timezone.localtime(upload.timestamp).timetuple()[:6],
+                )
+                info.compress_type = compression
+                info.file_size = upload._pdf_file.size
+                with archive.open(info, mode='w') as entry:
+                    while chunk := source.read(chunk_size):
+                        entry.write(chunk)
+                        yield from _nonempty(stream.drain())
+            yield from _nonempty(stream.drain())
+    yield from _nonempty(stream.drain())
+
+
+def _nonempty(data):
+    if data:
+        yield data
+
+
+class PdfExportView(View):
+    """Stream a ZIP of completed PDFs, selected by signed ``tokens`` or an export ``token``.
+
+    ``tokens`` is a comma separated list of download tokens, as found in the
+    ``download_url`` of each upload. ``token`` comes from
+    ``ImageUpload.export_token`` and covers an email's recent uploads. Both
+    expire after PDF_DOWNLOAD_MAX_AGE seconds.
+
+    The archive is generated while it is sent, so memory use does not depend
+    on its size. Pass ``compression=deflate`` to compress entries; the
+    default stores them as is, since PDF images are already compressed.
+    """
+
+    def get(self, request):
+        uploads = ImageUpload.objects.filter(
+            status=ImageUpload.Status.COMPLETED,
+            _pdf_file__gt='',
+        )
+        try:
+            if request.GET.get('tokens'):
+                ids = [
+                    signing.loads(token, salt=ImageUpload.DOWNLOAD_SALT, max_age=settings.PDF_DOWNLOAD_MAX_AGE)
+                    for token in request.GET['tokens'].split(',')[:settings.EXPORT_MAX_FILES]
+                ]
+                uploads = uploads.filter(id__in=ids)
+            elif request.GET.get('token'):
+                selection = signing.loads(request.GET['token'], salt=ImageUpload.EXPORT_SALT,
+                                          max_age=settings.PDF_DOWNLOAD_MAX_AGE)
+                minutes = min(selection['minutes'], settings.EXPORT_MAX_MINUTES)
+                uploads = uploads.filter(
+                    email=selection['email'],
+                    timestamp__gte=timezone.now() - timedelta(minutes=minutes),
+                )
+            else:
+                return HttpResponse('Pass tokens or token', status=status.HTTP_400_BAD_REQUEST)
+        except signing.SignatureExpired:
+            return HttpResponse('Export link has expired', status=status.HTTP_410_GONE)
+        except signing.BadSignature:
+            raise Http404('Export not found')
+
+        uploads = uploads.only('id', 'timestamp', '_pdf_file')[:settings.EXPORT_MAX_FILES]
+        if not uploads.exists():
+            raise Http404('No completed uploads found')
+
+        compression = zipfile.ZIP_DEFLATED if request.GET.get('compression') == 'deflate' else zipfile.ZIP_STORED
+        response = StreamingHttpResponse(
+            _zip_uploads(uploads.iterator(), compression),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = 'attachment; filename="pdfs.zip"'
+        return response
@@ -0,0 +1,191 @@
+"""Completion webhooks: a signed JSON POST to an upload's ``callback_url``.
+
+Requests go through one keep-alive connection pool per process, with at most
+WEBHOOK_MAX_PER_HOST requests in flight to any one host. The deliver_webhook
+task retries failed deliveries with exponential backoff and records a
+WebhookDeadLetter once the retries run out.
+
+Receivers verify the ``X-Jpgtopdf-Signature: t=<unix time>,v1=<hex>`` header
+by computing HMAC-SHA256 over ``b'<t>.' + body`` with WEBHOOK_SECRET.
+
+Callback hosts are resolved when a connection is opened, and addresses that
+are not globally routable (loopback, private, link-local, ...) are refused
+unless WEBHOOK_ALLOW_PRIVATE is set, so uploads cannot make the workers
+reach internal services.
+"""
+from django.conf import settings
+from collections import defaultdict
+from urllib.parse import urlsplit
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+SIGNATURE_HEADER = 'X-Jpgtopdf-Signature'
+EVENT = 'upload.finished'
+# Client errors worth retrying; every 5xx is retried too
+RETRY_STATUSES = {408, 425, 429}
+
+
+class DeliveryError(Exception):
+    """Raised when a callback was not accepted; ``retry`` tells whether trying again may help."""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+def payload(upload):
+    """JSON-serializable body of the completion webhook of ``upload``."""
+    download_url = None
+    if upload._pdf_file:
+        download_url = settings.PUBLIC_BASE_URL.rstrip('/') + upload.get_download_url()
+    return {
+        'event': EVENT,
+        'id': upload.id,
+        'status': upload.status,
+        'error_message': upload.error_message,
+        'download_url': download_url,
+        'timestamp': upload.timestamp.isoformat(),
+    }
+
+
+def encode(data):
+    return json.dumps(data, separators=(',', ':'), sort_keys=True).encode()
+
+
+def sign(body, timestamp):
+    """Value of the signature header for ``body`` sent at ``timestamp``."""
+    secret = (settings.WEBHOOK_SECRET or settings.SECRET_KEY).encode()
+    digest = hmac.new(secret, f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+def backoff(retries):
+    """Seconds to wait before retry number ``retries + 1``, doubling up to WEBHOOK_BACKOFF_MAX with jitter."""
+    delay = min(settings.WEBHOOK_BACKOFF_MAX, settings.WEBHOOK_BACKOFF_SECONDS * 2 ** retries)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def resolve(host, port):
+    """Return a (host, port) address for ``host`` that is allowed as a callback target.
+
+    Every address the name resolves to must be public, so a name cannot mix
+    a public address with an internal one.
+    """
+    addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    if not settings.WEBHOOK_ALLOW_PRIVATE:
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split('%')[0])
+            if ip.version == 6 and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                raise DeliveryError(f'{host} resolves to non-public address {address}', retry=False)
+    return addresses[0], port
+
+
+def _create_connection(address, *args, **kwargs):
+    """socket.create_connection to the vetted address, used by pooled connections.
+
+    Connecting to the address that was checked, instead of letting the socket
+    resolve the name again, keeps a second DNS answer from bypassing the check.
+    TLS still verifies the certificate against the host name.
+    """
+    return socket.create_connection(resolve(*address), *args, **kwargs)
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared by the threads of a process.
+
+    Each (scheme, host, port) gets at most ``max_per_host`` requests in flight;
+    further requests wait up to ``timeout`` seconds for a slot.
+    """
+
+    def __init__(self, max_per_host, timeout):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._idle = defaultdict(list)
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _checkout(self, key):
+        """Return (connection, reused), preferring an idle keep-alive connection."""
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop(), True
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(host, port, timeout=self.timeout)
+        connection._create_connection = _create_connection
+        return connection, False
+
+    def post(self, url, body, headers):
+        """POST ``body`` to ``url`` and return (status, response body)."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        slot = self._slot(key)
+        if not slot.acquire(timeout=self.timeout):
+            raise DeliveryError(f'Too many deliveries in flight to {parts.hostname}')
+        try:
+            while True:
+                connection, reused = self._checkout(key)
+                try:
+                    connection.request('POST', path, body, headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    if reused:
+                        # The server may have closed the idle connection; retry on a new one
+                        continue
+                    raise
+                break
+            if response.will_close:
+                connection.close()
+            else:
+                with self._lock:
+                    self._idle[key].append(connection)
+            return response.status, data
+        finally:
+            slot.release()
+
+
+_pool = None
+
+
+def connection_pool():
+    """The pool of the current process, created after fork so children never share sockets."""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        _pool = ConnectionPool(settings.WEBHOOK_MAX_PER_HOST, settings.WEBHOOK_TIMEOUT)
+    return _pool
+
+
+def deliver(url, body):
+    """POST a signed ``body`` to ``url``, raising DeliveryError unless it gets a 2xx response."""
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'jpgtopdf-webhooks',
+        SIGNATURE_HEADER: sign(body, int(time.time())),
+    }
+    try:
+        status, _ = connection_pool().post(url, body, headers)
+    except (OSError, http.client.HTTPException) as e:
+        raise DeliveryError(f'{type(e).__name__}: {e}')
+    if not 200 <= status < 300:
+        raise DeliveryError(f'HTTP {status}', retry=status >= 500 or status in RETRY_STATUSES)
+    return status
@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_init, worker_process_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jpgtopdf.settings')
@@ -24,4 +25,37 @@ app.conf.beat_schedule = {
         'task': 'converter.tasks.cleanup_old_files',
         'schedule': 60.0,  # Run every minute
     },
-} 
\ No newline at end of file
+    'purge-old-uploads': {
+        'task': 'converter.tasks.purge_old_uploads',
+        'schedule': crontab(hour=3, minute=0),  # Run daily at 03:00
+    },
+    'reconcile-upload-files': {
+        'task': 'converter.tasks.reconcile_upload_files',
+        'schedule': crontab(hour=3, minute=30),  # Run daily at 03:30
+    },
+} 
+
+
+@worker_init.connect
+def start_metrics_server(sender=None, **kwargs):
+    """Serve worker metrics on METRICS_WORKER_PORT when the worker runs apart from the web app.
+
+    The server runs in the main process. Prefork pool processes record their
+    samples in their own memory, so with that pool the port needs
+    PROMETHEUS_MULTIPROC_DIR to serve anything but empty histograms.
+    """
+    from django.conf import settings
+    if settings.METRICS_WORKER_PORT:
+        from django.core.exceptions import ImproperlyConfigured
+        from prometheus_client import start_http_server
+        from converter.metrics import MULTIPROCESS, registry
+        if not MULTIPROCESS and sender is not None and sender.pool_cls.__module__ == 'celery.concurrency.prefork':
+            raise ImproperlyConfigured('METRICS_WORKER_PORT with the prefork pool requires PROMETHEUS_MULTIPROC_DIR')
+        start_http_server(settings.METRICS_WORKER_PORT, registry=registry())
+
+
+@worker_process_init.connect
+def warm_up_conversion(**kwargs):
+    """Load Pillow's codecs once in each new pool process instead of during its first task."""
+    from converter.conversion import warm_up
+    warm_up()
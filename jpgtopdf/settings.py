@@ -126,6 +126,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For development
 DEFAULT_FROM_EMAIL = 'noreply@jannisjpgtopdf.com'
 EMAIL_SUBJECT_PREFIX = '[JPGtoPDF] '
+EMAIL_MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024  # Further PDFs of a message are sent as download links
+# Digest mode: PDFs for the same address wait up to EMAIL_DIGEST_SECONDS and go
+# out in one message (0 sends one email per upload). Keep it well below
+# FILE_CLEANUP_MINUTES so the PDFs still exist when the digest is sent.
+EMAIL_DIGEST_SECONDS = int(os.getenv('EMAIL_DIGEST_SECONDS', '0'))
+EMAIL_DIGEST_MAX_UPLOADS = 10  # A digest is sent early once this many PDFs are waiting
+EMAIL_DIGEST_CLAIM_SECONDS = 300  # PDFs claimed by a digest that died are queued again after this long
 
 # Media files configuration
 MEDIA_URL = '/media/'
@@ -135,10 +142,102 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 for dir_path in ['uploads/jpg', 'uploads/pdf']:
     os.makedirs(os.path.join(MEDIA_ROOT, dir_path), exist_ok=True)
 
+# Tests write their uploads to a temporary MEDIA_ROOT that is removed afterwards
+TEST_RUNNER = 'jpgtopdf.test_runner.TempMediaRunner'
+
+# Storage for uploads and PDFs: 'filesystem' (MEDIA_ROOT) or 'ephemeral'.
+# Ephemeral storage keeps files on a tmpfs mounted at EPHEMERAL_STORAGE_ROOT, e.g.
+#   mount -t tmpfs -o size=512m tmpfs media/ephemeral
+# and writes to MEDIA_ROOT when it stays full for EPHEMERAL_STORAGE_ADMISSION_WAIT seconds.
+UPLOAD_STORAGE = os.getenv('UPLOAD_STORAGE', 'filesystem')
+EPHEMERAL_STORAGE_ROOT = os.path.join(MEDIA_ROOT, 'ephemeral')
+EPHEMERAL_STORAGE_MAX_BYTES = int(os.getenv('EPHEMERAL_STORAGE_MAX_BYTES', '0')) or None  # Cap below the mount size
+EPHEMERAL_STORAGE_ADMISSION_WAIT = 0.5
+
+# Repeated uploads with the same Idempotency-Key header get the first response back for this long
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# A key whose first request died (worker killed, timed out) can be claimed again after
+# this long; keep it above the web server's request timeout
+IDEMPOTENCY_LEASE_SECONDS = 60
+
+# Transactional outbox: uploads write their processing task to the outbox in
+# the same transaction and `manage.py relay_outbox` publishes it, so uploads
+# don't wait on the broker. Off publishes directly from the request.
+UPLOAD_OUTBOX = os.getenv('UPLOAD_OUTBOX', '') == '1'
+OUTBOX_BATCH_SIZE = 100  # Messages published per relay round
+OUTBOX_POLL_INTERVAL = 0.2  # Seconds the relay sleeps when the outbox is empty
+OUTBOX_CLAIM_SECONDS = 60  # Messages claimed by a relay that died are published again after this long
+OUTBOX_RETENTION_HOURS = 24  # Sent messages are purged after this long
+
+# Celery results: only process_image_upload stores one (an Outcome value), the
+# sweeps ignore theirs. Nothing reads them back, so they expire quickly.
+CELERY_RESULT_EXPIRES = 15 * 60
+
+# Completion webhooks, POSTed to an upload's callback_url when it completes or fails
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # HMAC key of the signature header, SECRET_KEY when empty
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '')  # Prefix of the download_url in payloads, e.g. https://example.com
+WEBHOOK_TIMEOUT = 5  # Seconds for connecting, each read, and waiting for a free per-host slot
+WEBHOOK_MAX_PER_HOST = 4  # Requests in flight to one host from each worker process
+WEBHOOK_MAX_RETRIES = 8  # Retries before a delivery is dead-lettered
+WEBHOOK_BACKOFF_SECONDS = 10  # Delay before the first retry, doubled for each further one
+WEBHOOK_BACKOFF_MAX = 60 * 60
+# Deliver to loopback, private and link-local addresses, for tests and local receivers only
+WEBHOOK_ALLOW_PRIVATE = os.getenv('WEBHOOK_ALLOW_PRIVATE', '') == '1'
+
+# Use the async upload and status views, set by jpgtopdf/asgi.py
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '') == '1'
+
 # File cleanup settings
 FILE_CLEANUP_MINUTES = 5
 PENDING_TIMEOUT_SECONDS = 10
 
+# Retention settings
+UPLOAD_RETENTION_DAYS = 30  # Upload rows are deleted this long after the upload
+FAILED_UPLOAD_RETENTION_DAYS = 90  # FAILED rows are kept longer for inspection and reprocessing
+PURGE_CHUNK_SIZE = 500  # Rows deleted (and files checked) per query
+PURGE_CHUNK_SLEEP = 0.1  # Seconds to pause between chunks so the write lock is released
+ORPHAN_MIN_AGE_MINUTES = 60  # Unreferenced upload files younger than this are kept
+
+# Reprocessing of failed uploads (reprocess_failed command and admin action)
+REPROCESS_BATCH_SIZE = 100  # Uploads enqueued per Celery group
+REPROCESS_RATE = 10.0  # Uploads per second the batches are spread over
+
+# Conversion settings
+MAX_PDF_PAGES = 500  # Multi-frame TIFF/GIF inputs with more frames are rejected
+PDF_SPOOL_MAX_MEMORY = 5 * 1024 * 1024  # Larger PDFs are buffered in a temporary file
+PDF_BACKGROUND_COLOR = '#ffffff'  # Fill colour for transparent areas
+PDF_SIZE_SEARCH_MAX_ITERATIONS = 6  # Encodes tried at most when fitting a PDF into max_pdf_bytes
+# Threads encoding the pages of one multi-frame upload. Each Celery pool
+# process runs its own, so keep threads x worker concurrency near the core count.
+PDF_ENCODE_THREADS = int(os.getenv('PDF_ENCODE_THREADS', '1'))
+PDF_PAGES_IN_FLIGHT = 2 * PDF_ENCODE_THREADS  # Decoded pages held in memory at once
+
+# Download settings
+PDF_DOWNLOAD_MAX_AGE = 60 * 60  # Signed download links expire after this many seconds
+# Hand PDF bodies to the front proxy: 'X-Sendfile' (Apache, lighttpd) or
+# 'X-Accel-Redirect' (nginx, with PDF_SENDFILE_PREFIX as an internal location
+# aliased to MEDIA_ROOT). Leave empty to stream through Django.
+PDF_SENDFILE_HEADER = os.getenv('PDF_SENDFILE_HEADER', '')
+PDF_SENDFILE_PREFIX = '/protected-media/'
+EXPORT_MAX_FILES = 500  # Most PDFs included in one ZIP export
+EXPORT_MAX_MINUTES = 24 * 60  # Longest window an email export token may cover
+
+# Admin settings
+ADMIN_COUNT_LIMIT = 10000  # Filtered change lists count at most this many rows
+ADMIN_DASHBOARD_CACHE_SECONDS = 5  # How long the upload dashboard's aggregate is reused
+
+# Profiling settings
+# Share of uploads whose conversion runs under cProfile and tracemalloc, e.g. 0.01.
+# Single uploads can be profiled with the upload's `profile` flag instead.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILE_MAX_FILES = 200  # Oldest profile dumps are deleted beyond this
+
+# Metrics settings
+# /metrics on the web app covers every process sharing PROMETHEUS_MULTIPROC_DIR.
+# Workers on other hosts can serve their own metrics on this port instead.
+METRICS_WORKER_PORT = int(os.getenv('METRICS_WORKER_PORT', '0')) or None
+
 # Import sensitive settings from local settings file
 try:
     from .settings_local import *
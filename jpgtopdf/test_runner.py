@@ -0,0 +1,23 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+import os
+import shutil
+import tempfile
+
+
+class TempMediaRunner(DiscoverRunner):
+    """Run the tests with MEDIA_ROOT in a temporary directory that is removed afterwards."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.media_root = tempfile.mkdtemp(prefix='jpgtopdf-media-')
+        self.media_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            EPHEMERAL_STORAGE_ROOT=os.path.join(self.media_root, 'ephemeral'),
+        )
+        self.media_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.media_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)